@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Motore di backtest delle regole dell'EA (EA_PRO.mq5) su barre M1.
+
+Tre passi, tutti vettoriali tranne l'ultimo (che gira solo sui trade):
+  1. segnali: predizione > buy & bias long → BUY, < sell & bias short → SELL,
+     solo in sessione; bias = Close M15 sopra/sotto la MA200 M15, usando
+     solo barre M15 già chiuse alla chiusura della barra M1 di segnale
+  2. uscite: per ogni segnale, primo tocco di TP / SL / trailing stop sulle
+     `max_bars` barre successive; i trade risolti escono dal set attivo.
+     TP e SL usano il primo tocco di etl.labeling (_first_reach sui livelli
+     di label_row, a parità di barra vince il TP), il trailing si aggiunge
+     sopra; con trail=0 e direzione long le uscite coincidono con
+     triple_barrier (controllo in bench/run_bench.py)
+  3. selezione: una posizione alla volta (il segnale successivo si apre
+     dopo l'uscita) + equity guard giornaliera; il ciclo salta da un trade
+     al successivo con searchsorted, costo ∝ numero di trade
+
+Trailing stop (trail = frazione del TP, es. 0.5): si attiva quando il
+guadagno massimo visto fino alla barra precedente raggiunge trail × TP, poi
+segue quel massimo alla stessa distanza. Stop con gap: fill all'Open.
+Nessun tocco entro max_bars → chiusura al Close dell'ultima barra.
+"""
+
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+
+from etl.labeling import SWEEP_BLOCK_ELEMS, _first_reach
+
+EXIT_TP, EXIT_STOP, EXIT_TIME = 1, -1, 0
+
+# ~8 matrici (trade × larghezza finestra) float64 vive per blocco
+BLOCK_ELEMS = SWEEP_BLOCK_ELEMS // 4
+FIRST_WINDOW = 16       # barre della prima finestra, poi raddoppia
+
+
+class Exits(NamedTuple):
+    index:  np.ndarray  # int64  : barra di uscita
+    ret:    np.ndarray  # float64: rendimento del trade (frazione del prezzo, con segno)
+    reason: np.ndarray  # int8   : EXIT_TP / EXIT_STOP / EXIT_TIME
+
+
+# ────────────────────────────────
+# 1️⃣  Filtri: bias M15 + sessione
+# ────────────────────────────────
+def trend_bias(times: pd.DatetimeIndex, close: np.ndarray, ma: int = 200,
+               tf: str = "15min", bar: str = "1min") -> np.ndarray:
+    """+1 / -1 / 0 per barra: Close del timeframe `tf` sopra/sotto la sua MA.
+
+    La barra tf [T, T+tf) è nota solo dalla sua chiusura: la barra M1 che
+    apre in t (chiude in t + bar) vede le barre tf chiuse entro t + bar.
+    """
+    s = pd.Series(close, index=times)
+    htf = s.resample(tf, label="right", closed="left").last().dropna()
+    ma_s = htf.rolling(ma, min_periods=ma).mean()
+    side = np.sign(htf - ma_s).fillna(0).astype(np.int8)
+    pos = side.index.searchsorted(times + pd.Timedelta(bar), side="right") - 1
+    out = np.zeros(len(times), dtype=np.int8)
+    ok = pos >= 0
+    out[ok] = side.to_numpy()[pos[ok]]
+    return out
+
+
+def session_mask(times: pd.DatetimeIndex, start_hour: int, end_hour: int) -> np.ndarray:
+    """Barre con ora in [start_hour, end_hour) (es. 7–21 = Londra + New York)."""
+    h = times.hour
+    if start_hour <= end_hour:
+        return np.asarray((h >= start_hour) & (h < end_hour))
+    return np.asarray((h >= start_hour) | (h < end_hour))   # sessione a cavallo di mezzanotte
+
+
+def signals(pred: np.ndarray, bias: np.ndarray, session: np.ndarray,
+            buy: float, sell: float) -> np.ndarray:
+    """+1 BUY / -1 SELL / 0 per barra (pred NaN → nessun segnale)."""
+    long_ = (pred > buy) & (bias > 0) & session
+    short = (pred < sell) & (bias < 0) & session
+    return long_.astype(np.int8) - short.astype(np.int8)
+
+
+# ────────────────────────────────
+# 2️⃣  Uscite vettoriali
+# ────────────────────────────────
+def _first_true(m: np.ndarray) -> np.ndarray:
+    """Indice della prima colonna True per riga (ncols se nessuna)."""
+    j = m.argmax(axis=1)
+    return np.where(m[np.arange(len(m)), j], j, m.shape[1])
+
+
+def resolve_exits(o: np.ndarray, h: np.ndarray, l: np.ndarray, c: np.ndarray,
+                  entries: np.ndarray, direction: np.ndarray, tp: float, sl: float,
+                  trail: float = 0.0, max_bars: int = 1440,
+                  block_elems: int = BLOCK_ELEMS) -> Exits:
+    """Uscita di ogni trade aperto al Close di `entries` (ordinati) in `direction`.
+
+    Le barre future si esaminano a finestre di larghezza doppia (16, 32,
+    64, ...): i trade chiusi escono dal set attivo, quindi il costo è
+    proporzionale alla durata dei trade, non a trade × max_bars. Il picco
+    di guadagno (trailing) passa da una finestra alla successiva.
+    """
+    n, H = len(c), int(max_bars)
+    entries = np.asarray(entries, dtype=np.int64)
+    k = len(entries)
+    idx = np.zeros(k, dtype=np.int64)
+    ret = np.zeros(k)
+    reason = np.full(k, EXIT_TIME, dtype=np.int8)
+    if k == 0:
+        return Exits(idx, ret, reason)
+
+    # coda di H barre piatte all'ultimo Close: nessun tocco, uscita a tempo
+    pad = np.full(H, c[-1])
+    O, Hi, Lo, C = (np.r_[x, pad] for x in (o, h, l, c))
+    lng_all = np.asarray(direction) > 0
+    dir_all = np.where(lng_all, 1.0, -1.0)
+    carry = np.full(k, -np.inf)                    # guadagno massimo prima della finestra
+
+    act, j0, width = np.arange(k), 0, FIRST_WINDOW
+    while len(act) and j0 < H:
+        j1 = min(j0 + width, H)
+        cols = np.arange(j0 + 1, j1 + 1)           # offset dalla barra di entry
+        block = max(1, block_elems // len(cols))
+        still = []
+        for a in range(0, len(act), block):
+            q = act[a:a + block]
+            e = entries[q]
+            bar = e[:, None] + cols
+            lng = lng_all[q]
+            px = C[e]
+            # primo tocco TP / SL come etl.labeling: livelli di label_row sul
+            # Close di entry, running max e ricerca binaria (_first_reach); il
+            # lato short usa i livelli speculari (Low ≤ livello ⇔ -Low ≥ -livello)
+            hb, lb, lm = Hi[bar], -Lo[bar], lng[:, None]
+            xf = np.where(lm, hb, lb)                          # verso favorevole
+            xa = np.where(lm, lb, hb)                          # verso avverso
+            j_tp = _first_reach(np.maximum.accumulate(xf, axis=1),
+                                np.where(lng, px * (1 + tp), -(px * (1 - tp))))
+            j_st = _first_reach(np.maximum.accumulate(xa, axis=1),
+                                np.where(lng, -(px * (1 - sl)), px * (1 + sl)))
+            stop_d = np.broadcast_to((sl * px)[:, None], xf.shape)
+
+            if trail > 0:
+                # trailing: sempre più stretto dello SL una volta attivo e
+                # l'attivazione è monotona → uscita = primo fra SL e trailing
+                s = (dir_all[q] * px)[:, None]
+                fav, adv = xf - s, xa + s                      # escursioni dall'entry
+                tr_d = (trail * tp * px)[:, None]
+                peak = np.maximum.accumulate(np.hstack([carry[q][:, None], fav]), axis=1)
+                prev = peak[:, :-1]                # picco fino alla barra precedente
+                on = prev >= tr_d
+                stop_d = np.where(on, tr_d - prev, stop_d)
+                j_st = np.minimum(j_st, _first_true(on & (adv >= stop_d)))
+                carry[q] = peak[:, -1]
+
+            w = len(cols)
+            is_tp = (j_tp <= j_st) & (j_tp < w)    # parità di barra: prima il TP
+            is_st = ~is_tp & (j_st < w)
+            done = np.flatnonzero(is_tp | is_st)
+            still.append(q[~(is_tp | is_st)])
+            if len(done) == 0:
+                continue
+
+            jd = np.where(is_tp, j_tp, j_st)[done]
+            qd, xb, p0 = q[done], bar[done, jd], px[done]
+            open_adv = dir_all[qd] * (p0 - O[xb])
+            stop_fill = np.maximum(stop_d[done, jd], open_adv)   # gap oltre lo stop → Open
+            idx[qd] = xb
+            ret[qd] = np.where(is_tp[done], tp, -stop_fill / p0)
+            reason[qd] = np.where(is_tp[done], EXIT_TP, EXIT_STOP)
+        act = np.concatenate(still)
+        j0, width = j1, width * 2
+
+    # nessun tocco entro max_bars: chiusura al Close dell'ultima barra
+    e = entries[act]
+    idx[act] = e + H
+    ret[act] = dir_all[act] * (C[e + H] - C[e]) / C[e]
+    np.minimum(idx, n - 1, out=idx)
+    return Exits(idx, ret, reason)
+
+
+# ────────────────────────────────
+# 3️⃣  Selezione trade + equity guard
+# ────────────────────────────────
+def select_trades(entries: np.ndarray, exits: Exits, days: np.ndarray, sl: float,
+                  risk: float = 0.01, daily_stop: float = 0.03, cost: float = 0.0):
+    """Una posizione alla volta; guard: a -daily_stop sul giorno stop ai nuovi trade.
+
+    Il rischio per trade è `risk` dell'equity allo SL pieno: rendimento
+    sull'equity = risk × (ret - cost) / sl. La guard si valuta alla chiusura
+    dei trade. Ritorna (indici dei segnali eseguiti, equity dopo ogni trade).
+    """
+    k = len(entries)
+    taken, equity = [], []
+    eq, day, day_open = 1.0, None, 1.0
+    exit_days = days[np.minimum(exits.index, len(days) - 1)]
+    ent_days = days[entries]
+    i = 0
+    while i < k:
+        if ent_days[i] != day:
+            day, day_open = ent_days[i], eq
+        eq *= 1.0 + risk * (exits.ret[i] - cost) / sl
+        taken.append(i)
+        equity.append(eq)
+        x = exits.index[i]
+        if eq <= day_open * (1.0 - daily_stop):
+            i = int(np.searchsorted(ent_days, exit_days[i], side="right"))
+        else:
+            i = max(i + 1, int(np.searchsorted(entries, x, side="left")))
+    return np.asarray(taken, dtype=np.int64), np.asarray(equity)
+
+
+def summarize(entries, direction, exits: Exits, taken, equity, n_days: int,
+              risk: float, sl: float, cost: float = 0.0) -> dict:
+    """PnL, drawdown e statistiche dei trade eseguiti."""
+    n = len(taken)
+    if n == 0:
+        return dict(trades=0, trades_per_day=0.0, win_rate=0.0, total_return=0.0,
+                    max_drawdown=0.0, profit_factor=0.0, avg_bars=0.0, long=0, short=0,
+                    n_tp=0, n_stop=0, n_timeout=0)
+    r = risk * (exits.ret[taken] - cost) / sl
+    curve = np.r_[1.0, equity]
+    dd = 1.0 - curve / np.maximum.accumulate(curve)
+    gains, losses = r[r > 0].sum(), -r[r < 0].sum()
+    d = np.asarray(direction)[taken]
+    return dict(trades=n, trades_per_day=n / max(n_days, 1),
+                win_rate=float((r > 0).mean()), total_return=float(equity[-1] - 1.0),
+                max_drawdown=float(dd.max()),
+                profit_factor=float(gains / losses) if losses > 0 else float("inf"),
+                avg_bars=float((exits.index[taken] - entries[taken]).mean()),
+                long=int((d > 0).sum()), short=int((d < 0).sum()),
+                n_tp=int((exits.reason[taken] == EXIT_TP).sum()),
+                n_stop=int((exits.reason[taken] == EXIT_STOP).sum()),
+                n_timeout=int((exits.reason[taken] == EXIT_TIME).sum()))
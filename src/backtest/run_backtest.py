@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Backtest offline delle regole dell'EA sul test split.
+
+  • score del test con il modello ONNX, a batch letti da parquet (stesse
+    colonne e ordine dello spec feature, come il gateway)
+  • barre M1 dal clean parquet (con margine prima del test per la MA200
+    M15 e dopo per le uscite)
+  • griglia di parametri: prodotto di --buy --sell --tp --sl --trail
+    --max-bars; le uscite si calcolano una volta per (tp, sl, trail,
+    max_bars) sull'unione dei segnali, le soglie filtrano solo i segnali
+  • report: PnL, max drawdown, trade/giorno, win rate, profit factor per
+    combinazione → --out (CSV), ordinato per rendimento
+"""
+
+import argparse, itertools, sys, time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/ nel path
+from backtest import engine as E
+from deploy.batch_score import open_dataset, to_matrix
+from deploy.onnx_model import OnnxModel
+from etl import store
+from etl.features import load_spec
+from utils.logger import setup_logging
+from utils.profiling import profiled, lap
+
+L = setup_logging("backtest")
+
+
+# ────────────────────────────────
+# CLI
+# ────────────────────────────────
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Backtest regole EA su predizioni ONNX")
+    p.add_argument("--test",  default="data/splits/test.parquet")
+    p.add_argument("--bars",  default="data/processed/EURUSD_M1_clean.parquet",
+                   help="Barre M1 OHLC (clean.py)")
+    p.add_argument("--model", default="models/onnx/lgbm_model.onnx")
+    p.add_argument("--spec",  default="models/onnx/feature_spec.json")
+    p.add_argument("--symbol", default="EURUSD", help="Simbolo (dataset hive)")
+    p.add_argument("--batch", type=int, default=65536, help="Righe per batch ONNX")
+    p.add_argument("--buy",  type=float, nargs="+", default=[0.6], help="Soglia BUY (pred >)")
+    p.add_argument("--sell", type=float, nargs="+", default=[0.4], help="Soglia SELL (pred <)")
+    p.add_argument("--tp",   type=float, nargs="+", default=[0.001], help="TP pct")
+    p.add_argument("--sl",   type=float, nargs="+", default=[0.001], help="SL pct")
+    p.add_argument("--trail", type=float, nargs="+", default=[0.5],
+                   help="Trailing stop come frazione del TP (0 = off)")
+    p.add_argument("--max-bars", type=int, nargs="+", default=[1440],
+                   help="Barre massime in posizione")
+    p.add_argument("--ma", type=int, default=200, help="MA del trend filter")
+    p.add_argument("--bias-tf", default="15min", help="Timeframe del trend filter")
+    p.add_argument("--session", type=int, nargs=2, default=[7, 21], metavar=("START", "END"),
+                   help="Ore di sessione [START, END) nel fuso dei dati (Londra + NY)")
+    p.add_argument("--risk", type=float, default=0.01, help="Equity a rischio allo SL pieno")
+    p.add_argument("--daily-stop", type=float, default=0.03, help="Equity guard giornaliera")
+    p.add_argument("--cost", type=float, default=0.0, help="Costo per trade (pct, spread+comm.)")
+    p.add_argument("--out", default="logs/backtest.csv")
+    return p.parse_args(argv)
+
+
+# ────────────────────────────────
+# Score ONNX a batch
+# ────────────────────────────────
+def score(test: Path, model: OnnxModel, features: list, batch: int, symbol: str) -> pd.Series:
+    """P(Label=1) per barra del test, letto e scorato a batch (come batch_score.py)."""
+    dset = open_dataset(test, symbol)
+    buf = np.empty((batch, len(features)), dtype=np.float32)
+    times, preds = [], []
+    for b in dset.to_batches(columns=["time"] + features, batch_size=batch):
+        if b.num_rows == 0:
+            continue
+        preds.append(model.predict_proba(to_matrix(b, features, buf)))
+        times.append(b.column("time").to_numpy(zero_copy_only=False))
+    s = pd.Series(np.concatenate(preds), index=pd.DatetimeIndex(np.concatenate(times)))
+    return s.sort_index()
+
+
+# ────────────────────────────────
+# Main
+# ────────────────────────────────
+@profiled("backtest")
+def main(args):
+    for path in (args.test, args.model, args.spec):
+        if not Path(path).exists():
+            L.error(f"⚠️  File non trovato: {path}")
+            sys.exit(1)
+    spec = load_spec(args.spec)
+    model = OnnxModel(args.model)
+    if model.n_features != len(spec["features"]):
+        L.error(f"⚠️  Modello con {model.n_features} feature, spec con {len(spec['features'])}")
+        sys.exit(1)
+
+    t0 = time.perf_counter()
+    pred = score(Path(args.test), model, spec["features"], args.batch, args.symbol)
+    t_score = time.perf_counter() - t0
+    lap("score", rows=len(pred))
+    L.info(f"Test scorato: {len(pred):,} barre in {t_score:.2f}s "
+           f"({len(pred) / max(t_score, 1e-9):,.0f} righe/s)")
+
+    # barre: margine prima (MA del trend filter) e dopo (uscite)
+    warm = pd.Timedelta(args.bias_tf) * args.ma * 2 + pd.Timedelta(days=3)
+    tail = pd.Timedelta(minutes=max(args.max_bars) * 2) + pd.Timedelta(days=3)
+    bars = store.read(args.bars, columns=["Open", "High", "Low", "Close"], symbol=args.symbol,
+                      start=pred.index[0] - warm, end=pred.index[-1] + tail)
+    pos = bars.index.get_indexer(pred.index)
+    if (pos < 0).any():
+        L.warning(f"Barre di test senza OHLC: {(pos < 0).sum():,} → ignorate")
+    pred_bar = np.full(len(bars), np.nan)
+    pred_bar[pos[pos >= 0]] = pred.to_numpy()[pos >= 0]
+    lap("load", rows=len(bars))
+
+    t1 = time.perf_counter()
+    o, h, l, c = (bars[k].to_numpy(np.float64) for k in ("Open", "High", "Low", "Close"))
+    bias = E.trend_bias(bars.index, c, args.ma, args.bias_tf)
+    session = E.session_mask(bars.index, *args.session)
+    days = (bars.index.asi8 // 86_400_000_000_000).astype(np.int64)
+    n_days = len(np.unique(days[~np.isnan(pred_bar)]))
+    L.info(f"Barre: {len(bars):,}  giorni di test: {n_days}  "
+           f"bias long/short: {(bias > 0).mean():.0%}/{(bias < 0).mean():.0%}  "
+           f"in sessione: {session.mean():.0%}")
+
+    # unione dei segnali delle soglie più larghe: non dipende da tp/sl/trail/max_bars
+    sig = E.signals(pred_bar, bias, session, min(args.buy), max(args.sell))
+    entries = np.flatnonzero(sig)
+    side, p_ent = sig[entries], pred_bar[entries]
+
+    rows = []
+    for tp, sl, trail, mb in itertools.product(args.tp, args.sl, args.trail, args.max_bars):
+        # uscite calcolate una volta per tutte le soglie buy/sell
+        ex = E.resolve_exits(o, h, l, c, entries, side, tp, sl, trail, mb)
+        for buy, sell in itertools.product(args.buy, args.sell):
+            keep = np.flatnonzero(np.where(side > 0, p_ent > buy, p_ent < sell))
+            sub = E.Exits(*(x[keep] for x in ex))
+            taken, equity = E.select_trades(entries[keep], sub, days, sl, args.risk,
+                                            args.daily_stop, args.cost)
+            stats = E.summarize(entries[keep], side[keep], sub, taken, equity,
+                                n_days, args.risk, sl, args.cost)
+            rows.append(dict(buy=buy, sell=sell, tp=tp, sl=sl, trail=trail, max_bars=mb,
+                             signals=len(keep), **stats))
+    t_sim = time.perf_counter() - t1
+    lap("simulate", rows=len(rows))              # righe = combinazioni
+
+    res = pd.DataFrame(rows).sort_values("total_return", ascending=False)
+    Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+    res.to_csv(args.out, index=False)
+    L.info(f"Simulate {len(res)} combinazioni in {t_sim:.2f}s")
+    cols = ["buy", "sell", "tp", "sl", "trail", "trades", "trades_per_day", "win_rate",
+            "total_return", "max_drawdown", "profit_factor"]
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        L.info("\n" + res[cols].head(10).to_string(index=False, float_format="{:.4f}".format))
+    L.info(f"✅ Risultati salvati: {args.out}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
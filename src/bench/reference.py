@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Implementazioni di riferimento (lente, ovvie) per i controlli di correttezza
+del benchmark: le versioni vettoriali degli stage devono coincidere con
+queste su dati sintetici.
+
+  • label_row      → loop barra per barra dell'etichettatura originale
+                     (primo tocco TP/SL entro H barre, TP vince a parità)
+  • zscore         → z-score global / expanding / rolling con pandas
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def label_row(highs, lows, closes, i: int, tp_pct: float, sl_pct: float, H: int) -> int:
+    tp_level = closes[i] * (1 + tp_pct)
+    sl_level = closes[i] * (1 - sl_pct)
+    for h, l in zip(highs[i + 1:i + 1 + H], lows[i + 1:i + 1 + H]):
+        if h >= tp_level:
+            return 1
+        if l <= sl_level:
+            return 0
+    return 0
+
+
+def labels(highs, lows, closes, tp_pct: float, sl_pct: float, H: int, rows: int = None) -> np.ndarray:
+    """label_row sulle prime `rows` barre etichettabili (len - H)."""
+    n = max(len(closes) - H, 0) if rows is None else min(rows, max(len(closes) - H, 0))
+    return np.fromiter((label_row(highs, lows, closes, i, tp_pct, sl_pct, H) for i in range(n)),
+                       dtype=np.int64, count=n)
+
+
+def zscore(X: np.ndarray, mode: str, n_fit: int = None, window: int = 1440,
+           min_periods: int = 100) -> np.ndarray:
+    """Z-score colonna per colonna con pandas (std campionaria, ddof=1)."""
+    df = pd.DataFrame(np.asarray(X, dtype=np.float64))
+    if mode == "global":
+        fit = df.iloc[:n_fit]
+        return ((df - fit.mean()) / fit.std().replace(0.0, 1.0)).to_numpy()
+    if mode == "expanding":
+        r = df.expanding(min_periods=max(min_periods, 2))
+    else:
+        r = df.rolling(window, min_periods=window)
+    return ((df - r.mean()) / r.std()).to_numpy()
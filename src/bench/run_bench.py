@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+Benchmark riproducibile della pipeline su dati M1 sintetici (bench/synthetic.py).
+
+Per ogni taglia (--sizes 10k 100k 1M ...):
+  • CSV sintetico con seed fisso, generato una volta e riusato
+    (<workdir>/raw/<format>_seed<seed>/SYN<taglia>_M1.csv)
+  • gli stage della pipeline (stessi argv di pipeline.py) chiamati in
+    processo: wall, picco RSS, righe/s e tempi dei sotto-step dai record
+    di utils/profiling (load, compute, validate, write, ...)
+  • percorso /predict: latenza ONNX a riga singola (p50/p99), throughput
+    a batch, FeatureStream.update a barra singola (/predict_bars);
+    con --http anche il gateway vero (load_test, p50/p99 e req/s)
+  • correttezza contro le implementazioni di riferimento (bench/reference.py):
+      label      → triple_barrier vs label_row sulle prime --check-rows barre
+      exits      → backtest.engine.resolve_exits (long, trail=0) vs triple_barrier
+      normalize  → Normalizer global/expanding/rolling vs pandas
+      formats    → clean da CSV MT5 e Dukascopy degli stessi dati: stesso parquet
+      stream     → FeatureStream vs feature store batch (con --features all
+                   --norm expanding: finestre lunghe e stato di normalizzazione)
+--repeat k: ogni taglia gira k volte, si tiene il minimo per metrica.
+
+Risultati in logs/bench/<timestamp>_<git sha>.json con ambiente (sha,
+versioni, CPU); --compare confronta con il risultato precedente (o un file)
+ed esce con 1 su regressioni oltre --threshold o controlli falliti.
+
+Uso:
+  python src/bench/run_bench.py --sizes 10k 100k 1M --compare
+  python src/bench/run_bench.py --sizes 10M --stages clean label features --no-predict
+  python src/bench/run_bench.py --sizes 100k --stages clean label features --no-predict \
+      --features all --norm expanding
+"""
+
+import argparse, asyncio, importlib, json, logging, os, platform, subprocess, sys, time
+from argparse import Namespace
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/ nel path
+import pipeline
+from bench import synthetic, reference
+from backtest import engine
+from etl import features as F
+from etl import store
+from etl.labeling import triple_barrier
+from etl.normalize import Normalizer, MODES
+from utils import profiling
+from utils.logger import setup_logging
+
+L = setup_logging("bench")
+
+SRC = Path(__file__).resolve().parents[1]
+RESULTS_DIR = Path("logs/bench")
+UNITS = {"k": 1_000, "m": 1_000_000}
+
+
+def parse_size(s: str) -> int:
+    s = s.strip().lower().replace("_", "")
+    return int(float(s[:-1]) * UNITS[s[-1]]) if s[-1] in UNITS else int(s)
+
+
+def size_label(n: int) -> str:
+    for u, m in (("M", 1_000_000), ("K", 1_000)):
+        if n >= m and n % m == 0:
+            return f"{n // m}{u}"
+    return str(n)
+
+
+def pct(x: list) -> dict:
+    a = np.asarray(x) * 1000
+    return dict(p50_ms=round(float(np.percentile(a, 50)), 4),
+                p99_ms=round(float(np.percentile(a, 99)), 4))
+
+
+# ────────────────────────────────
+# 1️⃣  Stage della pipeline
+# ────────────────────────────────
+def layout(n: int, args):
+    ns = Namespace(raw_dir=str(Path(args.workdir) / "raw" / f"{args.format}_seed{args.seed}"),
+                   data_dir=str(Path(args.workdir) / "data"),
+                   models_dir=str(Path(args.workdir) / "models"),
+                   source="csv", incremental=False, threads=args.threads)
+    symbol = f"SYN{size_label(n)}"
+    return symbol, ns, pipeline.paths(symbol, ns)
+
+
+def run_stage(stage: str, symbol: str, P: dict, ns: Namespace, args, extra=()) -> dict:
+    """Uno stage in processo con gli argv di pipeline.py (+ extra): wall e picco RSS."""
+    module, argv, _, _, _ = pipeline.stage_plan(stage, symbol, P, ns)
+    if stage in ("clean", "label", "features"):
+        argv = argv + ["--quality-report", str(Path(args.workdir) / "quality" / f"{stage}_{symbol}.json")]
+    mod = importlib.import_module(module)
+    if not args.verbose:
+        mod.L.setLevel(logging.WARNING)
+    profiling.reset_peak_rss()
+    t0 = time.perf_counter()
+    try:
+        mod.main(mod.parse_args(argv + list(extra)))
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise RuntimeError(f"{stage} fallito su {symbol} (exit {e.code})")
+    return dict(secs=time.perf_counter() - t0, peak_rss_mb=profiling.peak_rss_mb())
+
+
+def stage_spans(records: list, stage: str, symbol: str) -> dict:
+    """Sotto-step dello stage dai record di profiling (secondi, righe/s)."""
+    out = {}
+    for r in records:       # i nomi di @profiled coincidono con gli stage di pipeline.py
+        if r.get("symbol") in (symbol, None) and r["stage"] == stage and r["span"] != "total":
+            out[r["span"]] = dict(secs=r["secs"], rows_per_s=r.get("rows_per_s"))
+    return out
+
+
+# ────────────────────────────────
+# 2️⃣  Percorso /predict
+# ────────────────────────────────
+def bench_predict(P: dict, args) -> dict:
+    from deploy.onnx_model import OnnxModel
+    from deploy.streaming import FeatureStream
+
+    test = pd.read_parquet(P["splits"] / "test.parquet")
+    spec = F.load_spec(P["onnx"].parent / "feature_spec.json")
+    X = test[spec["features"]].to_numpy(np.float32)
+    model = OnnxModel(P["onnx"], intra_threads=1)
+    out = dict(features=len(spec["features"]), rows=len(X))
+
+    lat = []
+    for i in range(min(args.predict_calls, len(X))):
+        t0 = time.perf_counter()
+        model.predict_proba(X[i:i + 1])
+        lat.append(time.perf_counter() - t0)
+    out["single"] = pct(lat)
+
+    t0 = time.perf_counter()
+    for a in range(0, len(X), args.predict_batch):
+        model.predict_proba(X[a:a + args.predict_batch])
+    out["batch_rows_per_s"] = round(len(X) / max(time.perf_counter() - t0, 1e-9), 1)
+
+    # /predict_bars: una barra per chiamata dopo la storia di warm-up
+    clean = store.read(P["clean"])
+    times, bars = clean.index.asi8, clean[F.INPUTS].to_numpy(np.float64)
+    fs = FeatureStream(spec)
+    k = max(fs.lookback, 1)
+    fs.update("S", times[:k], bars[:k])
+    lat = []
+    for i in range(k, min(k + args.predict_calls, len(bars))):
+        t0 = time.perf_counter()
+        model.predict_proba(fs.update("S", times[i:i + 1], bars[i:i + 1]))
+        lat.append(time.perf_counter() - t0)
+    out["bars"] = pct(lat) if lat else {}
+
+    if args.http:
+        out["http"] = bench_http(P, len(spec["features"]), args)
+    return out
+
+
+def bench_http(P: dict, n_features: int, args) -> dict:
+    from deploy import load_test
+    url = f"http://127.0.0.1:{args.port}/predict"
+    gw = SRC / "deploy" / "fastapi_gateway.py"
+    proc = subprocess.Popen([sys.executable, str(gw), "--port", str(args.port),
+                             "--model", str(P["onnx"]), "--spec", str(P["onnx"].parent / "feature_spec.json"),
+                             "--pred-log", str(Path(args.workdir) / "pred_log.csv")],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        load_test.wait_ready(url)
+        asyncio.run(load_test.run(url, 200, args.concurrency, n_features))
+        lat, wall = asyncio.run(load_test.run(url, args.http_requests, args.concurrency, n_features))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    p50, p99 = np.percentile(lat, [50, 99])
+    return dict(p50_ms=round(float(p50), 4), p99_ms=round(float(p99), 4),
+                req_per_s=round(len(lat) / wall, 1), concurrency=args.concurrency)
+
+
+# ────────────────────────────────
+# 3️⃣  Correttezza vs riferimento
+# ────────────────────────────────
+def check_labels(P: dict, args) -> dict:
+    lab = store.read(P["labeled"], columns=["Label"])["Label"].to_numpy()
+    clean = store.read(P["clean"])
+    h, l, c = (clean[x].to_numpy(np.float64) for x in ("High", "Low", "Close"))
+    ref = reference.labels(h, l, c, args.tp, args.sl, args.horizon, args.check_rows)
+    got = triple_barrier(h, l, c, args.tp, args.sl, args.horizon).label[:len(ref)]
+    bad = int(np.count_nonzero(got != ref)) + int(np.count_nonzero(lab[:len(ref)] != ref))
+    return dict(rows=len(ref), mismatches=bad, ok=bad == 0)
+
+
+def check_exits(P: dict, args) -> dict:
+    """Uscite del backtest senza trailing = primo tocco di triple_barrier."""
+    clean = store.read(P["clean"])
+    o, h, l, c = (clean[x].to_numpy(np.float64) for x in ("Open", "High", "Low", "Close"))
+    ref = triple_barrier(h, l, c, args.tp, args.sl, args.horizon)
+    n = min(len(ref.label), args.check_rows)
+    entries = np.arange(n)
+    ex = engine.resolve_exits(o, h, l, c, entries, np.ones(n, dtype=np.int8), args.tp, args.sl,
+                              trail=0.0, max_bars=args.horizon)
+    off = np.where(ref.barrier[:n] != 0, ref.offset[:n], args.horizon)
+    bad = int(np.count_nonzero((ex.reason != ref.barrier[:n]) | (ex.index - entries != off)))
+    return dict(rows=n, mismatches=bad, ok=bad == 0)
+
+
+def check_normalize(args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    n = min(args.check_rows, 20_000)
+    X = np.cumsum(rng.normal(size=(n, 6)), axis=0) * [1e-4, 1e-2, 1, 10, 1e3, 1e5] + [1.1, 0, 50, 0, 1e4, 0]
+    out = {}
+    for mode in MODES:
+        norm = Normalizer(range(6), mode, window=500, min_periods=100)
+        norm.fit(X[:n // 2])
+        got = np.vstack([norm.transform(X[a:a + 1777]) for a in range(0, n, 1777)])
+        ref = reference.zscore(X, mode, n_fit=n // 2, window=500, min_periods=100)
+        nan_ok = bool(np.array_equal(np.isnan(got), np.isnan(ref)))
+        m = np.isfinite(ref)
+        err = float(np.max(np.abs(got[m] - ref[m]))) if m.any() else 0.0
+        out[mode] = dict(max_abs=err, nan_ok=nan_ok, ok=nan_ok and err <= args.tol)
+    return dict(rows=n, modes=out, ok=all(v["ok"] for v in out.values()))
+
+
+def check_formats(n: int, args) -> dict:
+    """Stessi dati in formato MT5 e Dukascopy → stesso clean parquet."""
+    clean = importlib.import_module("etl.clean")
+    clean.L.setLevel(logging.WARNING)
+    rows = min(n, args.check_rows)
+    root = Path(args.workdir) / "formats"
+    outs = {}
+    for fmt in synthetic.FORMATS:
+        csv = synthetic.ensure_csv(root / f"{fmt}_seed{args.seed}_{rows}.csv", rows, fmt, args.seed)
+        out = root / f"{fmt}_{rows}.parquet"
+        clean.main(clean.parse_args(["--input", str(csv), "--output", str(out), "--symbol", "SYNFMT",
+                                     "--state", str(root / "state.json"),
+                                     "--quality-report", str(root / f"quality_{fmt}.json")]))
+        outs[fmt] = store.read(out)
+    a, b = outs["mt5"], outs["dukascopy"]
+    cols = [c for c in a.columns if c in b.columns]
+    same = (a.index.equals(b.index) and cols == list(a.columns)
+            and all(np.array_equal(a[c].to_numpy(np.float64), b[c].to_numpy(np.float64)) for c in cols))
+    return dict(rows=len(a), ok=bool(same))
+
+
+def check_stream(P: dict, args) -> dict:
+    spec = F.load_spec(P["spec"])
+    feats = store.read(P["features"])
+    clean = store.read(P["clean"])
+    from deploy.streaming import FeatureStream
+    # global: nessuno stato fra barre oltre al lookback → basta la coda;
+    # expanding/rolling: tutta la serie da zero, senza lo stato di fine storia
+    # dello spec (altrimenti la storia verrebbe contata due volte)
+    if spec["norm"]["mode"] != "global":
+        spec = dict(spec, norm={k: v for k, v in spec["norm"].items() if k != "state"})
+    fs = FeatureStream(spec)
+    start = 0
+    if spec["norm"]["mode"] == "global":
+        start = max(len(clean) - args.check_rows - fs.lookback, 0)
+    times, bars = clean.index.asi8[start:], clean[F.INPUTS].to_numpy(np.float64)[start:]
+    sym = spec.get("symbol", "S")
+    X = np.vstack([fs.update(sym, times[a:a + 997], bars[a:a + 997]) for a in range(0, len(bars), 997)])
+    got = pd.DataFrame(X, index=clean.index[start:], columns=spec["features"])
+    idx = feats.index[feats.index.isin(got.index)][-args.check_rows:]
+    g, r = got.loc[idx].to_numpy(), feats.loc[idx, spec["features"]].to_numpy(np.float32)
+    d = np.abs(g.astype(np.float64) - r)
+    return dict(rows=len(idx), max_abs=float(np.nanmax(d)) if len(idx) else 0.0,
+                exact=bool(np.array_equal(g, r, equal_nan=True)),
+                ok=bool(len(idx) and np.nanmax(d) <= args.tol))
+
+
+# ────────────────────────────────
+# 4️⃣  Risultati e confronto
+# ────────────────────────────────
+def environment() -> dict:
+    def git(*a):
+        try:
+            return subprocess.run(["git", *a], cwd=SRC, capture_output=True, text=True,
+                                  timeout=30).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+    versions = {}
+    for name in ("numpy", "pandas", "pyarrow", "lightgbm", "onnxruntime"):
+        try:
+            versions[name] = importlib.import_module(name).__version__
+        except ImportError:
+            versions[name] = None
+    return dict(git=git("rev-parse", "--short", "HEAD") or "nogit",
+                dirty=bool(git("status", "--porcelain", "--untracked-files=no")),
+                python=platform.python_version(), host=platform.node(),
+                cpu=platform.processor() or platform.machine(), cpus=os.cpu_count(), **versions)
+
+
+def flatten(res: dict) -> dict:
+    """Metriche confrontabili: (taglia/stage/metrica) → valore, più alto = peggio."""
+    out = {}
+    for size, r in res["sizes"].items():
+        for st, m in r["stages"].items():
+            out[f"{size}/{st}/secs"] = m["secs"]
+            out[f"{size}/{st}/peak_rss_mb"] = m["peak_rss_mb"]
+            for sp, s in m.get("spans", {}).items():
+                out[f"{size}/{st}.{sp}/secs"] = s["secs"]
+        p = r.get("predict") or {}
+        for k in ("single", "bars", "http"):
+            for q in ("p50_ms", "p99_ms"):
+                if q in p.get(k, {}):
+                    out[f"{size}/predict.{k}/{q}"] = p[k][q]
+    return out
+
+
+def compare(base: dict, new: dict, threshold: float, min_secs: float) -> list:
+    a, b = flatten(base), flatten(new)
+    rows = []
+    for k in (k for k in a if k in b):
+        unit = k.rsplit("/", 1)[1]
+        floor = min_secs if unit == "secs" else (min_secs * 1000 if unit.endswith("_ms") else 50.0)
+        ratio = b[k] / a[k] if a[k] > 0 else float("inf")
+        rows.append(dict(metric=k, base=a[k], new=b[k], ratio=ratio,
+                         regression=ratio > 1 + threshold and max(a[k], b[k]) >= floor))
+    return rows
+
+
+def previous_result(current: Path = None):
+    files = sorted(p for p in RESULTS_DIR.glob("*.json") if p != current)
+    return files[-1] if files else None
+
+
+def print_table(res: dict):
+    L.info(f"{'size':>6} {'stage':<10}{'secs':>9}{'righe/s':>13}{'RSS MB':>9}  sotto-step")
+    for size, r in res["sizes"].items():
+        for st, m in r["stages"].items():
+            spans = "  ".join(f"{k} {v['secs']:.2f}" for k, v in m.get("spans", {}).items())
+            L.info(f"{size:>6} {st:<10}{m['secs']:9.2f}{r['bars'] / max(m['secs'], 1e-9):13,.0f}"
+                   f"{m['peak_rss_mb']:9,.0f}  {spans}")
+        p = r.get("predict")
+        if p:
+            line = (f"{size:>6} predict   riga p50 {p['single']['p50_ms']:.3f} ms p99 "
+                    f"{p['single']['p99_ms']:.3f} ms  batch {p['batch_rows_per_s']:,.0f} righe/s")
+            if p.get("bars"):
+                line += f"  barra p50 {p['bars']['p50_ms']:.3f} ms p99 {p['bars']['p99_ms']:.3f} ms"
+            if p.get("http"):
+                h = p["http"]
+                line += f"  http p50 {h['p50_ms']:.2f} ms p99 {h['p99_ms']:.2f} ms {h['req_per_s']:,.0f} req/s"
+            L.info(line)
+        for name, c in r.get("checks", {}).items():
+            L.info(f"{size:>6} check {name:<10}{'✅' if c['ok'] else '❌'} "
+                   f"{ {k: v for k, v in c.items() if k not in ('ok', 'modes')} }")
+
+
+# ────────────────────────────────
+# 5️⃣  Main
+# ────────────────────────────────
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark pipeline + /predict su dati sintetici")
+    p.add_argument("--sizes", nargs="+", default=["10k", "100k", "1M"],
+                   help="Barre per taglia (10k, 1M, 10M ...)")
+    p.add_argument("--stages", nargs="+", choices=pipeline.STAGES, default=list(pipeline.STAGES))
+    p.add_argument("--format", choices=synthetic.FORMATS, default="mt5", help="Formato CSV sorgente")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--repeat", type=int, default=1, help="Ripetizioni (si tiene il minimo)")
+    p.add_argument("--workdir", default="data/bench", help="CSV, parquet e modelli del benchmark")
+    p.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="Thread LightGBM")
+    p.add_argument("--no-predict", dest="predict", action="store_false", help="Salta /predict")
+    p.add_argument("--predict-calls", type=int, default=2000, help="Chiamate a riga/barra singola")
+    p.add_argument("--predict-batch", type=int, default=4096)
+    p.add_argument("--http", action="store_true", help="Anche il gateway HTTP (load_test)")
+    p.add_argument("--http-requests", type=int, default=3000)
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--no-checks", dest="checks", action="store_false", help="Salta i controlli")
+    p.add_argument("--check-rows", type=int, default=50_000, help="Righe confrontate col riferimento")
+    p.add_argument("--tol", type=float, default=1e-6, help="Differenza massima ammessa (checks)")
+    p.add_argument("--tp", type=float, default=0.001, help="Come label.py")
+    p.add_argument("--sl", type=float, default=0.001, help="Come label.py")
+    p.add_argument("--horizon", type=int, default=20, help="Come label.py")
+    p.add_argument("--features", nargs="+", default=None,
+                   help="Come feature_engineering.py (es. all; default: quelle di default)")
+    p.add_argument("--norm", choices=MODES, default=None,
+                   help="Come feature_engineering.py (expanding/rolling: controllo stream con stato)")
+    p.add_argument("--out", default=None, help="File risultati (default logs/bench/<ts>_<sha>.json)")
+    p.add_argument("--compare", nargs="?", const="prev", default=None, metavar="FILE",
+                   help="Confronta con FILE (default: risultato precedente in logs/bench)")
+    p.add_argument("--threshold", type=float, default=0.2, help="Peggioramento tollerato (0.2 = +20%%)")
+    p.add_argument("--min-secs", type=float, default=0.05, help="Ignora metriche più brevi")
+    p.add_argument("--verbose", action="store_true", help="Log completi degli stage")
+    return p.parse_args(argv)
+
+
+def bench_size(n: int, args) -> dict:
+    symbol, ns, P = layout(n, args)
+    t0 = time.perf_counter()
+    synthetic.ensure_csv(P["raw"], n, args.format, args.seed)
+    L.info(f"[{symbol}] CSV {P['raw']} pronto in {time.perf_counter() - t0:.1f}s")
+    for k in ("clean", "labeled", "features", "state"):
+        Path(P[k]).parent.mkdir(parents=True, exist_ok=True)
+    # label.py con gli stessi tp/sl/horizon dei controlli
+    extra = dict(label=["--tp", str(args.tp), "--sl", str(args.sl), "--horizon", str(args.horizon)],
+                 features=(["--features", *args.features] if args.features else [])
+                          + (["--norm", args.norm] if args.norm else []))
+
+    out = dict(bars=n, symbol=symbol, stages={})
+    for rep in range(args.repeat):
+        before = len(profiling.load_records(profiling.METRICS_PATH))
+        for stage in args.stages:
+            m = run_stage(stage, symbol, P, ns, args, extra.get(stage, ()))
+            records = profiling.load_records(profiling.METRICS_PATH)[before:]
+            m["spans"] = stage_spans(records, stage, symbol)
+            best = out["stages"].get(stage)
+            out["stages"][stage] = m if best is None else min_metrics(best, m)
+            L.info(f"[{symbol}] {stage:<9} {m['secs']:8.2f}s  picco RSS {m['peak_rss_mb']:,.0f} MB"
+                   + (f"  (ripetizione {rep + 1}/{args.repeat})" if args.repeat > 1 else ""))
+
+    if args.predict and {"split", "onnx"} <= set(args.stages):
+        runs_ = [bench_predict(P, args) for _ in range(args.repeat)]
+        out["predict"] = runs_[0] if len(runs_) == 1 else min_metrics(*runs_)
+
+    if args.checks:
+        checks = {}
+        if "label" in args.stages:
+            checks["label"] = check_labels(P, args)
+            checks["exits"] = check_exits(P, args)
+        if "clean" in args.stages:
+            checks["formats"] = check_formats(n, args)
+        if "features" in args.stages:
+            checks["stream"] = check_stream(P, args)
+        out["checks"] = checks
+    return out
+
+
+def min_metrics(a, b):
+    """Minimo elemento per elemento di due dict di metriche annidati."""
+    if isinstance(a, dict):
+        return {k: min_metrics(a[k], b[k]) if k in b else a[k] for k in a}
+    if isinstance(a, (int, float)) and not isinstance(a, bool) and isinstance(b, (int, float)):
+        return min(a, b)
+    return a
+
+
+def main(args):
+    work = Path(args.workdir)
+    work.mkdir(parents=True, exist_ok=True)
+    os.environ["RUN_ID"] = "bench-" + datetime.now().strftime("%Y%m%dT%H%M%S")
+    profiling.METRICS_PATH = work / "metrics.jsonl"      # span degli stage, separati dai run veri
+    os.environ["METRICS_PATH"] = str(profiling.METRICS_PATH)   # anche per il gateway (--http)
+    env = environment()
+    sizes = [parse_size(s) for s in args.sizes]
+    L.info(f"Benchmark {env['git']}{' (dirty)' if env['dirty'] else ''}  taglie "
+           f"{[size_label(n) for n in sizes]}  stage {' → '.join(args.stages)}  seed {args.seed}")
+
+    res = dict(run=os.environ["RUN_ID"], created=datetime.now().isoformat(timespec="seconds"),
+               env=env, config=dict(format=args.format, seed=args.seed, repeat=args.repeat,
+                                    stages=args.stages, threads=args.threads,
+                                    tp=args.tp, sl=args.sl, horizon=args.horizon,
+                                    features=args.features, norm=args.norm),
+               sizes={})
+    for n in sizes:
+        res["sizes"][size_label(n)] = bench_size(n, args)
+    if args.checks:
+        res["checks"] = dict(normalize=check_normalize(args))
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{datetime.now():%Y%m%dT%H%M%S}_{env['git']}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(res, f, indent=2)
+    print_table(res)
+    for mode, c in res.get("checks", {}).get("normalize", {}).get("modes", {}).items():
+        L.info(f"check normalize {mode:<10}{'✅' if c['ok'] else '❌'} max |Δ| {c['max_abs']:.2e}")
+    L.info(f"Risultati → {out}")
+
+    failed = [f"{s}/{k}" for s, r in res["sizes"].items() for k, c in r.get("checks", {}).items()
+              if not c["ok"]] + [k for k, c in res.get("checks", {}).items() if not c["ok"]]
+    if failed:
+        L.error(f"❌ Controlli di correttezza falliti: {failed}")
+
+    regressions = []
+    if args.compare:
+        base_path = previous_result(out) if args.compare == "prev" else Path(args.compare)
+        if base_path is None or not base_path.exists():
+            L.warning("Nessun risultato precedente da confrontare")
+        else:
+            with open(base_path) as f:
+                base = json.load(f)
+            rows = compare(base, res, args.threshold, args.min_secs)
+            L.info(f"Confronto con {base_path.name} ({base['env']['git']}): {len(rows)} metriche")
+            for r in rows:
+                if r["regression"] or args.verbose:
+                    L.info(f"  {r['metric']:<36}{r['base']:12.4f}{r['new']:12.4f}"
+                           f"{100 * (r['ratio'] - 1):+8.1f}%{'  ⚠️' if r['regression'] else ''}")
+            regressions = [r for r in rows if r["regression"]]
+            if regressions:
+                L.error(f"⚠️  Regressioni oltre +{100 * args.threshold:.0f}%: {len(regressions)}")
+    if failed or regressions:
+        sys.exit(1)
+    L.info("✅ Benchmark completato")
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Generatore OHLCV M1 sintetico e riproducibile (stesso seed → stessi byte).
+
+  • minuti di trading lun-ven (weekend esclusi), da --start
+  • rendimenti log-normali con volatilità per sessione (Asia bassa,
+    Londra / New York alta) e regimi lenti di volatilità
+  • Open = Close precedente (gap sul primo minuto dopo il weekend),
+    High/Low oltre il corpo della candela, prezzi arrotondati a 5 decimali
+    come negli export reali; Volume (tick) Poisson con lo stesso profilo
+  • scrittura a chunk in entrambi i formati letti da clean.py:
+      mt5       → <DATE> <TIME> <OPEN> ... <TICKVOL> <VOL> <SPREAD> (tab)
+      dukascopy → timestamp (ms),open,high,low,close,volume
+
+Uso:
+  python src/bench/synthetic.py --bars 1000000 --format mt5 --out data/raw/SYN_M1.csv
+"""
+
+import argparse, time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+FORMATS = ("mt5", "dukascopy")
+CHUNK = 1_000_000
+DECIMALS = 5
+
+
+def trading_minutes(n: int, start: str = "2020-01-06") -> pd.DatetimeIndex:
+    """Primi n minuti lun-ven a partire da `start`."""
+    span = int(n * 7 / 5) + 3 * 1440                # weekend + margine
+    t = pd.Timestamp(start).value + np.arange(span, dtype=np.int64) * 60_000_000_000
+    dow = (t // 86_400_000_000_000 + 3) % 7         # 1970-01-01 = giovedì → lun = 0
+    return pd.DatetimeIndex(t[dow < 5][:n], name="time")
+
+
+def generate(n: int, seed: int = 0, start: str = "2020-01-06", price: float = 1.10,
+             vol: float = 1.5e-4) -> pd.DataFrame:
+    """n barre M1 OHLCV (float64 arrotondati a DECIMALS, Volume int64)."""
+    rng = np.random.default_rng(seed)
+    idx = trading_minutes(n, start)
+    hour = (idx.asi8 // 3_600_000_000_000) % 24
+    session = np.where((hour >= 7) & (hour < 16), 1.3, 0.6) + np.where((hour >= 13) & (hour < 21), 0.6, 0.0)
+    regime = np.exp(np.repeat(rng.normal(0, 0.3, n // 1440 + 1), 1440)[:n])   # vol giornaliera
+    sigma = vol * session * regime
+
+    r = rng.standard_normal(n) * sigma
+    gap = np.r_[False, np.diff(idx.asi8) > 60_000_000_000]
+    r[gap] += rng.standard_normal(gap.sum()) * vol * 10          # gap del lunedì
+    close = price * np.exp(np.cumsum(r))
+    open_ = np.r_[price, close[:-1]]
+    wick = np.abs(rng.standard_normal((2, n))) * sigma * 0.5
+    high = np.maximum(open_, close) * (1 + wick[0])
+    low = np.minimum(open_, close) * (1 - wick[1])
+    volume = rng.poisson(40 * session * regime)
+
+    df = pd.DataFrame({"Open": open_, "High": high, "Low": low, "Close": close}, index=idx)
+    df = df.round(DECIMALS)                    # arrotondamento monotono: OHLC resta coerente
+    df["Volume"] = volume.astype(np.int64)
+    return df
+
+
+# ────────────────────────────────
+# Scrittura CSV
+# ────────────────────────────────
+def _mt5_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    t = df.index.asi8
+    day, tod = np.divmod(t, 86_400_000_000_000)
+    codes, days = pd.factorize(day)
+    dates = pd.to_datetime(days * 86_400_000_000_000).strftime("%Y.%m.%d").to_numpy()
+    mins = tod // 60_000_000_000
+    times = np.array([f"{m // 60:02d}:{m % 60:02d}:00" for m in range(1440)])
+    return pd.DataFrame({"<DATE>": dates[codes], "<TIME>": times[mins],
+                         "<OPEN>": df["Open"], "<HIGH>": df["High"], "<LOW>": df["Low"],
+                         "<CLOSE>": df["Close"], "<TICKVOL>": df["Volume"],
+                         "<VOL>": 0, "<SPREAD>": 1})
+
+
+def _duka_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({"timestamp": df.index.asi8 // 1_000_000, "open": df["Open"],
+                         "high": df["High"], "low": df["Low"], "close": df["Close"],
+                         "volume": df["Volume"]})
+
+
+def write_csv(df: pd.DataFrame, path: Path, fmt: str = "mt5", chunk: int = CHUNK):
+    """CSV nel formato `fmt` a chunk di `chunk` righe (tmp + rename)."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato sconosciuto: {fmt} (attesi {FORMATS})")
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    to_chunk, sep = (_mt5_chunk, "\t") if fmt == "mt5" else (_duka_chunk, ",")
+    with open(tmp, "w") as f:
+        for a in range(0, len(df), chunk):
+            to_chunk(df.iloc[a:a + chunk]).to_csv(f, sep=sep, index=False, header=a == 0,
+                                                   float_format=f"%.{DECIMALS}f")
+    tmp.replace(path)
+    return path
+
+
+def ensure_csv(path: Path, n: int, fmt: str = "mt5", seed: int = 0) -> Path:
+    """Genera il CSV solo se manca (cache fra run del benchmark)."""
+    path = Path(path)
+    if not path.exists():
+        write_csv(generate(n, seed), path, fmt)
+    return path
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="OHLCV M1 sintetico (seed) → CSV MT5 / Dukascopy")
+    p.add_argument("--bars", type=int, default=1_000_000)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--start", default="2020-01-06")
+    p.add_argument("--format", choices=FORMATS, default="mt5")
+    p.add_argument("--out", default="data/raw/SYN_M1.csv")
+    return p.parse_args(argv)
+
+
+def main(args):
+    t0 = time.perf_counter()
+    df = generate(args.bars, args.seed, args.start)
+    write_csv(df, args.out, args.format)
+    print(f"✅ {len(df):,} barre ({df.index[0]} → {df.index[-1]}) in {args.out} "
+          f"[{args.format}] in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Scoring batch offline con il modello ONNX (niente .pkl / joblib).
+
+  • legge feature store, split o dataset hive a batch di row group
+    (pyarrow, solo le colonne dello spec)
+  • ogni colonna Arrow viene copiata direttamente (cast incluso) in un
+    buffer float32 C-contiguo riusato fra i batch: nessun DataFrame
+    intermedio, una sola copia per valore
+  • una sessione onnxruntime riusata, --threads thread intra-op
+  • predizioni scritte in streaming (ParquetWriter): time + pred (+ --keep)
+  • --check-pkl: parità con LightGBM predict sulle prime --check-rows righe
+"""
+
+import argparse, os, sys, time
+from pathlib import Path
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as pds
+import pyarrow.parquet as pq
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/ nel path
+from deploy.onnx_model import OnnxModel
+from etl import store
+from etl.features import load_spec
+from utils.logger import setup_logging
+from utils.profiling import profiled, lap
+
+L = setup_logging("batch_score")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Scoring batch ONNX: parquet → parquet")
+    p.add_argument("--input",  default="data/splits/test.parquet",
+                   help="Parquet con le colonne dello spec (file, directory di part o hive)")
+    p.add_argument("--output", default="data/predictions/test_pred.parquet")
+    p.add_argument("--model",  default="models/onnx/lgbm_model.onnx")
+    p.add_argument("--spec",   default="models/onnx/feature_spec.json")
+    p.add_argument("--symbol", default="EURUSD", help="Simbolo (input hive)")
+    p.add_argument("--batch",  type=int, default=store.ROW_GROUP_ROWS, help="Righe per batch")
+    p.add_argument("--threads", type=int, default=os.cpu_count() or 1,
+                   help="Thread intra-op onnxruntime")
+    p.add_argument("--pred-col", default="pred", help="Nome della colonna predizione")
+    p.add_argument("--keep", nargs="*", default=[], help="Colonne da copiare nell'output (es. Label)")
+    p.add_argument("--check-pkl", default=None,
+                   help="Modello LightGBM .pkl per il controllo di parità")
+    p.add_argument("--check-rows", type=int, default=100_000)
+    p.add_argument("--tol", type=float, default=1e-5, help="Differenza massima ammessa (parità)")
+    return p.parse_args(argv)
+
+
+# ────────────────────────────────
+# Lettura a batch → float32
+# ────────────────────────────────
+def open_dataset(path: Path, symbol: str) -> pds.Dataset:
+    if store.is_dataset(path) and (path / f"symbol={symbol}").exists():
+        return pds.dataset(path / f"symbol={symbol}", format="parquet",
+                           partitioning=store.PARTITIONING)
+    return pds.dataset(str(path), format="parquet")
+
+
+def to_matrix(batch: pa.RecordBatch, features: list, buf: np.ndarray) -> np.ndarray:
+    """Colonne Arrow → vista (n, k) di `buf` float32; NaN al posto dei null."""
+    X = buf[:batch.num_rows]
+    for j, name in enumerate(features):
+        col = batch.column(name)
+        if col.null_count:
+            col = col.fill_null(np.nan)
+        X[:, j] = col.to_numpy(zero_copy_only=False)   # cast a float32 in scrittura
+    return X
+
+
+def score(dset: pds.Dataset, model: OnnxModel, features: list, out: Path,
+          batch: int, pred_col: str, keep: list):
+    """Scora il dataset a batch e scrive le predizioni; ritorna righe scritte."""
+    names = dset.schema.names
+    cols = (["time"] if "time" in names else []) + keep + features
+    cols = list(dict.fromkeys(cols))
+    buf = np.empty((batch, len(features)), dtype=np.float32)
+    writer, rows = None, 0
+    try:
+        for b in dset.to_batches(columns=cols, batch_size=batch):
+            if b.num_rows == 0:
+                continue
+            X = to_matrix(b, features, buf)
+            pred = model.predict_proba(X)
+            out_cols = {c: b.column(c) for c in cols if c not in features or c in keep}
+            out_cols[pred_col] = pa.array(pred)
+            table = pa.Table.from_pydict(out_cols)
+            if writer is None:
+                out.parent.mkdir(parents=True, exist_ok=True)
+                writer = pq.ParquetWriter(out, table.schema)
+            writer.write_table(table)
+            rows += b.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+# ────────────────────────────────
+# Parità con LightGBM
+# ────────────────────────────────
+def parity(dset: pds.Dataset, model: OnnxModel, features: list, pkl: str, rows: int) -> dict:
+    """ONNX vs LightGBM predict sulle stesse righe (input float32 per entrambi)."""
+    import joblib
+    booster = joblib.load(pkl)
+    table = dset.head(rows, columns=features)
+    buf = np.empty((table.num_rows, len(features)), dtype=np.float32)
+    X = to_matrix(table.combine_chunks().to_batches()[0], features, buf) if table.num_rows else buf
+    p_onnx = model.predict_proba(X).astype(np.float64)
+    p_lgb = booster.predict(X.astype(np.float64))
+    diff = np.abs(p_onnx - p_lgb)
+    return dict(rows=len(X), max_abs=float(diff.max()) if len(X) else 0.0,
+                mean_abs=float(diff.mean()) if len(X) else 0.0)
+
+
+# ────────────────────────────────
+# Main
+# ────────────────────────────────
+@profiled("batch_score")
+def main(args):
+    for path in (args.input, args.model, args.spec):
+        if not Path(path).exists():
+            L.error(f"⚠️  File non trovato: {path}")
+            sys.exit(1)
+    spec = load_spec(args.spec)
+    features = spec["features"]
+    model = OnnxModel(args.model, intra_threads=args.threads)
+    if model.n_features != len(features):
+        L.error(f"⚠️  Modello con {model.n_features} feature, spec con {len(features)}")
+        sys.exit(1)
+    dset = open_dataset(Path(args.input), args.symbol)
+    missing = [c for c in features + args.keep if c not in dset.schema.names]
+    if missing:
+        L.error(f"⚠️  Colonne mancanti in {args.input}: {missing}")
+        sys.exit(1)
+
+    if args.check_pkl:
+        r = parity(dset, model, features, args.check_pkl, args.check_rows)
+        L.info(f"Parità ONNX vs LightGBM su {r['rows']:,} righe: "
+               f"max |Δ| {r['max_abs']:.2e}  media {r['mean_abs']:.2e}")
+        if r["max_abs"] > args.tol:
+            L.error(f"⚠️  Parità fallita: max |Δ| {r['max_abs']:.2e} > {args.tol:.0e}")
+            sys.exit(1)
+        lap("parity", rows=r["rows"])
+
+    t0 = time.perf_counter()
+    rows = score(dset, model, features, Path(args.output), args.batch, args.pred_col, args.keep)
+    dt = time.perf_counter() - t0
+    lap("score", rows=rows)
+    L.info(f"Righe scorate: {rows:,} in {dt:.2f}s ({rows / max(dt, 1e-9):,.0f} righe/s, "
+           f"{args.threads} thread)")
+    L.info(f"✅ Predizioni salvate: {args.output}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,652 @@
+#!/usr/bin/env python3
+"""
+Gateway FastAPI per l'EA MT5:
+  • POST /predict       {"features": [...]} → {"prediction": p}
+  • POST /predict_bars  {"symbol": "EURUSD", "bars": [{time, open, high, low,
+    close, volume}, ...]} → {"predictions": [...]}: feature e z-score calcolati
+    lato server dallo spec versionato (models/onnx/feature_spec.json), con un
+    ring buffer per simbolo (deploy/streaming.py)
+
+Percorso di richiesta a bassa latenza:
+  • una sola InferenceSession onnxruntime precaricata all'avvio
+  • micro-batching asyncio: le richieste concorrenti arrivate entro
+    --max-wait-ms vengono unite in un'unica chiamata `run` (max --max-batch)
+  • il log delle predizioni (logs/pred_log.csv, una colonna con la versione
+    servita) passa da una coda verso un thread writer in background: nessun
+    I/O su disco sulla richiesta; un file con header diverso viene ruotato
+  • metriche (utils/profiling.py → logs/metrics.jsonl): span di avvio
+    (modello, warm-up, spec) e ogni --metrics-s secondi un record "serve"
+    con righe, righe/s e latenza p50/p99, scritto dallo stesso thread
+
+Registry (--registry models/registry, deploy/registry.py):
+  • il modello servito è la versione del puntatore `production`, riletto
+    ogni --watch-s secondi (o POST /models/reload): la nuova versione viene
+    caricata e scaldata fuori dal loop, poi sostituita in un colpo solo; le
+    richieste già accodate finiscono sul modello precedente, i ring buffer
+    di /predict_bars passano alla nuova versione → nessun riavvio; una
+    versione con un altro numero di feature viene rifiutata (l'EA manda
+    ancora il vettore vecchio)
+  • shadow: se c'è un puntatore `candidate`, un thread dedicato scora il
+    candidate sugli stessi input (batch di feature o barre, con il suo
+    spec) dopo la risposta; confronto con il live in GET /models, record
+    "shadow" in logs/metrics.jsonl e righe in logs/shadow_log.csv
+
+Verifica latenze p50/p99: python src/deploy/load_test.py --spawn
+"""
+
+import argparse, asyncio, os, queue, sys, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
+import uvicorn
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/ nel path
+from deploy import registry
+from deploy.onnx_model import OnnxModel, MODEL_PATH
+from deploy.streaming import load_stream, SPEC_PATH
+from utils.logger import setup_logging, LOG_DIR
+from utils.profiling import Profiler, rss_mb
+
+# ─────────────────────────────
+# Logging
+# ─────────────────────────────
+L = setup_logging("gateway")
+
+# Config da env (così funziona anche con `uvicorn deploy.fastapi_gateway:app`)
+CFG = dict(
+    model=os.environ.get("GATEWAY_MODEL", str(MODEL_PATH)),
+    spec=os.environ.get("GATEWAY_SPEC", str(SPEC_PATH)),
+    threads=int(os.environ.get("GATEWAY_THREADS", "1")),
+    max_batch=int(os.environ.get("GATEWAY_MAX_BATCH", "64")),
+    max_wait_ms=float(os.environ.get("GATEWAY_MAX_WAIT_MS", "1.0")),
+    pred_log=os.environ.get("GATEWAY_PRED_LOG", str(LOG_DIR / "pred_log.csv")),
+    metrics_s=float(os.environ.get("GATEWAY_METRICS_S", "60")),
+    registry=os.environ.get("GATEWAY_REGISTRY") or None,
+    watch_s=float(os.environ.get("GATEWAY_WATCH_S", "2.0")),
+    shadow_log=os.environ.get("GATEWAY_SHADOW_LOG", str(LOG_DIR / "shadow_log.csv")),
+)
+BUY, SELL = 0.6, 0.4       # soglie dell'EA: accordo live/shadow sul segnale
+
+
+# ─────────────────────────────
+# 1️⃣  Log predizioni non bloccante
+# ─────────────────────────────
+class PredictionLog:
+    """Writer CSV su thread dedicato; la richiesta fa solo un put_nowait."""
+
+    def __init__(self, path: Path, n_features: int, flush_s: float = 1.0,
+                 profiler: Profiler = None, metrics_s: float = 60.0):
+        self.path, self.flush_s = Path(path), flush_s
+        self.profiler, self.metrics_s = profiler, metrics_s
+        self.latencies = []
+        self.header = "ts,version,latency_ms,prediction," + ",".join(f"f{i}" for i in range(n_features))
+        self.q = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name="pred-log", daemon=True)
+        self.thread.start()
+
+    def log(self, latency_ms: float, prediction: float, features, version: str = ""):
+        self.q.put_nowait((time.time(), version, latency_ms, prediction, features))
+
+    def _rotate(self):
+        """Header diverso (altro numero di feature / formato) → file nuovo."""
+        with open(self.path) as f:
+            if f.readline().rstrip("\n") == self.header:
+                return
+        old = self.path.with_name(f"{self.path.stem}.{time.strftime('%Y%m%dT%H%M%S')}{self.path.suffix}")
+        os.replace(self.path, old)
+        L.info(f"Log predizioni con header diverso spostato in {old}")
+
+    def _run(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists() and self.path.stat().st_size:
+            self._rotate()
+        new = not self.path.exists() or self.path.stat().st_size == 0
+        with open(self.path, "a", buffering=1 << 16) as f:
+            if new:
+                f.write(self.header + "\n")
+            last_flush = last_metrics = time.monotonic()
+            while True:
+                try:
+                    item = self.q.get(timeout=self.flush_s)
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    break
+                if item:
+                    ts, version, lat, pred, feats = item
+                    stamp = datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="milliseconds")
+                    f.write(f"{stamp},{version},{lat:.3f},{pred:.6f}," + ",".join(map(repr, feats)) + "\n")
+                    self.latencies.append(lat)
+                if time.monotonic() - last_flush >= self.flush_s:
+                    f.flush()
+                    last_flush = time.monotonic()
+                if self.profiler and time.monotonic() - last_metrics >= self.metrics_s:
+                    self._emit(time.monotonic() - last_metrics)
+                    last_metrics = time.monotonic()
+            if self.profiler:
+                self._emit(time.monotonic() - last_metrics)
+
+    def _emit(self, secs: float):
+        """Record "serve" della finestra appena chiusa (nessun record se vuota)."""
+        lat, self.latencies = np.asarray(self.latencies), []
+        if len(lat):
+            p50, p99 = np.percentile(lat, [50, 99])
+            self.profiler.emit(span="serve", secs=round(secs, 3), rows=len(lat),
+                               rows_per_s=round(len(lat) / secs, 1), p50_ms=round(p50, 3),
+                               p99_ms=round(p99, 3), rss_mb=rss_mb())
+
+    def close(self):
+        self.q.put(None)
+        self.thread.join(timeout=5)
+
+
+# ─────────────────────────────
+# 2️⃣  Micro-batcher asyncio
+# ─────────────────────────────
+class MicroBatcher:
+    """Raccoglie le richieste concorrenti e le valuta con una sola `run`.
+
+    Il primo elemento apre una finestra di max_wait_ms; la batch parte appena
+    è piena o la finestra scade. La finestra si apre solo se la batch
+    precedente ha unito più richieste (c'è carico concorrente): a traffico
+    isolato la richiesta parte subito, senza pagare l'attesa.
+    L'inferenza gira su un thread dedicato, così mentre una batch è in
+    calcolo il loop continua ad accodare la successiva.
+    """
+
+    def __init__(self, predict_fn, max_batch: int = 64, max_wait_ms: float = 1.0):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue: asyncio.Queue = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="onnx")
+        self.task = None
+        self.under_load = False
+        self.busy = False
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        self.executor.shutdown(wait=False)
+        while self.queue is not None and not self.queue.empty():
+            _, fut = self.queue.get_nowait()
+            if not fut.done():
+                fut.set_exception(RuntimeError("Modello sostituito, richiesta da ripetere"))
+
+    async def drain(self, timeout: float = 5.0):
+        """Attende che le richieste già accodate siano servite (hot-swap)."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        await asyncio.sleep(self.max_wait + 0.01)      # submit_many ancora da schedulare
+        while (self.busy or not self.queue.empty()) and loop.time() < deadline:
+            await asyncio.sleep(0.005)
+
+    async def submit(self, features) -> float:
+        fut = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((features, fut))
+        return await fut
+
+    async def submit_many(self, rows) -> list:
+        return await asyncio.gather(*(self.submit(r) for r in rows))
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        self.busy = True
+        deadline = loop.time() + (self.max_wait if self.under_load else 0.0)
+        while len(batch) < self.max_batch:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        self.under_load = len(batch) > 1
+        return batch
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            X = np.asarray([f for f, _ in batch], dtype=np.float32)
+            try:
+                probs = await loop.run_in_executor(self.executor, self.predict_fn, X)
+            except Exception as e:              # la batch fallisce, il loop no
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                self.busy = False
+                continue
+            for (_, fut), p in zip(batch, probs):
+                if not fut.done():
+                    fut.set_result(float(p))
+            self.busy = False
+
+
+# ─────────────────────────────
+# 3️⃣  Versioni servite e shadow
+# ─────────────────────────────
+class Deployment:
+    """Una versione del modello: sessione ONNX, stream feature e micro-batcher."""
+
+    def __init__(self, version: str, model: OnnxModel, stream=None):
+        self.version, self.model, self.stream = version, model, stream
+        self.batcher = None
+
+    @property
+    def spec_hash(self):
+        return self.stream.spec["hash"] if self.stream else None
+
+    async def start(self):
+        self.batcher = MicroBatcher(self.model.predict_proba, CFG["max_batch"], CFG["max_wait_ms"])
+        await self.batcher.start()
+        return self
+
+    async def retire(self):
+        await self.batcher.drain()
+        await self.batcher.stop()
+
+
+def load_deployment(version: str, model_path, spec_path, P: Profiler = None) -> Deployment:
+    """Carica e scalda modello + spec (bloccante: all'avvio o in un thread)."""
+    span = P.span if P else (lambda name: nullcontext())
+    with span("load_model"):
+        model = OnnxModel(model_path, intra_threads=CFG["threads"])
+    with span("warmup"):
+        model.predict_proba(np.zeros((1, model.n_features), dtype=np.float32))
+    stream = None
+    if spec_path and Path(spec_path).exists():
+        with span("load_spec"):
+            stream = load_stream(spec_path)
+        if stream.n_features != model.n_features:
+            raise RuntimeError(f"Spec {spec_path}: {stream.n_features} feature, "
+                               f"modello {model.n_features}")
+    return Deployment(version, model, stream)
+
+
+def load_version(version: str, P: Profiler = None) -> Deployment:
+    d = registry.version_dir(CFG["registry"], version)
+    return load_deployment(version, d / registry.MODEL_FILE, d / registry.SPEC_FILE, P)
+
+
+def ea_signal(p: np.ndarray) -> np.ndarray:
+    return np.where(p > BUY, 1, np.where(p < SELL, -1, 0))
+
+
+class Shadow:
+    """Scoring del candidate sugli stessi input del live, su un thread dedicato.
+
+    /predict accoda il vettore di feature con la predizione live; /predict_bars
+    accoda le barre subito dopo lo stream live (ordine garantito) con un
+    Future risolto a fine richiesta. Il thread svuota la coda, aggiorna lo
+    stream del candidate, scora tutto con una sola `run` e confronta.
+    """
+
+    def __init__(self, dep: Deployment, live_version: str, path: Path,
+                 profiler: Profiler = None, metrics_s: float = 60.0, max_batch: int = 1024):
+        self.dep, self.live_version = dep, live_version
+        self.path, self.profiler, self.metrics_s = Path(path), profiler, metrics_s
+        self.max_batch = max_batch
+        self.total = self._empty()
+        self.window = self._empty()
+        self.q = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name="shadow", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _empty() -> dict:
+        return dict(rows=0, abs_sum=0.0, abs_max=0.0, agree=0, live_sum=0.0, shadow_sum=0.0)
+
+    def submit(self, kind: str, payload, live):
+        self.q.put_nowait((time.time(), kind, payload, live))
+
+    def _score(self, items: list, f):
+        X, live, meta = [], [], []
+        for ts, kind, payload, preds in items:
+            if kind == "features":
+                if len(payload) == self.dep.model.n_features:
+                    X.append(payload)
+                    live.append(preds)
+                    meta.append((ts, ""))
+                continue
+            symbol, times, bars = payload
+            try:
+                Xs = self.dep.stream.update(symbol, times, bars) if self.dep.stream else None
+            except ValueError:
+                Xs = None
+            try:
+                preds = preds.result(timeout=5)     # predizioni live della stessa richiesta
+            except Exception:
+                preds = None
+            if Xs is None or preds is None:
+                continue
+            for x, p in zip(Xs, preds):
+                if p is not None and not np.isnan(x).any():
+                    X.append(x)
+                    live.append(p)
+                    meta.append((ts, symbol))
+        if not X:
+            return
+        live = np.asarray(live, dtype=np.float64)
+        shadow = self.dep.model.predict_proba(np.asarray(X, dtype=np.float32)).astype(np.float64)
+        d = np.abs(shadow - live)
+        for acc in (self.total, self.window):
+            acc["rows"] += len(d)
+            acc["abs_sum"] += float(d.sum())
+            acc["abs_max"] = max(acc["abs_max"], float(d.max()))
+            acc["agree"] += int(np.count_nonzero(ea_signal(live) == ea_signal(shadow)))
+            acc["live_sum"] += float(live.sum())
+            acc["shadow_sum"] += float(shadow.sum())
+        for (ts, symbol), a, b in zip(meta, live, shadow):
+            stamp = datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="milliseconds")
+            f.write(f"{stamp},{symbol},{self.live_version},{self.dep.version},{a:.6f},{b:.6f}\n")
+
+    def _run(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        new = not self.path.exists() or self.path.stat().st_size == 0
+        with open(self.path, "a", buffering=1 << 16) as f:
+            if new:
+                f.write("ts,symbol,live_version,shadow_version,live,shadow\n")
+            last_metrics = time.monotonic()
+            stop = False
+            while not stop:
+                try:
+                    items = [self.q.get(timeout=1.0)]
+                except queue.Empty:
+                    items = []
+                while items and len(items) < self.max_batch:
+                    try:
+                        items.append(self.q.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in items:
+                    stop = True
+                    items = items[:items.index(None)]
+                try:
+                    self._score(items, f)
+                except Exception as e:                # lo shadow non deve mai fermarsi
+                    L.warning(f"Shadow {self.dep.version}: {e}")
+                f.flush()
+                if self.profiler and (stop or time.monotonic() - last_metrics >= self.metrics_s):
+                    self._emit(time.monotonic() - last_metrics)
+                    last_metrics = time.monotonic()
+
+    @staticmethod
+    def summary(acc: dict) -> dict:
+        n = max(acc["rows"], 1)
+        return dict(rows=acc["rows"], mean_abs_diff=round(acc["abs_sum"] / n, 6),
+                    max_abs_diff=round(acc["abs_max"], 6), signal_agree=round(acc["agree"] / n, 4),
+                    live_mean=round(acc["live_sum"] / n, 6), shadow_mean=round(acc["shadow_sum"] / n, 6))
+
+    def _emit(self, secs: float):
+        acc, self.window = self.window, self._empty()
+        if acc["rows"]:
+            self.profiler.emit(span="shadow", secs=round(secs, 3), live=self.live_version,
+                               candidate=self.dep.version, **self.summary(acc))
+
+    def snapshot(self) -> dict:
+        return dict(candidate=self.dep.version, live=self.live_version, **self.summary(self.total))
+
+    def close(self):
+        self.q.put(None)
+        self.thread.join(timeout=10)
+
+
+# ─────────────────────────────
+# 4️⃣  App
+# ─────────────────────────────
+class PredictIn(BaseModel):
+    features: list[float]
+
+
+class Bar(BaseModel):
+    time: datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float = 0.0
+
+
+class BarsIn(BaseModel):
+    symbol: str
+    bars: list[Bar] = Field(min_length=1)
+
+
+STATE = {}
+EPOCH, US = datetime(1970, 1, 1), timedelta(microseconds=1)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    P = Profiler("gateway")
+    STATE.update(profiler=P, shadow=None, failed=set(), lock=asyncio.Lock())
+    if CFG["registry"]:
+        version = registry.get_pointer(CFG["registry"], "production")
+        if version is None:
+            raise RuntimeError(f"Registry {CFG['registry']}: nessun puntatore production "
+                               f"(python src/deploy/registry.py promote)")
+        live = load_version(version, P)
+    else:
+        live = load_deployment(CFG["model"], CFG["model"], CFG["spec"], P)
+    if live.stream is not None:
+        L.info(f"Spec feature: hash {live.spec_hash}")
+    else:
+        L.warning("Spec feature non trovato: /predict_bars disattivato")
+    STATE["live"] = await live.start()
+    STATE["pred_log"] = PredictionLog(CFG["pred_log"], live.model.n_features,
+                                      profiler=P, metrics_s=CFG["metrics_s"])
+    L.info(f"Modello caricato: {live.version} ({live.model.n_features} feature, "
+           f"threads={CFG['threads']}, max_batch={CFG['max_batch']}, "
+           f"max_wait={CFG['max_wait_ms']}ms)")
+    watcher = None
+    if CFG["registry"]:
+        await sync_registry()
+        watcher = asyncio.create_task(watch_registry())
+    yield
+    if watcher:
+        watcher.cancel()
+    if STATE["shadow"]:
+        await asyncio.to_thread(STATE["shadow"].close)
+    await STATE["live"].batcher.stop()
+    STATE["pred_log"].close()
+
+
+# ─────────────────────────────
+# 5️⃣  Hot-swap dal registry
+# ─────────────────────────────
+async def swap(version: str):
+    """Carica `version` fuori dal loop, poi la mette in servizio atomicamente."""
+    t0 = time.perf_counter()
+    old = STATE["live"]
+    try:
+        new = await asyncio.to_thread(load_version, version)
+    except Exception as e:
+        STATE["failed"].add(version)             # niente retry a ogni giro del watcher
+        L.error(f"⚠️  Hot-swap a {version} fallito, resta {old.version}: {e}")
+        return False
+    if new.model.n_features != old.model.n_features:
+        STATE["failed"].add(version)             # l'EA manda ancora il vecchio vettore
+        L.error(f"⚠️  Hot-swap a {version} rifiutato: {new.model.n_features} feature, "
+                f"servite {old.model.n_features} (serve un riavvio con EA aggiornato)")
+        return False
+    if new.stream is not None and old.stream is not None:
+        new.stream.carry_over(old.stream)        # storia per /predict_bars
+    STATE["live"] = await new.start()
+    asyncio.create_task(old.retire())
+    secs = time.perf_counter() - t0
+    STATE["profiler"].emit(span="swap", secs=round(secs, 4), version=version, previous=old.version)
+    L.info(f"🔁 Hot-swap {old.version} → {version} in {secs * 1000:.0f} ms "
+           f"(spec {new.spec_hash}, {new.model.n_features} feature)")
+    return True
+
+
+async def set_shadow(version):
+    old = STATE["shadow"]
+    STATE["shadow"] = None
+    if old is not None:
+        await asyncio.to_thread(old.close)
+        L.info(f"Shadow {old.dep.version} chiuso: {old.snapshot()}")
+    if version is None:
+        return
+    try:
+        dep = await asyncio.to_thread(load_version, version)
+    except Exception as e:
+        STATE["failed"].add(version)
+        L.error(f"⚠️  Candidate {version} non caricabile: {e}")
+        return
+    live = STATE["live"]
+    if dep.stream is not None and live.stream is not None:
+        dep.stream.carry_over(live.stream)
+    STATE["shadow"] = Shadow(dep, live.version, CFG["shadow_log"], STATE["profiler"], CFG["metrics_s"])
+    L.info(f"👥 Shadow attivo: candidate {version} vs live {live.version}")
+
+
+async def sync_registry() -> dict:
+    """Allinea live e shadow ai puntatori del registry."""
+    async with STATE["lock"]:
+        root = CFG["registry"]
+        prod = registry.get_pointer(root, "production")
+        cand = registry.get_pointer(root, "candidate")
+        if prod and prod != STATE["live"].version and prod not in STATE["failed"]:
+            await swap(prod)
+        live = STATE["live"].version
+        want = cand if cand and cand != live and cand not in STATE["failed"] else None
+        shadow = STATE["shadow"]
+        if want != (shadow.dep.version if shadow else None) or (shadow and shadow.live_version != live):
+            await set_shadow(want)
+        return models_info()
+
+
+async def watch_registry():
+    while True:
+        await asyncio.sleep(CFG["watch_s"])
+        try:
+            await sync_registry()
+        except Exception as e:                   # il watcher non deve mai morire
+            L.error(f"⚠️  Registry {CFG['registry']}: {e}")
+
+
+def models_info() -> dict:
+    live, shadow = STATE["live"], STATE.get("shadow")
+    return {"registry": CFG["registry"], "live": live.version, "spec": live.spec_hash,
+            "n_features": live.model.n_features,
+            "shadow": shadow.snapshot() if shadow else None}
+
+
+app = FastAPI(title="ML-EA Gateway", lifespan=lifespan)
+
+
+@app.get("/health")
+async def health():
+    live = STATE["live"]
+    return {"status": "ok", "model": live.version, "spec": live.spec_hash}
+
+
+@app.get("/models")
+async def models():
+    return models_info()
+
+
+@app.post("/models/reload")
+async def models_reload():
+    if not CFG["registry"]:
+        raise HTTPException(409, "Registry non configurato (--registry)")
+    STATE["failed"].clear()                      # reload esplicito: si riprova tutto
+    return await sync_registry()
+
+
+@app.post("/predict")
+async def predict(req: PredictIn):
+    t0 = time.perf_counter()
+    live = STATE["live"]
+    if len(req.features) != live.model.n_features:
+        raise HTTPException(422, f"Attese {live.model.n_features} feature, ricevute {len(req.features)}")
+    pred = await live.batcher.submit(req.features)
+    STATE["pred_log"].log((time.perf_counter() - t0) * 1000, pred, req.features, live.version)
+    if STATE["shadow"] is not None:
+        STATE["shadow"].submit("features", req.features, pred)
+    return {"prediction": pred}
+
+
+@app.post("/predict_bars")
+async def predict_bars(req: BarsIn):
+    """Barre chiuse in ordine cronologico → una predizione per barra.
+
+    null per le barre ancora senza storia sufficiente (avvio a freddo).
+    """
+    t0 = time.perf_counter()
+    live = STATE["live"]
+    stream = live.stream
+    if stream is None:
+        raise HTTPException(503, "Spec feature non caricato")
+    # orologio "a muro" come inviato (ora broker, come i dati di training)
+    times = np.array([(b.time.replace(tzinfo=None) - EPOCH) // US for b in req.bars],
+                     dtype=np.int64) * 1000
+    bars = np.array([[b.open, b.high, b.low, b.close, b.volume] for b in req.bars],
+                    dtype=np.float64).reshape(-1, 5)
+    try:
+        X = stream.update(req.symbol, times, bars)
+    except ValueError as e:
+        raise HTTPException(409, str(e))
+    shadow, done = STATE["shadow"], Future()
+    if shadow is not None:                       # stesso ordine dello stream live
+        shadow.submit("bars", (req.symbol, times, bars), done)
+
+    ok = ~np.isnan(X).any(axis=1)
+    preds = [None] * len(X)
+    try:
+        if ok.any():
+            rows = X[ok]
+            for i, p in zip(np.flatnonzero(ok), await live.batcher.submit_many(rows)):
+                preds[i] = p
+            lat = (time.perf_counter() - t0) * 1000
+            for p, r in zip(preds, X):
+                if p is not None:
+                    STATE["pred_log"].log(lat, p, r.tolist(), live.version)
+    finally:
+        done.set_result(preds)
+    return {"symbol": req.symbol, "spec": live.spec_hash, "predictions": preds}
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="FastAPI ONNX gateway")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--model", default=CFG["model"], help="Modello ONNX")
+    p.add_argument("--spec", default=CFG["spec"], help="Spec feature (per /predict_bars)")
+    p.add_argument("--threads", type=int, default=CFG["threads"],
+                   help="Thread intra-op onnxruntime")
+    p.add_argument("--max-batch", type=int, default=CFG["max_batch"],
+                   help="Richieste max per batch")
+    p.add_argument("--max-wait-ms", type=float, default=CFG["max_wait_ms"],
+                   help="Attesa max per riempire una batch")
+    p.add_argument("--pred-log", default=CFG["pred_log"], help="CSV predizioni")
+    p.add_argument("--metrics-s", type=float, default=CFG["metrics_s"],
+                   help="Secondi fra due record di throughput/latenza in logs/metrics.jsonl")
+    p.add_argument("--registry", default=CFG["registry"],
+                   help="Registry modelli: serve `production`, shadow su `candidate` (ignora --model/--spec)")
+    p.add_argument("--watch-s", type=float, default=CFG["watch_s"],
+                   help="Secondi fra due letture dei puntatori del registry")
+    p.add_argument("--shadow-log", default=CFG["shadow_log"], help="CSV live vs candidate")
+    args = p.parse_args()
+
+    if not args.registry and not Path(args.model).exists():
+        L.error(f"⚠️  Modello ONNX non trovato: {args.model} (run convert_to_onnx.py)")
+        sys.exit(1)
+    CFG.update(model=args.model, spec=args.spec, threads=args.threads, max_batch=args.max_batch,
+               max_wait_ms=args.max_wait_ms, pred_log=args.pred_log, metrics_s=args.metrics_s,
+               registry=args.registry, watch_s=args.watch_s, shadow_log=args.shadow_log)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Load test locale per /predict: N richieste su C connessioni keep-alive
+concorrenti, report p50/p90/p99/max e throughput. Exit code 1 se i target
+--p50-ms / --p99-ms non sono rispettati.
+
+Con --spawn avvia il gateway in un sottoprocesso e lo chiude alla fine.
+Client HTTP/1.1 minimale su asyncio (solo stdlib): niente overhead del client
+nelle misure.
+"""
+
+import argparse, asyncio, json, subprocess, sys, time
+from pathlib import Path
+from urllib.parse import urlparse
+import numpy as np
+
+
+async def _request(reader, writer, host: str, path: str, body: bytes) -> bytes:
+    writer.write(b"POST %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\n"
+                 b"Content-Length: %d\r\n\r\n%s" % (path.encode(), host.encode(), len(body), body))
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":")[1])
+    payload = await reader.readexactly(length)
+    if status != 200:
+        raise RuntimeError(f"HTTP {status}: {payload[:200]!r}")
+    return payload
+
+
+async def _worker(url, bodies, n, latencies):
+    reader, writer = await asyncio.open_connection(url.hostname, url.port)
+    try:
+        for i in range(n):
+            t0 = time.perf_counter()
+            await _request(reader, writer, url.netloc, url.path, bodies[i % len(bodies)])
+            latencies.append((time.perf_counter() - t0) * 1000)
+    finally:
+        writer.close()
+
+
+async def run(url: str, requests: int, concurrency: int, n_features: int, seed: int = 0):
+    u = urlparse(url)
+    rng = np.random.default_rng(seed)
+    bodies = [json.dumps({"features": rng.normal(size=n_features).round(6).tolist()}).encode()
+              for _ in range(256)]
+    latencies = []
+    per_worker = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_worker(u, bodies, n, latencies) for n in per_worker))
+    return np.asarray(latencies), time.perf_counter() - t0
+
+
+def wait_ready(url: str, timeout: float = 30.0):
+    u = urlparse(url)
+
+    async def ping():
+        r, w = await asyncio.open_connection(u.hostname, u.port)
+        w.write(b"GET /health HTTP/1.1\r\nHost: %s\r\n\r\n" % u.netloc.encode())
+        await w.drain()
+        head = await r.readuntil(b"\r\n\r\n")
+        w.close()
+        return b" 200 " in head
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if asyncio.run(ping()):
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"Gateway non pronto su {url}")
+
+
+def main(args):
+    proc = None
+    if args.spawn:
+        gw = Path(__file__).resolve().parent / "fastapi_gateway.py"
+        u = urlparse(args.url)
+        proc = subprocess.Popen([sys.executable, str(gw), "--host", u.hostname,
+                                 "--port", str(u.port), *args.gateway_args])
+    try:
+        wait_ready(args.url)
+        asyncio.run(run(args.url, args.warmup, args.concurrency, args.features))
+        lat, wall = asyncio.run(run(args.url, args.requests, args.concurrency, args.features))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    p50, p90, p99 = np.percentile(lat, [50, 90, 99])
+    print(f"Richieste: {len(lat):,}  concorrenza: {args.concurrency}  "
+          f"throughput: {len(lat) / wall:,.0f} req/s")
+    print(f"Latenza ms → p50: {p50:.2f}  p90: {p90:.2f}  p99: {p99:.2f}  max: {lat.max():.2f}")
+
+    ok = (args.p50_ms is None or p50 <= args.p50_ms) and (args.p99_ms is None or p99 <= args.p99_ms)
+    print("✅ Target rispettati" if ok else f"❌ Target mancati (p50 ≤ {args.p50_ms}, p99 ≤ {args.p99_ms})")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Load test /predict (p50/p99)")
+    p.add_argument("--url", default="http://127.0.0.1:8000/predict")
+    p.add_argument("--requests", type=int, default=5000)
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--warmup", type=int, default=200)
+    p.add_argument("--features", type=int, default=4, help="Lunghezza vettore feature")
+    p.add_argument("--p50-ms", type=float, default=5.0, help="Target p50 (ms)")
+    p.add_argument("--p99-ms", type=float, default=20.0, help="Target p99 (ms)")
+    p.add_argument("--spawn", action="store_true", help="Avvia il gateway in un sottoprocesso")
+    p.add_argument("gateway_args", nargs="*", help="Argomenti extra per fastapi_gateway.py (dopo --)")
+    main(p.parse_args())
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Wrapper onnxruntime per il modello LightGBM convertito (convert_to_onnx.py).
+Una sessione precaricata, thread intra-op configurabili, output = probabilità
+della classe 1 come vettore float32 (gestisce anche i modelli con ZipMap).
+"""
+
+from pathlib import Path
+import numpy as np
+import onnxruntime as ort
+
+MODEL_PATH = Path("models/onnx/lgbm_model.onnx")
+
+
+def load_session(path: Path = MODEL_PATH, intra_threads: int = 1,
+                 inter_threads: int = 1) -> ort.InferenceSession:
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = intra_threads
+    so.inter_op_num_threads = inter_threads
+    so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(str(path), so, providers=["CPUExecutionProvider"])
+
+
+class OnnxModel:
+    """Sessione + metadati di input/output, riusabile da più chiamanti."""
+
+    def __init__(self, path: Path = MODEL_PATH, intra_threads: int = 1):
+        self.path = Path(path)
+        self.session = load_session(self.path, intra_threads)
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        self.n_features = inp.shape[1]
+        outs = [o.name for o in self.session.get_outputs()]
+        self.prob_name = "probabilities" if "probabilities" in outs else outs[-1]
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """X (n, n_features) → P(Label = 1), shape (n,), float32."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        probs = self.session.run([self.prob_name], {self.input_name: X})[0]
+        if isinstance(probs, list):          # ZipMap: lista di {classe: prob}
+            return np.fromiter((p[1] for p in probs), dtype=np.float32, count=len(probs))
+        return probs[:, 1]
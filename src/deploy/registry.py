@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Registry locale dei modelli: versioni immutabili + puntatori atomici.
+
+  <root>/versions/<versione>/   lgbm_model.onnx, feature_spec.json (feature +
+                                statistiche di normalizzazione), metrics.json,
+                                lgbm_model.pkl (opz.), manifest.json
+  <root>/production             puntatore: nome della versione servita
+  <root>/candidate              puntatore: versione in shadow (opzionale)
+  <root>/history.jsonl          promozioni / rollback in append
+
+  • versione = <timestamp>-<sha256 di onnx + spec + metriche[:8]>: ripubblicare
+    gli stessi file restituisce la versione esistente; lo stesso onnx con
+    un altro spec (altra normalizzazione) è una versione nuova
+  • la cartella viene scritta in <root>/versions/.tmp-* e rinominata con
+    os.replace: una versione visibile è sempre completa
+  • i puntatori sono file di una riga riscritti con tmp + os.replace: il
+    gateway (--registry) li rilegge ogni --watch-s secondi e fa hot-swap
+    senza riavvio; nessuno legge mai un puntatore scritto a metà
+
+Uso:
+  python src/deploy/registry.py publish --onnx models/onnx/lgbm_model.onnx --pkl models/checkpoints/lgbm_model.pkl --candidate
+  python src/deploy/registry.py list
+  python src/deploy/registry.py promote            # candidate → production
+  python src/deploy/registry.py rollback           # production precedente
+"""
+
+import argparse, hashlib, json, os, shutil, sys, uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+REGISTRY = Path(os.environ.get("MODEL_REGISTRY", "models/registry"))
+POINTERS = ("production", "candidate")
+MODEL_FILE, SPEC_FILE, METRICS_FILE, PKL_FILE = ("lgbm_model.onnx", "feature_spec.json",
+                                                 "metrics.json", "lgbm_model.pkl")
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _content_hash(*paths) -> str:
+    """Hash dei file che definiscono una versione (None = assente)."""
+    h = hashlib.sha256()
+    for p in paths:
+        h.update(_sha256(p).encode() if p is not None else b"-")
+    return h.hexdigest()
+
+
+def _write_atomic(path: Path, text: str):
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}")
+    with open(tmp, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+# ────────────────────────────────
+# 1️⃣  Versioni
+# ────────────────────────────────
+def version_dir(root: Path, version: str) -> Path:
+    return Path(root) / "versions" / version
+
+
+def manifest(root: Path, version: str) -> dict:
+    with open(version_dir(root, version) / "manifest.json") as f:
+        return json.load(f)
+
+
+def versions(root: Path = REGISTRY) -> list:
+    """Manifest delle versioni complete, dalla più vecchia."""
+    d = Path(root) / "versions"
+    if not d.exists():
+        return []
+    return [manifest(root, p.name) for p in sorted(d.iterdir())
+            if not p.name.startswith(".") and (p / "manifest.json").exists()]
+
+
+def publish(onnx: Path, spec: Path = None, root: Path = REGISTRY, pkl: Path = None,
+            metrics: Path = None, note: str = None) -> str:
+    """Copia modello + spec (+ pkl, metriche) in una nuova versione; ritorna il nome.
+
+    Senza spec la versione serve solo /predict (niente /predict_bars).
+    """
+    onnx = Path(onnx)
+    metrics = Path(metrics) if metrics else (Path(pkl).parent / METRICS_FILE if pkl else None)
+    if metrics is not None and not metrics.exists():
+        metrics = None
+    sha = _sha256(onnx)
+    content = _content_hash(onnx, spec, metrics)
+    for m in versions(root):
+        if m.get("content") == content:
+            return m["version"]
+    version = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{content[:8]}"
+    base = Path(root) / "versions"
+    base.mkdir(parents=True, exist_ok=True)
+    tmp = base / f".tmp-{uuid.uuid4().hex[:8]}"
+    tmp.mkdir()
+    try:
+        shutil.copyfile(onnx, tmp / MODEL_FILE)
+        man = dict(version=version, created=_now(), sha256=sha, content=content,
+                   source=str(onnx), note=note)
+        if spec is not None:
+            shutil.copyfile(spec, tmp / SPEC_FILE)
+            with open(spec) as f:
+                s = json.load(f)
+            man.update(spec=s.get("hash"), features=len(s["features"]),
+                       norm=s.get("norm", {}).get("mode"))
+        if pkl and Path(pkl).exists():
+            shutil.copyfile(pkl, tmp / PKL_FILE)
+        if metrics is not None:
+            shutil.copyfile(metrics, tmp / METRICS_FILE)
+            with open(metrics) as f:
+                m = json.load(f)
+            man["metrics"] = {k: v for k, v in m.items() if not isinstance(v, (dict, list))}
+        with open(tmp / "manifest.json", "w") as f:
+            json.dump(man, f, indent=2)
+        os.replace(tmp, version_dir(root, version))
+    finally:
+        if tmp.exists():
+            shutil.rmtree(tmp)
+    return version
+
+
+# ────────────────────────────────
+# 2️⃣  Puntatori
+# ────────────────────────────────
+def get_pointer(root: Path = REGISTRY, name: str = "production"):
+    try:
+        v = (Path(root) / name).read_text().strip()
+    except FileNotFoundError:
+        return None
+    return v or None
+
+
+def set_pointer(root: Path, name: str, version, reason: str = None):
+    """Punta `name` a `version` (None = rimuove) e registra il cambio in history."""
+    if name not in POINTERS:
+        raise ValueError(f"Puntatore sconosciuto: {name} (attesi {POINTERS})")
+    root = Path(root)
+    if version is not None and not (version_dir(root, version) / "manifest.json").exists():
+        raise ValueError(f"Versione non trovata nel registry {root}: {version}")
+    prev = get_pointer(root, name)
+    if version is None:
+        (root / name).unlink(missing_ok=True)
+    else:
+        _write_atomic(root / name, version + "\n")
+    with open(root / "history.jsonl", "a") as f:
+        f.write(json.dumps(dict(ts=_now(), pointer=name, version=version, previous=prev,
+                                reason=reason)) + "\n")
+    return prev
+
+
+def resolve(root: Path = REGISTRY, ref: str = "production"):
+    """production / candidate / latest / nome versione → cartella (None se assente)."""
+    if ref in POINTERS:
+        ref = get_pointer(root, ref)
+    elif ref == "latest":
+        vs = versions(root)
+        ref = vs[-1]["version"] if vs else None
+    return version_dir(root, ref) if ref else None
+
+
+def promote(root: Path = REGISTRY, version: str = None) -> str:
+    """production ← version (default: candidate); il candidate viene rimosso."""
+    cand = get_pointer(root, "candidate")
+    version = version or cand
+    if version is None:
+        raise ValueError("Nessun candidate da promuovere")
+    set_pointer(root, "production", version, reason="promote")
+    if cand == version:
+        set_pointer(root, "candidate", None, reason="promoted")
+    return version
+
+
+def rollback(root: Path = REGISTRY) -> str:
+    """production ← versione servita prima di quella attuale (rollback ripetuti risalgono la storia)."""
+    cur = get_pointer(root, "production")
+    path = Path(root) / "history.jsonl"
+    hist = [json.loads(line) for line in open(path)] if path.exists() else []
+    for h in reversed(hist):
+        if (h["pointer"] == "production" and h["version"] == cur
+                and h.get("reason") != "rollback" and h["previous"] not in (None, cur)):
+            set_pointer(root, "production", h["previous"], reason="rollback")
+            return h["previous"]
+    raise ValueError(f"Nessuna versione precedente a {cur} in history")
+
+
+# ────────────────────────────────
+# 3️⃣  CLI
+# ────────────────────────────────
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Registry modelli: versioni + puntatori")
+    p.add_argument("--root", default=str(REGISTRY), help="Cartella del registry (env MODEL_REGISTRY)")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    pub = sub.add_parser("publish", help="Registra un modello ONNX (+ spec, pkl, metriche)")
+    pub.add_argument("--onnx", default="models/onnx/lgbm_model.onnx")
+    pub.add_argument("--spec", default=None, help="Default: feature_spec.json accanto all'onnx")
+    pub.add_argument("--pkl", default=None, help="Modello LightGBM (metrics.json accanto)")
+    pub.add_argument("--note", default=None)
+    g = pub.add_mutually_exclusive_group()
+    g.add_argument("--candidate", action="store_true", help="Mette la versione in shadow")
+    g.add_argument("--production", action="store_true", help="Serve subito la versione")
+    sub.add_parser("list", help="Versioni e puntatori")
+    pr = sub.add_parser("promote", help="production ← candidate (o --version)")
+    pr.add_argument("--version", default=None)
+    c = sub.add_parser("candidate", help="Imposta (o rimuove con --clear) il candidate")
+    c.add_argument("--version", default=None)
+    c.add_argument("--clear", action="store_true")
+    sub.add_parser("rollback", help="production ← versione precedente")
+    return p.parse_args(argv)
+
+
+def main(args):
+    root = Path(args.root)
+    try:
+        if args.cmd == "publish":
+            spec = Path(args.spec) if args.spec else Path(args.onnx).parent / SPEC_FILE
+            v = publish(args.onnx, spec if spec.exists() else None, root, args.pkl, note=args.note)
+            print(f"✅ Versione {v} in {version_dir(root, v)}")
+            if args.candidate or args.production:
+                set_pointer(root, "candidate" if args.candidate else "production", v, reason="publish")
+                print(f"→ {'candidate' if args.candidate else 'production'} = {v}")
+        elif args.cmd == "list":
+            ptr = {n: get_pointer(root, n) for n in POINTERS}
+            for m in versions(root):
+                tags = [n for n, v in ptr.items() if v == m["version"]]
+                met = m.get("metrics", {})
+                print(f"{m['version']}  spec {m.get('spec') or '-'}  feature {m.get('features', '-')}  "
+                      f"score {met.get('best_score', '-')}  {' '.join(f'[{t}]' for t in tags)}")
+        elif args.cmd == "promote":
+            print(f"✅ production = {promote(root, args.version)}")
+        elif args.cmd == "candidate":
+            v = None if args.clear else (args.version or versions(root)[-1]["version"])
+            set_pointer(root, "candidate", v, reason="candidate")
+            print(f"✅ candidate = {v}")
+        elif args.cmd == "rollback":
+            print(f"✅ production = {rollback(root)}")
+    except (ValueError, FileNotFoundError, IndexError) as e:
+        print(f"⚠️  {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(parse_args())
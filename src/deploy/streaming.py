@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Feature online per il gateway: barre OHLCV grezze → vettori normalizzati.
+
+Per ogni simbolo un ring buffer a capacità fissa tiene le ultime
+`lookback` barre: la barra nuova viene scritta in O(1) e le feature
+vengono calcolate con la stessa etl.features.compute del batch, sulla
+finestra minima necessaria, poi normalizzate con lo stesso etl.normalize:
+ogni simbolo riparte dallo stato di fine storia salvato nello spec
+(global → mean/std fissi, expanding/rolling → cumulative in O(1) per barra).
+Lo stato expanding/rolling è quello del simbolo su cui lo spec è stato
+fittato (spec["symbol"]): altri simboli vengono rifiutati invece di partire
+dalle statistiche di un altro strumento; con global ogni simbolo va bene.
+Con uno spec float32 barre e feature grezze vengono arrotondate a float32
+come nel batch (prezzi float32 su disco).
+"""
+
+import sys
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/ nel path
+from etl import features as F
+from etl.normalize import Normalizer
+
+SPEC_PATH = Path("models/onnx/feature_spec.json")
+
+
+class RingBuffer:
+    """Ultime `capacity` barre (righe float64) con i loro timestamp (int64 ns)."""
+
+    def __init__(self, capacity: int, width: int):
+        self.buf = np.zeros((capacity, width))
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.capacity, self.head, self.count = capacity, 0, 0
+        self.last_time = None
+
+    def push(self, times: np.ndarray, rows: np.ndarray):
+        times, rows = times[-self.capacity:], rows[-self.capacity:]
+        n = len(rows)
+        idx = (self.head + np.arange(n)) % self.capacity
+        self.buf[idx], self.times[idx] = rows, times
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+        self.last_time = int(times[-1])
+
+    def tail(self, k: int):
+        """Ultime min(k, count) barre in ordine cronologico → (times, rows)."""
+        k = min(k, self.count)
+        idx = (self.head - k + np.arange(k)) % self.capacity
+        return self.times[idx], self.buf[idx]
+
+
+class FeatureStream:
+    """Stato per simbolo + spec: update() restituisce X float32 pronto per il modello."""
+
+    def __init__(self, spec: dict):
+        self.spec = spec
+        self.lookback = F.lookback(spec["features"])
+        self.features = spec["features"]
+        self.dtype = np.dtype(spec.get("dtype", "float64"))
+        self.buffers: dict[str, RingBuffer] = {}
+        self.norms: dict[str, Normalizer] = {}
+
+    @property
+    def n_features(self) -> int:
+        return len(self.features)
+
+    def accepts(self, symbol: str) -> bool:
+        """False se lo stato di normalizzazione dello spec è di un altro simbolo."""
+        if self.spec["norm"]["mode"] == "global":
+            return True
+        owner = self.spec.get("symbol")
+        if owner is None:           # spec senza simbolo: lo stato va al primo che arriva
+            owner = next(iter(self.norms), symbol)
+        return symbol == owner
+
+    def update(self, symbol: str, times: np.ndarray, bars: np.ndarray) -> np.ndarray:
+        """Accoda barre (n, 5) OHLCV con times int64 ns crescenti; ritorna (n, n_features).
+
+        Le righe senza storia sufficiente (avvio a freddo) escono a NaN.
+        """
+        if len(bars) == 0:          # niente da accodare: buffer e stato invariati
+            return np.empty((0, self.n_features), np.float32)
+        rb = self.buffers.get(symbol)
+        if rb is None:
+            if not self.accepts(symbol):
+                raise ValueError(f"{symbol}: normalizzazione {self.spec['norm']['mode']} fittata "
+                                 f"su {self.spec.get('symbol') or next(iter(self.norms))}, "
+                                 f"serve uno spec per {symbol}")
+            rb = self.buffers[symbol] = RingBuffer(max(self.lookback, 1), bars.shape[1])
+            self.norms[symbol] = Normalizer.from_dict(self.features, self.spec["norm"])
+        if len(times) and ((rb.last_time is not None and times[0] <= rb.last_time)
+                           or np.any(np.diff(times) <= 0)):
+            raise ValueError(f"{symbol}: barre non in ordine o già ricevute "
+                             f"(ultima {rb.last_time})")
+
+        if self.dtype != np.float64:
+            bars = bars.astype(self.dtype).astype(np.float64)
+        h_times, hist = rb.tail(self.lookback - 1)
+        window = np.vstack([hist, bars])
+        raw = F.compute(dict(zip(F.INPUTS, window.T)), np.concatenate([h_times, times]),
+                        self.features)
+        X = np.column_stack([raw[c] for c in self.features])[-len(bars):].astype(self.dtype)
+
+        # prime barre senza lookback pieno: NaN e fuori dallo stato di normalizzazione
+        missing = min(max(self.lookback - 1 - len(hist), 0), len(X))
+        X[:missing] = np.nan
+        X[missing:] = self.norms[symbol].transform(X[missing:])
+        rb.push(times, bars)
+        return X.astype(np.float32)
+
+    def carry_over(self, other: "FeatureStream"):
+        """Riempie i ring buffer con le ultime barre grezze di `other` (hot-swap).
+
+        Le barre passano da update() senza storia: escono a NaN, quindi lo
+        stato della normalizzazione resta quello dello spec.
+        """
+        if self.lookback <= 1:
+            return
+        for symbol, rb in other.buffers.items():
+            times, rows = rb.tail(self.lookback - 1)
+            if len(times) and self.accepts(symbol):
+                self.update(symbol, times, rows)
+
+    def reset(self, symbol: str = None):
+        if symbol is None:
+            self.buffers.clear()
+            self.norms.clear()
+        else:
+            self.buffers.pop(symbol, None)
+            self.norms.pop(symbol, None)
+
+
+def load_stream(path: Path = SPEC_PATH) -> FeatureStream:
+    return FeatureStream(F.load_spec(path))
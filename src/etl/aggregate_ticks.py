@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Aggrega tick Dukascopy (CSV dukascopy-node -t tick) in barre OHLCV:
+  • time   → una barra ogni --size (es. 1min, 5min)
+  • tick   → una barra ogni --size tick
+  • volume → una barra ogni --size di volume scambiato
+  • dollar → una barra ogni --size di controvalore (prezzo × volume)
+
+Bucketing vettoriale: id barra = floor(cumsum / soglia) (per le barre a
+tempo = timestamp // durata), poi riduzione per run di id uguali con
+np.*.reduceat. Lettura a chunk → RAM limitata al chunk. La cumulata è
+intera (tick contati, volume/controvalore quantizzati a soglia / 2^32):
+somme esatte, quindi gli id non dipendono da come i tick sono divisi fra
+chunk e file.
+
+Parallelismo: un file per periodo (es. un mese, come li scarica
+dukascopy-node) = un segmento. Per le barre tick/volume/dollar un primo
+passaggio parallelo calcola il totale della cumulata di ogni segmento, da
+cui gli offset globali; il secondo passaggio aggrega i segmenti in
+parallelo e le barre parziali a cavallo fra chunk/segmenti (stesso id)
+vengono ricucite.
+
+Output: time + Open/High/Low/Close, Volume = numero di tick (come il
+TICKVOL di MT5), Size = volume scambiato; stesso formato (float32)
+dell'output di clean.py, pronto per label.py.
+"""
+
+import argparse, glob, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/ nel path
+from etl import store
+from utils.logger import setup_logging
+from utils.profiling import profiled, lap
+
+# ────────────────────────────────
+# 1️⃣  Logging
+# ────────────────────────────────
+L = setup_logging("aggregate", "aggregate_ticks")
+
+TICK_DTYPES = {"timestamp": "int64", "askPrice": "float64", "bidPrice": "float64",
+               "askVolume": "float64", "bidVolume": "float64"}
+BARS = ("time", "tick", "volume", "dollar")
+FIELDS = ("bucket", "time", "Open", "High", "Low", "Close", "Volume", "Size")
+QUANT_BITS = 32     # volume/dollar: cumulata in unità intere di soglia / 2^32
+
+
+# ────────────────────────────────
+# 2️⃣  Lettura tick
+# ────────────────────────────────
+def read_ticks(path: Path, chunksize: int, price: str = "mid"):
+    """Chunk (ts_ns, price, size) da un CSV tick; righe invalide scartate."""
+    last = None
+    for chunk in pd.read_csv(path, usecols=list(TICK_DTYPES), dtype=TICK_DTYPES,
+                             chunksize=chunksize):
+        size = (chunk["askVolume"] + chunk["bidVolume"]).to_numpy()
+        ts = chunk["timestamp"].to_numpy() * 1_000_000
+        px = _price(chunk, price)
+        ok = np.isfinite(px) & (px > 0) & np.isfinite(size)
+        if not ok.all():
+            ts, px, size = ts[ok], px[ok], size[ok]
+        if len(ts) and ((last is not None and ts[0] < last) or np.any(np.diff(ts) < 0)):
+            raise ValueError(f"{path}: tick non ordinati per timestamp")
+        if len(ts):
+            last = ts[-1]
+        yield ts, px, size
+
+
+def _price(chunk: pd.DataFrame, price: str) -> np.ndarray:
+    if price == "bid":
+        return chunk["bidPrice"].to_numpy()
+    if price == "ask":
+        return chunk["askPrice"].to_numpy()
+    return (chunk["askPrice"].to_numpy() + chunk["bidPrice"].to_numpy()) / 2
+
+
+def _units(bar: str, px: np.ndarray, size: np.ndarray, threshold: float) -> np.ndarray:
+    """Contributo intero (int64) di ogni tick alla cumulata che chiude la barra.
+
+    Con passi interi la somma è associativa: il totale del passaggio 1 più
+    le cumulate del passaggio 2 danno esattamente gli stessi valori di un
+    run su un file unico, con qualsiasi divisione in chunk.
+    """
+    if bar == "tick":
+        return np.ones(len(px), dtype=np.int64)
+    step = size if bar == "volume" else px * size
+    return np.rint(step * (2.0 ** QUANT_BITS / threshold)).astype(np.int64)
+
+
+def _bucket(bar: str, before: np.ndarray, threshold: float) -> np.ndarray:
+    if bar == "tick":
+        return np.floor(before / threshold).astype(np.int64)   # interi esatti in float64
+    return before >> QUANT_BITS
+
+
+def segment_total(path: str, bar: str, threshold: float, price: str, chunksize: int) -> int:
+    """Passaggio 1: totale (intero) della cumulata del segmento, stessi filtri del passaggio 2."""
+    total = 0
+    for _, px, size in read_ticks(path, chunksize, price):
+        total += int(_units(bar, px, size, threshold).sum())
+    return total
+
+
+# ────────────────────────────────
+# 3️⃣  Bucketing + riduzione
+# ────────────────────────────────
+def reduce_runs(b: dict) -> dict:
+    """Fonde le righe consecutive con lo stesso bucket (tick → barre, o barre parziali)."""
+    bucket = b["bucket"]
+    if len(bucket) == 0:
+        return b
+    starts = np.r_[0, np.flatnonzero(np.diff(bucket)) + 1]
+    ends = np.r_[starts[1:], len(bucket)] - 1
+    return dict(bucket=bucket[starts], time=b["time"][starts],
+                Open=b["Open"][starts], Close=b["Close"][ends],
+                High=np.maximum.reduceat(b["High"], starts),
+                Low=np.minimum.reduceat(b["Low"], starts),
+                Volume=np.add.reduceat(b["Volume"], starts),
+                Size=np.add.reduceat(b["Size"], starts))
+
+
+def empty() -> dict:
+    return {k: np.array([], dtype=np.int64 if k in ("bucket", "time", "Volume") else np.float64)
+            for k in FIELDS}
+
+
+def concat(a: dict, b: dict) -> dict:
+    return {k: np.concatenate([a[k], b[k]]) for k in FIELDS}
+
+
+def split_last(b: dict):
+    """(barre complete, ultima barra ancora aperta)."""
+    return ({k: v[:-1] for k, v in b.items()}, {k: v[-1:] for k, v in b.items()})
+
+
+def aggregate_segment(path: str, bar: str, size: float, price: str,
+                      offset: int, chunksize: int) -> dict:
+    """Passaggio 2 su un segmento: barre con id globale (offset = cumulata iniziale)."""
+    out, carry, cum = [], None, offset
+    for ts, px, sz in read_ticks(path, chunksize, price):
+        if len(ts) == 0:
+            continue
+        if bar == "time":
+            bucket = ts // size
+        else:
+            c = cum + np.cumsum(_units(bar, px, sz, size))
+            before = np.r_[cum, c[:-1]]            # cumulata prima del tick
+            bucket = _bucket(bar, before, size)
+            cum = int(c[-1])
+        bars = reduce_runs(dict(bucket=bucket, time=ts, Open=px, High=px, Low=px, Close=px,
+                                Volume=np.ones(len(ts), dtype=np.int64), Size=sz))
+        if carry is not None:
+            bars = reduce_runs(concat(carry, bars))
+        done, carry = split_last(bars)
+        out.append(done)
+    if carry is not None:
+        out.append(carry)
+    if not out:
+        return empty()
+    return {k: np.concatenate([o[k] for o in out]) for k in FIELDS}
+
+
+def to_frame(bars: dict, bar: str, size) -> pd.DataFrame:
+    t = bars["bucket"] * size if bar == "time" else bars["time"]
+    df = pd.DataFrame({k: bars[k] for k in ("Open", "High", "Low", "Close", "Volume", "Size")},
+                      index=pd.DatetimeIndex(t.astype("datetime64[ns]"), name="time"))
+    df["Volume"] = df["Volume"].astype("int64")
+    return df.astype({c: store.PRICE_DTYPE for c in ("Open", "High", "Low", "Close", "Size")})
+
+
+# ────────────────────────────────
+# 4️⃣  Main
+# ────────────────────────────────
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Tick Dukascopy → barre time/tick/volume/dollar")
+    p.add_argument("--input", nargs="+", default=["data/raw/ticks/*.csv"],
+                   help="CSV tick (uno per periodo, glob ammessi)")
+    p.add_argument("--output", default="data/processed/EURUSD_M1_clean.parquet",
+                   help="Barre (stesso formato di clean.py)")
+    p.add_argument("--bar", choices=BARS, default="time", help="Tipo di barra")
+    p.add_argument("--size", default="1min",
+                   help="Durata (time, es. 1min) o soglia (tick/volume/dollar)")
+    p.add_argument("--price", choices=("mid", "bid", "ask"), default="mid")
+    p.add_argument("--chunksize", type=int, default=5_000_000, help="Tick per chunk")
+    p.add_argument("--workers", type=int, default=4, help="Segmenti in parallelo")
+    p.add_argument("--symbol", default="EURUSD", help="Simbolo (dataset hive / stato)")
+    p.add_argument("--state", default=str(store.STATE_PATH), help="File stato incrementale")
+    return p.parse_args(argv)
+
+
+@profiled("aggregate_ticks")
+def main(args):
+    files = sorted({f for pat in args.input for f in glob.glob(pat)})
+    if not files:
+        L.error(f"⚠️  Nessun file tick per {args.input}")
+        sys.exit(1)
+    size = pd.Timedelta(args.size).value if args.bar == "time" else float(args.size)
+    if size <= 0:
+        L.error("⚠️  --size deve essere > 0")
+        sys.exit(1)
+    L.info(f"Segmenti: {len(files)}  barre: {args.bar} {args.size}  prezzo: {args.price}")
+    t0 = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=min(args.workers, len(files))) as ex:
+        offsets = [0] * len(files)
+        if args.bar != "time":
+            totals = list(ex.map(segment_total, files, [args.bar] * len(files), [size] * len(files),
+                                 [args.price] * len(files), [args.chunksize] * len(files)))
+            offsets = np.r_[0, np.cumsum(totals, dtype=np.int64)[:-1]].tolist()
+            L.info(f"Passaggio 1 (totali per segmento) in {time.perf_counter() - t0:.1f}s")
+        futs = [ex.submit(aggregate_segment, f, args.bar, size, args.price, off, args.chunksize)
+                for f, off in zip(files, offsets)]
+        parts = []
+        for f, fut in zip(files, futs):
+            try:
+                parts.append(fut.result())
+            except ValueError as e:
+                L.error(f"⚠️  {e}")
+                sys.exit(1)
+            L.info(f"  {Path(f).name}: {len(parts[-1]['bucket']):,} barre (parziali incluse)")
+
+    parts = [p for p in parts if len(p["bucket"])]
+    for a, b in zip(parts[:-1], parts[1:]):
+        if b["time"][0] < a["time"][-1]:
+            L.error("⚠️  Segmenti sovrapposti nel tempo: controlla i file di input")
+            sys.exit(1)
+    # ricucitura ai confini: le barre con lo stesso id globale si fondono
+    bars = reduce_runs({k: np.concatenate([empty()[k]] + [p[k] for p in parts]) for k in FIELDS})
+    df = to_frame(bars, args.bar, size)
+    if df.index.has_duplicates:
+        L.warning(f"Barre con lo stesso timestamp di apertura: {df.index.duplicated().sum():,}")
+    L.info(f"Tick aggregati: {int(df['Volume'].sum()):,} → barre: {len(df):,} "
+           f"in {time.perf_counter() - t0:.1f}s")
+    lap("aggregate", rows=int(df["Volume"].sum()))   # righe = tick
+
+    store.write(df, args.output, args.symbol)
+    if len(df):
+        store.set_stage(args.symbol, "clean", df.index[-1], args.state, bar=args.bar,
+                        size=args.size)
+    lap("write", rows=len(df))
+    L.info(f"✅ Barre salvate: {args.output}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -2,58 +2,88 @@
 """
 Pulizia e deduplicazione dati M1 o tick aggregato.
 - Logging a file + console
-- Validazione schema Pandera (Volume opzionale)
+- Validazione vettoriale di tutte le righe (etl/validate.py): ordine e
+  duplicati dell'input grezzo (warning contati, clean li risolve); OHLC, NaN,
+  gap dell'output pulito anche fra chunk → report logs/quality/clean_<S>.json;
+  schema Pandera completo solo con --deep-validate
 - Gestisce timestamp in ms (Dukascopy) o DATE+TIME (MT5)
+- Modalità streaming (--chunksize): lettura a chunk con dtype espliciti,
+  scrittura a row group e merge ordinato fra chunk → RAM limitata al chunk
+- Prezzi float32 (store.PRICE_DTYPE): metà RAM e disco, precisione ben
+  sotto il point anche sulle coppie JPY
 """
 
-import argparse, logging, sys
+import argparse, shutil, sys, tempfile, time
 from pathlib import Path
+import numpy as np
 import pandas as pd
-import pandera as pa
-from pandera import Column, DataFrameSchema, Check
+import pyarrow as pa_arrow
+import pyarrow.parquet as pq
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/ nel path
+from etl import store
+from etl import validate as V
+from utils.logger import setup_logging
+from utils.profiling import profiled, lap
 
 # ────────────────────────────────
 # 1️⃣  Logging
 # ────────────────────────────────
-LOG_DIR = Path("logs"); LOG_DIR.mkdir(exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_DIR / "clean.log"),
-        logging.StreamHandler(sys.stdout)
-    ],
-)
-L = logging.getLogger("clean")
+L = setup_logging("clean")
 
 # ────────────────────────────────
-# 2️⃣  Schema Pandera (Volume non obbligatorio)
+# 2️⃣  Dtype attesi (Volume non obbligatorio)
 # ────────────────────────────────
-schema = DataFrameSchema({
-    "Open":   Column(float, Check(lambda s: s.notna())),
-    "High":   Column(float, Check(lambda s: s.notna())),
-    "Low":    Column(float, Check(lambda s: s.notna())),
-    "Close":  Column(float, Check(lambda s: s.notna())),
-    "Volume": Column(int,   Check.ge(0), nullable=True)
-})
+DTYPES = {c: store.PRICE_DTYPE for c in V.PRICES}
 
 # ────────────────────────────────
 # 3️⃣  Funzione load
 # ────────────────────────────────
-def load_csv(path: Path) -> pd.DataFrame:
-    """Carica CSV da Dukascopy-node (timestamp) o MT5 (DATE+TIME)."""
-    sep_guess = "\t" if "\t" in open(path, "r").readline() else ","
-    df = pd.read_csv(path, sep=sep_guess)
+PX = np.dtype(store.PRICE_DTYPE).name
+MT5_DTYPES = {"DATE": str, "TIME": str, "OPEN": PX, "HIGH": PX,
+              "LOW": PX, "CLOSE": PX, "TICKVOL": "int64"}
+DUKA_DTYPES = {"timestamp": "int64", "open": PX, "high": PX,
+               "low": PX, "close": PX, "volume": "float64"}
+
+
+def sniff_csv(path: Path) -> dict:
+    """Legge solo l'header: separatore, formato (mt5 / dukascopy), usecols e dtype."""
+    with open(path, "r") as f:
+        header = f.readline()
+    sep = "\t" if "\t" in header else ","
+    raw_cols = [c.strip() for c in header.rstrip("\r\n").split(sep)]
+    names = {c: c.replace("<", "").replace(">", "").strip() for c in raw_cols}
+
+    if "DATE" in names.values():        # Export MT5
+        dtypes = {c: MT5_DTYPES[n] for c, n in names.items() if n in MT5_DTYPES}
+        kind = "mt5"
+    elif "timestamp" in names.values(): # Dukascopy timestamp ms
+        dtypes = {c: DUKA_DTYPES[n] for c, n in names.items() if n in DUKA_DTYPES}
+        kind = "dukascopy"
+    else:
+        L.error("⚠️  CSV non contiene colonne DATE+TIME o timestamp.")
+        sys.exit(1)
+    return dict(sep=sep, kind=kind, usecols=list(dtypes), dtype=dtypes, names=names)
+
 
-    if "DATE" in df.columns:     # Export MT5
-        df.columns = [c.replace("<", "").replace(">", "").strip() for c in df.columns]
-        df["time"] = pd.to_datetime(df["DATE"] + " " + df["TIME"])
+def to_ohlcv(df: pd.DataFrame, kind: str, names: dict,
+             date_format: str = "%Y.%m.%d") -> pd.DataFrame:
+    """Normalizza un (chunk di) CSV raw in colonne time + OHLCV."""
+    df = df.rename(columns=names)
+    if kind == "mt5":
+        # DATE ha pochi valori distinti (cache), TIME al massimo 1440:
+        # si parsano solo i valori unici, niente concatenazione di stringhe.
+        date = pd.to_datetime(df["DATE"], format=date_format, cache=True)
+        codes, uniq = pd.factorize(df["TIME"])
+        tod = pd.to_timedelta(uniq).to_numpy()[codes]
+        df["time"] = date.to_numpy() + tod
         df = df.rename(columns={
             "OPEN": "Open", "HIGH": "High", "LOW": "Low",
             "CLOSE": "Close", "TICKVOL": "Volume"
         })
-    elif "timestamp" in df.columns:  # Dukascopy timestamp ms
-        df["time"] = pd.to_datetime(df["timestamp"], unit="ms")
+    else:
+        ms = df["timestamp"].to_numpy(dtype="int64")
+        df["time"] = ms.astype("datetime64[ms]").astype("datetime64[ns]")
         df = df.rename(columns={
             "open": "Open", "high": "High", "low": "Low",
             "close": "Close"
@@ -63,11 +93,15 @@ def load_csv(path: Path) -> pd.DataFrame:
             df = df.rename(columns={"volume": "Volume"})
         else:
             df["Volume"] = 0
-    else:
-        L.error("⚠️  CSV non contiene colonne DATE+TIME o timestamp.")
-        sys.exit(1)
     return df
 
+
+def load_csv(path: Path, date_format: str = "%Y.%m.%d") -> pd.DataFrame:
+    """Carica CSV da Dukascopy-node (timestamp) o MT5 (DATE+TIME)."""
+    fmt = sniff_csv(path)
+    df = pd.read_csv(path, sep=fmt["sep"], usecols=fmt["usecols"], dtype=fmt["dtype"])
+    return to_ohlcv(df, fmt["kind"], fmt["names"], date_format)
+
 # ────────────────────────────────
 # 4️⃣  Funzione clean
 # ────────────────────────────────
@@ -75,13 +109,178 @@ def clean(df: pd.DataFrame) -> pd.DataFrame:
     df = (df
         .set_index("time")
         [["Open", "High", "Low", "Close", "Volume"]]
-        .sort_index())
+        .sort_index(kind="stable"))   # a parità di time resta la prima riga del file
     df = df.loc[~df.index.duplicated()]
     return df
 
 # ────────────────────────────────
-# 5️⃣  Main
+# 5️⃣  Streaming a chunk
+# ────────────────────────────────
+def check_raw(df: pd.DataFrame, rep: V.Report, prev=None):
+    """Ordine e duplicati dell'input grezzo (output di to_ohlcv, prima di clean):
+    clean li risolve, quindi sono warning contati; `prev` = ultimo time del chunk prima."""
+    t0 = time.perf_counter()
+    V.check_order(pd.DatetimeIndex(df["time"]), rep, prev, level="warning")
+    rep.secs += time.perf_counter() - t0
+
+
+def validate(df: pd.DataFrame, rep: V.Report, deep: bool = False, prev=None):
+    """Controlli sulle righe pulite in uscita, accumulati in `rep` (anche fra chunk):
+    `prev` = ultimo timestamp già scritto, così i gap a cavallo dei chunk contano."""
+    V.validate(df, rep, bars=True, dtypes=DTYPES, prev=prev, deep=deep)
+
+
+def _write(writer, df: pd.DataFrame, path: Path):
+    table = pa_arrow.Table.from_pandas(df)
+    if writer is None:
+        writer = pq.ParquetWriter(path, table.schema)
+    writer.write_table(table)
+    return writer
+
+
+def _read_batches(path: Path, batch_rows: int):
+    for b in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+        df = b.to_pandas()
+        yield df.set_index("time") if "time" in df.columns else df
+
+
+def merge_runs(runs: list, out_path: Path, batch_rows: int, rep: V.Report = None,
+               deep: bool = False):
+    """K-way merge di run parquet già ordinati e deduplicati.
+
+    Da ogni run si tiene in RAM un solo batch; si emettono le righe fino al
+    watermark = minimo dei max dei batch dei run non esauriti (nessun run
+    può più produrre timestamp inferiori). A parità di timestamp vince il
+    run più vecchio (ordine di file), come nel dedup keep-first.
+    `rep`: validazione delle righe fuse, nell'ordine in cui vengono scritte.
+    Ritorna (righe scritte, primo timestamp, ultimo timestamp).
+    """
+    iters = [_read_batches(r, batch_rows) for r in runs]
+    bufs  = [next(it, None) for it in iters]
+    done  = [b is None for b in bufs]
+    writer, first, last, rows = None, None, None, 0
+
+    while not all(b is None for b in bufs):
+        live = [b.index[-1] for b, d in zip(bufs, done) if b is not None and not d]
+        wm = min(live) if live else None
+        parts = []
+        for k, b in enumerate(bufs):
+            if b is None:
+                continue
+            cut = len(b) if wm is None else b.index.searchsorted(wm, side="right")
+            parts.append(b.iloc[:cut])
+            bufs[k] = b.iloc[cut:]
+            if len(bufs[k]) == 0:
+                bufs[k] = next(iters[k], None)
+                done[k] = bufs[k] is None
+        out = pd.concat(parts).sort_index(kind="stable")
+        out = out.loc[~out.index.duplicated()]
+        if last is not None:
+            out = out.loc[out.index > last]
+        if len(out):
+            if rep is not None:
+                validate(out, rep, deep, prev=last)
+            writer = _write(writer, out, out_path)
+            first = out.index[0] if first is None else first
+            last, rows = out.index[-1], rows + len(out)
+    if writer is not None:
+        writer.close()
+    return rows, first, last
+
+
+def stream_clean(raw_csv: Path, out_path: Path, chunksize: int,
+                 date_format: str = "%Y.%m.%d", after=None, rep: V.Report = None,
+                 deep: bool = False):
+    """CSV → parquet a chunk. Ritorna (righe lette, righe scritte, primo ts, ultimo ts).
+
+    Caso normale (export già in ordine temporale): ogni chunk ordinato e
+    deduplicato va dritto nel parquet come row group, scartando i timestamp
+    già scritti. Al primo chunk fuori ordine si passa a run temporanei
+    ordinati + merge finale, sempre a memoria limitata.
+    `after`: scarta i timestamp <= after (già processati, modalità incrementale).
+    `rep`: report di validazione: ordine/duplicati dell'input grezzo chunk per
+    chunk, poi le righe pulite nell'ordine in cui finiscono nel parquet (gap
+    anche a cavallo dei chunk; col merge si rivalida l'output fuso).
+    """
+    fmt = sniff_csv(raw_csv)
+    reader = pd.read_csv(raw_csv, sep=fmt["sep"], usecols=fmt["usecols"],
+                         dtype=fmt["dtype"], chunksize=chunksize)
+
+    tmp = Path(tempfile.mkdtemp(prefix="clean_runs_", dir=out_path.parent))
+    writer, first, last, runs = None, None, None, []
+    rows_in = rows_out = 0
+    raw_last, out_rep = None, V.Report(rep.stage, rep.symbol) if rep is not None else None
+    try:
+        for raw in reader:
+            rows_in += len(raw)
+            df = to_ohlcv(raw, fmt["kind"], fmt["names"], date_format)
+            if rep is not None and len(df):
+                check_raw(df, rep, raw_last)
+                raw_last = df["time"].iloc[-1]
+            df = clean(df)
+            if after is not None:
+                df = df.loc[df.index > after]
+            if not runs and last is not None:
+                df = df.loc[df.index != last]          # duplicato al confine
+            if len(df) == 0:
+                continue
+
+            if not runs and (last is None or df.index[0] > last):
+                if out_rep is not None:
+                    validate(df, out_rep, deep, prev=last if last is not None else after)
+                writer = _write(writer, df, out_path)
+                first = df.index[0] if first is None else first
+                last, rows_out = df.index[-1], rows_out + len(df)
+                continue
+
+            if not runs:                               # primo chunk fuori ordine
+                L.info("Chunk fuori ordine → merge ordinato dei run")
+                if out_rep is not None:                # l'output fuso viene rivalidato
+                    out_rep = V.Report(rep.stage, rep.symbol)
+                if writer is not None:
+                    writer.close()
+                    writer = None
+                    runs.append(tmp / "run-00000.parquet")
+                    shutil.move(out_path, runs[0])
+            run = tmp / f"run-{len(runs):05d}.parquet"
+            df.to_parquet(run)
+            runs.append(run)
+
+        if writer is not None:
+            writer.close()
+        if runs:
+            rows_out, first, last = merge_runs(runs, out_path, max(1024, chunksize // len(runs)),
+                                               out_rep, deep)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    if rep is not None:
+        rep.merge(out_rep)
+    return rows_in, rows_out, first, last
+
+# ────────────────────────────────
+# 6️⃣  Main
 # ────────────────────────────────
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Clean M1 CSV -> Parquet")
+    parser.add_argument("--symbol", default="EURUSD", help="Simbolo (log + stato incrementale)")
+    parser.add_argument("--input",  default="data/raw/EURUSD_M1.csv", help="Path CSV raw")
+    parser.add_argument("--output", default="data/processed/EURUSD_M1_clean.parquet",
+                        help="Parquet pulito (senza .parquet → dataset hive per simbolo/anno/mese)")
+    parser.add_argument("--chunksize", type=int, default=0,
+                        help="Righe per chunk (0 = carica tutto in RAM)")
+    parser.add_argument("--date-format", default="%Y.%m.%d",
+                        help="Formato colonna DATE degli export MT5")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Aggiunge solo le barre successive all'ultimo run")
+    parser.add_argument("--state", default=str(store.STATE_PATH), help="File stato incrementale")
+    parser.add_argument("--deep-validate", action="store_true",
+                        help="Anche schema Pandera completo (lento)")
+    parser.add_argument("--quality-report", default=None,
+                        help="Report JSON di validazione (default logs/quality/clean_<symbol>.json)")
+    return parser.parse_args(argv)
+
+
+@profiled("clean")
 def main(args):
     L.info(f"Start clean for {args.symbol}")
 
@@ -90,30 +289,63 @@ def main(args):
         L.error(f"CSV non trovato: {raw_csv}")
         sys.exit(1)
 
-    df = load_csv(raw_csv)
-    L.info(f"Rows loaded: {len(df):,}")
+    out_path = Path(args.output)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    df = clean(df)
-    L.info(f"Rows after dedup: {len(df):,}")
+    after = None
+    if args.incremental:
+        after = store.get_stage(args.symbol, "clean", args.state)["last"]
+        L.info(f"Modalità incrementale: ultimo timestamp processato {after}")
 
-    # Validate schema
-    try:
-        schema.validate(df.sample(min(len(df), 500)))  # valida max 500 righe
-        L.info("Schema Pandera → ✅ OK")
-    except pa.errors.SchemaError as e:
-        L.error(f"Schema validation failed:\n{e}")
-        sys.exit(1)
+    rep = V.Report("clean", args.symbol)
+    if args.chunksize:
+        # file singolo da riscrivere → streaming diretto; altrimenti file
+        # temporaneo pubblicato poi come part-file / partizioni hive
+        direct = not args.incremental and not store.is_dataset(out_path)
+        target = out_path if direct else out_path.parent / f".{out_path.name}.new.parquet"
+        if direct and out_path.is_dir():
+            shutil.rmtree(out_path)
+        rows_in, rows_out, first, last = stream_clean(raw_csv, target, args.chunksize,
+                                                      args.date_format, after, rep,
+                                                      args.deep_validate)
+        L.info(f"Rows loaded: {rows_in:,}")
+        L.info(f"Rows after dedup: {rows_out:,}")
+        lap("stream", rows=rows_in)              # lettura + pulizia + validazione + scrittura
+        if not V.finish(rep, L, args.quality_report):
+            target.unlink(missing_ok=True)
+            sys.exit(1)
+        if not direct and rows_out:
+            store.write_file(target, out_path, first, args.symbol, append=args.incremental)
+            lap("publish", rows=rows_out)
+    else:
+        df = load_csv(raw_csv, args.date_format)
+        L.info(f"Rows loaded: {len(df):,}")
+        lap("load", rows=len(df))
+        check_raw(df, rep)
 
-    out_path = Path(args.output)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    df.to_parquet(out_path)
+        df = clean(df)
+        L.info(f"Rows after dedup: {len(df):,}")
+        lap("compute", rows=len(df))
+
+        if after is not None:
+            df = df.loc[df.index > after]
+        validate(df, rep, args.deep_validate, prev=after)
+        if not V.finish(rep, L, args.quality_report):
+            sys.exit(1)
+        lap("validate", rows=len(df))
+
+        if args.incremental:
+            store.append(df, out_path, args.symbol)
+        else:
+            store.write(df, out_path, args.symbol)
+        rows_out, last = len(df), (df.index[-1] if len(df) else None)
+        lap("write", rows=rows_out)
+
+    if args.incremental:
+        L.info(f"Nuove righe aggiunte: {rows_out:,}")
+    if last is not None:
+        store.set_stage(args.symbol, "clean", last, args.state)
     L.info(f"✅ Clean parquet salvato: {out_path}")
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Clean M1 CSV -> Parquet")
-    parser.add_argument("--symbol", default="EURUSD", help="Simbolo (solo log)")
-    parser.add_argument("--input",  default="data/raw/EURUSD_M1.csv", help="Path CSV raw")
-    parser.add_argument("--output", default="data/processed/EURUSD_M1_clean.parquet",
-                        help="Parquet pulito")
-    args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    main(parse_args())
@@ -1,85 +1,192 @@
 #!/usr/bin/env python3
 """
-Calcola le feature base (HL_range, OC_change, Body_pct, Volume_log),
-le normalizza (z-score) e salva il Parquet in feature_store.
+Calcola le feature richieste (--features, default il set base HL_range,
+OC_change, Body_pct, Volume_log; registry completo in etl/features.py),
+le normalizza (z-score, etl/normalize.py) e salva il Parquet in feature_store.
+Le prime lookback-1 barre, senza storia sufficiente, vengono scartate.
+
+--norm global    → mean/std fittati solo sul periodo di train (--fit-end /
+                   --fit-frac, stesso taglio di split.py): niente leakage dal test
+--norm expanding → statistiche su tutta la storia fino alla barra corrente
+--norm rolling   → statistiche sulle ultime --window barre
+
+Feature, parametri e stato di fine storia della normalizzazione vanno nello
+spec versionato (--spec), che convert_to_onnx.py copia accanto al modello:
+il gateway riparte da lì e produce gli stessi valori dell'offline.
+
+Feature float32 (store.PRICE_DTYPE): la normalizzazione gira a blocchi di
+NORM_CHUNK righe (stato cumulativo → stessi bit del blocco unico) e scrive
+in un array float32, senza matrici float64 grandi quanto il dataset.
+
+Validazione vettoriale su tutte le righe (feature finite, dominio label,
+indice) → logs/quality/features_<S>.json; Pandera solo con --deep-validate.
 """
 
-import argparse, logging, sys, os
+import argparse, sys, os, time
 from pathlib import Path
 import pandas as pd, numpy as np
-import pandera as pa
-from pandera import Column, DataFrameSchema, Check
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/ nel path
+from etl import store, features as F
+from etl import validate as V
+from etl.normalize import Normalizer, MODES
+from utils.logger import setup_logging
+from utils.profiling import profiled, lap
 
 # ─────────────────────────────
 # 1️⃣  Logging
 # ─────────────────────────────
-LOG_DIR = Path("logs"); LOG_DIR.mkdir(exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_DIR / "feature_engineering.log"),
-        logging.StreamHandler(sys.stdout)
-    ],
-)
-L = logging.getLogger("feature")
+L = setup_logging("feature", "feature_engineering")
+
+NORM_CHUNK = 256 * 1024
+WARMUP_MAX = 0.5        # quota massima di barre scartate come warm-up della normalizzazione
 
 # ─────────────────────────────
 # 2️⃣  CLI
 # ─────────────────────────────
-p = argparse.ArgumentParser(description="Feature Engineering M1")
-p.add_argument("--input",  default="data/processed/EURUSD_M1_labeled.parquet",
-               help="Parquet con colonna Label")
-p.add_argument("--output", default="data/feature_store/EURUSD_M1_features.parquet",
-               help="Parquet con feature normalizzate")
-args = p.parse_args()
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Feature Engineering M1")
+    p.add_argument("--input",  default="data/processed/EURUSD_M1_labeled.parquet",
+                   help="Parquet con colonna Label")
+    p.add_argument("--output", default="data/feature_store/EURUSD_M1_features.parquet",
+                   help="Parquet con feature normalizzate")
+    p.add_argument("--symbol", default="EURUSD", help="Simbolo (stato incrementale)")
+    p.add_argument("--incremental", action="store_true",
+                   help="Solo barre nuove, normalizzate con le statistiche del run completo")
+    p.add_argument("--state", default=str(store.STATE_PATH), help="File stato incrementale")
+    p.add_argument("--features", nargs="+", default=F.DEFAULT,
+                   help='Nomi o pattern del registry (es. "ret_*" "atr_*", oppure "all")')
+    p.add_argument("--list-features", action="store_true", help="Elenca il registry ed esce")
+    p.add_argument("--spec", default=str(F.SPEC_PATH), help="Spec feature + normalizzazione (JSON)")
+    p.add_argument("--norm", choices=MODES, default="global", help="Modo normalizzazione")
+    p.add_argument("--fit-end", default=None, help="Data fine blocco di fit (esclusa)")
+    p.add_argument("--fit-frac", type=float, default=0.70,
+                   help="Quota iniziale usata per il fit (se manca --fit-end)")
+    p.add_argument("--window", type=int, default=1440, help="Barre finestra (--norm rolling)")
+    p.add_argument("--min-periods", type=int, default=100,
+                   help="Barre minime prima del primo valore (--norm expanding)")
+    p.add_argument("--deep-validate", action="store_true",
+                   help="Anche schema Pandera completo (lento)")
+    p.add_argument("--quality-report", default=None,
+                   help="Report JSON di validazione (default logs/quality/features_<symbol>.json)")
+    return p.parse_args(argv)
 
-in_path  = Path(args.input)
-out_path = Path(args.output)
 
-if not in_path.exists():
-    L.error(f"⚠️  Labeled parquet non trovato: {in_path}")
-    sys.exit(1)
+@profiled("features")
+def main(args):
+    if args.list_features:
+        for f in F.REGISTRY.values():
+            print(f"{f.name:18s} lookback {F.lookback([f.name]):4d}  deps {', '.join(f.deps) or '-'}")
+        return
 
-# ─────────────────────────────
-# 3️⃣  Carica + calcola feature
-# ─────────────────────────────
-df = pd.read_parquet(in_path)
-L.info(f"Rows loaded: {len(df):,}")
+    in_path  = Path(args.input)
+    out_path = Path(args.output)
 
-df["HL_range"]  = df["High"] - df["Low"]
-df["OC_change"] = df["Close"] - df["Open"]
-df["Body_pct"]  = np.abs(df["Close"]-df["Open"]) / (df["HL_range"] + 1e-6)
-df["Volume_log"]= np.log1p(df["Volume"])
+    if not in_path.exists():
+        L.error(f"⚠️  Labeled parquet non trovato: {in_path}")
+        sys.exit(1)
 
-features = ["HL_range","OC_change","Body_pct","Volume_log"]
+    # ─────────────────────────────
+    # 3️⃣  Carica + calcola feature
+    # ─────────────────────────────
+    after, spec = None, None
+    if args.incremental:
+        after = store.get_stage(args.symbol, "features", args.state)["last"]
+        if after is not None:
+            if not Path(args.spec).exists():
+                L.error(f"Spec {args.spec} assente → rilancia senza --incremental")
+                sys.exit(1)
+            spec = F.load_spec(args.spec)
+        L.info(f"Modalità incrementale: ultima barra processata {after}")
 
-# ─────────────────────────────
-# 4️⃣  Normalizzazione z-score
-# ─────────────────────────────
-for col in features:
-    mean, std = df[col].mean(), df[col].std()
-    df[col] = (df[col] - mean) / std
-L.info("Feature normalizzate (z-score)")
+    try:
+        features = spec["features"] if spec is not None else F.resolve(args.features)
+    except ValueError as e:
+        L.error(str(e))
+        sys.exit(1)
+    lb = F.lookback(features)
+    L.info(f"Feature: {len(features)} (lookback {lb} barre)")
 
-# ─────────────────────────────
-# 5️⃣  Validazione schema
-# ─────────────────────────────
-schema = DataFrameSchema({
-    "Label": Column(int, Check(lambda s: s.isin([0,1]))),
-    **{c: Column(float, Check(lambda s: s.notna())) for c in features}
-})
-
-try:
-    schema.validate(df[["Label"]+features].sample(100))
-    L.info("Schema Pandera → OK")
-except pa.errors.SchemaError as e:
-    L.error(f"Schema validation failed:\n{e}")
-    sys.exit(1)
+    # overlap: le lb-1 barre già viste servono solo come storia delle finestre
+    df = store.read_after(in_path, after=after, lookback=lb - 1, symbol=args.symbol,
+                          columns=F.INPUTS + ["Label"])
+    L.info(f"Rows loaded: {len(df):,}")
+    if len(df) == 0 or (after is not None and df.index[-1] <= after):
+        L.info("Nessuna nuova barra → niente da fare")
+        return
+    last_in = df.index[-1]
+    lap("load", rows=len(df))
 
-# ─────────────────────────────
-# 6️⃣  Salva parquet
-# ─────────────────────────────
-out_path.parent.mkdir(parents=True, exist_ok=True)
-df[features + ["Label"]].to_parquet(out_path)
-L.info(f"✅ Features parquet salvato: {out_path}")
\ No newline at end of file
+    # dtype dallo spec in incrementale (gli spec float64 precedenti restano float64)
+    dtype = np.dtype(spec.get("dtype", "float64") if spec is not None else store.PRICE_DTYPE)
+    t0 = time.perf_counter()
+    feats = F.compute_frame(df, features, dtype)
+    L.info(f"Feature calcolate in {time.perf_counter() - t0:.2f}s")
+    lap("compute", rows=len(df))
+    if after is not None:
+        feats, df = feats[feats.index > after], df[df.index > after]
+    warm = feats.isna().any(axis=1).to_numpy()
+    if warm.any():
+        L.info(f"Barre senza lookback completo: {warm.sum():,} → scartate")
+        feats, df = feats[~warm], df[~warm]
+
+    # ─────────────────────────────
+    # 4️⃣  Normalizzazione z-score
+    # ─────────────────────────────
+    # incrementale: parametri e stato arrivano dallo spec del run precedente
+    if spec is not None:
+        norm = Normalizer.from_dict(features, spec["norm"])
+    else:
+        n_fit = (feats.index.searchsorted(pd.Timestamp(args.fit_end)) if args.fit_end
+                 else int(len(feats) * args.fit_frac))
+        norm = Normalizer(features, args.norm, args.window, args.min_periods, F.unscaled(features))
+        norm.fit(feats.iloc[:max(n_fit, 2)].to_numpy())
+        L.info(f"Fit normalizzazione ({args.norm}) su {max(n_fit, 2):,} barre "
+               f"(fino a {feats.index[max(n_fit, 2) - 1]})")
+
+    X = feats.to_numpy()
+    Z = np.empty(X.shape, dtype=dtype)
+    for a in range(0, len(X), NORM_CHUNK):
+        Z[a:a + NORM_CHUNK] = norm.transform(X[a:a + NORM_CHUNK])
+    feats = pd.DataFrame(Z, index=feats.index, columns=features)
+    del X, Z
+    warmup = feats.isna().any(axis=1).to_numpy()
+    if len(warmup) and warmup.mean() > WARMUP_MAX:
+        bad = [c for c in features if feats[c].isna().mean() > WARMUP_MAX]
+        L.error(f"⚠️  Warm-up della normalizzazione: {warmup.sum():,} barre su {len(warmup):,} "
+                f"senza statistiche (feature: {bad}); controlla --norm/--window/--min-periods")
+        sys.exit(1)
+    if warmup.any():
+        L.info(f"Barre di warm-up senza statistiche: {warmup.sum():,} → scartate")
+    df = feats[~warmup].assign(Label=df.loc[~warmup, "Label"].astype(store.LABEL_DTYPE))
+
+    L.info(f"Feature normalizzate ({norm.mode})")
+    lap("normalize", rows=len(feats))
+
+    # ─────────────────────────────
+    # 5️⃣  Validazione (tutte le righe)
+    # ─────────────────────────────
+    rep = V.validate(df, V.Report("features", args.symbol), label=True, features=features,
+                     dtypes={"Label": store.LABEL_DTYPE, **{c: dtype for c in features}},
+                     deep=args.deep_validate)
+    if not V.finish(rep, L, args.quality_report):
+        sys.exit(1)
+    lap("validate", rows=len(df))
+
+    # ─────────────────────────────
+    # 6️⃣  Salva parquet + spec
+    # ─────────────────────────────
+    spec = F.build_spec(features, norm.to_dict(), source=in_path, dtype=dtype, symbol=args.symbol)
+    F.save_spec(spec, args.spec)
+    L.info(f"Spec feature salvato: {args.spec} (hash {spec['hash']})")
+    if args.incremental:
+        store.append(df[features + ["Label"]], out_path, args.symbol)
+    else:
+        store.write(df[features + ["Label"]], out_path, args.symbol)
+    store.set_stage(args.symbol, "features", last_in, args.state, spec=spec["hash"])
+    lap("write", rows=len(df))
+    L.info(f"✅ Features parquet salvato: {out_path}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
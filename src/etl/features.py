@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Libreria feature, condivisa tra batch (feature_engineering.py) e inferenza
+online (deploy/streaming.py).
+
+• Registry dichiarativo: ogni feature dichiara la sua finestra (barre usate,
+  corrente inclusa) e le feature da cui dipende; il lookback totale si
+  ricava dalla catena delle dipendenze. Si calcola solo il set richiesto
+  (nomi o pattern: "ret_*", "all").
+• Implementazioni vettoriali su array numpy. Il Context memorizza feature e
+  finestre rolling già calcolate nel set richiesto: la stessa somma mobile
+  della Close serve ma_diff_* e ma_cross_*, le somme dei rendimenti servono
+  tutte le vol_* ecc. (filter_trend.py usa la stessa media mobile, non la
+  stessa cache: gira in un altro stage).
+• Le finestre rolling (sum/max/min) sono in O(N) indipendente dalla
+  finestra w: blocchi di w barre, ogni finestra = suffisso di un blocco +
+  prefisso del successivo (van Herk / Gil-Werman). Max/min sono esatti e
+  non dipendono da dove inizia la serie; le somme hanno l'errore di una
+  somma diretta di w termini (nessuna cumulata globale da sottrarre), quindi
+  gateway e run incrementali, che ripartono dalle ultime `lookback` barre,
+  coincidono col batch a meno dell'arrotondamento (di norma identici dopo
+  la conversione a float32).
+• Orari e sessioni usano l'orologio dei timestamp del dataset.
+• La normalizzazione (etl/normalize.py: modo, parametri fittati sul train
+  e stato di fine storia) finisce in uno spec JSON versionato con hash,
+  insieme alla lista delle feature: training, export ONNX e gateway leggono
+  da lì nomi e numero di colonne.
+• Calcoli sempre in float64; lo spec registra il dtype di storage ("dtype",
+  es. float32): prezzi e feature grezze vengono arrotondati a quel dtype
+  prima di calcolo e normalizzazione, offline come nel gateway.
+"""
+
+import fnmatch, hashlib, json, os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, NamedTuple
+import numpy as np
+import pandas as pd
+
+SPEC_VERSION = 2
+SPEC_PATH    = Path("data/feature_store/feature_spec.json")
+INPUTS       = ["Open", "High", "Low", "Close", "Volume"]
+DEFAULT      = ["HL_range", "OC_change", "Body_pct", "Volume_log"]   # set storico
+EPS          = 1e-6
+
+
+# ─────────────────────────────
+# Registry
+# ─────────────────────────────
+class Feature(NamedTuple):
+    name: str
+    fn: Callable
+    window: int          # barre usate dalla feature stessa (1 = solo la corrente)
+    deps: tuple          # feature del registry da cui dipende
+    scale: bool          # False = già limitata (flag, sin/cos): niente z-score
+
+
+REGISTRY: dict[str, Feature] = {}
+
+
+def register(name: str, window: int = 1, deps=(), scale: bool = True):
+    def deco(fn):
+        if name in REGISTRY:
+            raise ValueError(f"Feature già registrata: {name}")
+        REGISTRY[name] = Feature(name, fn, window, tuple(deps), scale)
+        return fn
+    return deco
+
+
+def lookback(names) -> int:
+    """Barre di storia (corrente inclusa) necessarie per calcolare `names`."""
+    def lb(name):
+        f = REGISTRY[name]
+        return f.window + max((lb(d) for d in f.deps), default=1) - 1
+    return max((lb(n) for n in names), default=1)
+
+
+def unscaled(names) -> list:
+    return [n for n in names if not REGISTRY[n].scale]
+
+
+def resolve(patterns) -> list:
+    """Nomi/pattern fnmatch ("all" = tutto) → nomi in ordine di registry, senza duplicati."""
+    out = []
+    for pat in patterns:
+        hits = list(REGISTRY) if pat == "all" else fnmatch.filter(REGISTRY, pat)
+        if not hits:
+            raise ValueError(f"Nessuna feature per '{pat}'")
+        out += [h for h in hits if h not in out]
+    return out
+
+
+# ─────────────────────────────
+# Context: input + cache condivisa
+# ─────────────────────────────
+_REDUCE = {"sum": (np.add, 0.0), "max": (np.maximum, -np.inf), "min": (np.minimum, np.inf)}
+
+
+def window_reduce(x: np.ndarray, w: int, how: str = "sum") -> np.ndarray:
+    """sum/max/min di x[i-w+1 .. i] per i = w-1 .. N-1, in O(N).
+
+    Prefissi e suffissi accumulati dentro blocchi di w barre: la finestra
+    che finisce in i è il suffisso del blocco di i-w+1 più il prefisso del
+    blocco di i (o un blocco intero, se allineata).
+    """
+    uf, fill = _REDUCE[how]
+    n = len(x)
+    nb = -(-n // w)
+    blocks = np.full(nb * w, fill)
+    blocks[:n] = x
+    blocks = blocks.reshape(nb, w)
+    pre = uf.accumulate(blocks, axis=1).ravel()
+    suf = uf.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    i = np.arange(w - 1, n)
+    j = i - (w - 1)
+    return np.where(j % w == 0, pre[i], uf(suf[j], pre[i]))
+
+
+class Context:
+    def __init__(self, cols: dict, times):
+        self.cache = {k: np.asarray(v, dtype=np.float64) for k, v in cols.items()}
+        self.times = np.asarray(times).astype("int64")          # ns
+        self.n = len(self.times)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name not in self.cache:
+            self.cache[name] = REGISTRY[name].fn(self)
+        return self.cache[name]
+
+    def derive(self, name: str, fn) -> np.ndarray:
+        """Serie intermedia non registrata (es. log Close), calcolata una volta."""
+        if name not in self.cache:
+            self.cache[name] = fn()
+        return self.cache[name]
+
+    def rolling(self, name: str, w: int, how: str = "sum") -> np.ndarray:
+        """sum/max/min sulle ultime w barre; NaN finché la finestra non è piena."""
+        key = f"{how}:{w}:{name}"
+        if key not in self.cache:
+            out = np.full(self.n, np.nan)
+            if self.n >= w:
+                out[w - 1:] = window_reduce(self[name], w, how)
+            self.cache[key] = out
+        return self.cache[key]
+
+    def mean(self, name: str, w: int) -> np.ndarray:
+        return self.rolling(name, w) / w
+
+    def std(self, name: str, w: int) -> np.ndarray:
+        """Std campionaria via somme mobili: solo per serie a media ~0 (rendimenti)."""
+        sq = f"sq:{name}"
+        self.derive(sq, lambda: self[name] ** 2)
+        s, q = self.rolling(name, w), self.rolling(sq, w)
+        return np.sqrt(np.maximum(q - s * s / w, 0) / (w - 1))
+
+    def lag(self, name: str, k: int) -> np.ndarray:
+        x, out = self[name], np.full(self.n, np.nan)
+        out[k:] = x[:self.n - k]
+        return out
+
+
+# ─────────────────────────────
+# Feature: candela
+# ─────────────────────────────
+@register("HL_range")
+def _hl_range(ctx):
+    return ctx["High"] - ctx["Low"]
+
+
+@register("OC_change")
+def _oc_change(ctx):
+    return ctx["Close"] - ctx["Open"]
+
+
+@register("Body_pct", deps=["HL_range"])
+def _body_pct(ctx):
+    return np.abs(ctx["Close"] - ctx["Open"]) / (ctx["HL_range"] + EPS)
+
+
+@register("Volume_log")
+def _volume_log(ctx):
+    return np.log1p(ctx["Volume"])
+
+
+@register("Upper_wick", deps=["HL_range"])
+def _upper_wick(ctx):
+    return (ctx["High"] - np.maximum(ctx["Open"], ctx["Close"])) / (ctx["HL_range"] + EPS)
+
+
+@register("Lower_wick", deps=["HL_range"])
+def _lower_wick(ctx):
+    return (np.minimum(ctx["Open"], ctx["Close"]) - ctx["Low"]) / (ctx["HL_range"] + EPS)
+
+
+# ─────────────────────────────
+# Feature: rendimenti e momentum
+# ─────────────────────────────
+def _log_close(ctx):
+    return ctx.derive("log_close", lambda: np.log(ctx["Close"]))
+
+
+for _n in (1, 2, 3, 5, 10, 15, 30, 60, 120, 240):
+    @register(f"ret_{_n}", window=_n + 1)
+    def _ret(ctx, n=_n):
+        lc = _log_close(ctx)
+        out = np.full(ctx.n, np.nan)
+        out[n:] = lc[n:] - lc[:-n]
+        return out
+
+
+@register("chg_1", window=2)
+def _chg_1(ctx):
+    return ctx["Close"] - ctx.lag("Close", 1)
+
+
+@register("rsi_14", window=14, deps=["chg_1"])
+def _rsi_14(ctx):
+    ctx.derive("gain", lambda: np.maximum(ctx["chg_1"], 0))
+    ctx.derive("loss", lambda: np.maximum(-ctx["chg_1"], 0))
+    g, l = ctx.rolling("gain", 14), ctx.rolling("loss", 14)
+    return 100 * g / (g + l + 1e-12)
+
+
+# ─────────────────────────────
+# Feature: medie mobili
+# ─────────────────────────────
+for _n in (5, 10, 20, 50, 100, 200):
+    @register(f"ma_diff_{_n}", window=_n)
+    def _ma_diff(ctx, n=_n):
+        return ctx["Close"] / ctx.mean("Close", n) - 1
+
+for _a, _b in ((5, 20), (20, 50), (50, 200)):
+    @register(f"ma_cross_{_a}_{_b}", window=_b)
+    def _ma_cross(ctx, a=_a, b=_b):
+        return ctx.mean("Close", a) / ctx.mean("Close", b) - 1
+
+
+# ─────────────────────────────
+# Feature: volatilità e range
+# ─────────────────────────────
+for _n in (5, 15, 30, 60, 120, 240):
+    @register(f"vol_{_n}", window=_n, deps=["ret_1"])
+    def _vol(ctx, n=_n):
+        return ctx.std("ret_1", n)
+
+
+@register("vol_ratio_5_60", deps=["vol_5", "vol_60"])
+def _vol_ratio(ctx):
+    return ctx["vol_5"] / (ctx["vol_60"] + 1e-12)
+
+
+@register("TR", window=2)
+def _true_range(ctx):
+    prev = ctx.lag("Close", 1)
+    return np.fmax(ctx["High"], prev) - np.fmin(ctx["Low"], prev)
+
+
+for _n in (14, 50, 100):
+    @register(f"atr_{_n}", window=_n, deps=["TR"])
+    def _atr(ctx, n=_n):
+        return ctx.mean("TR", n) / ctx["Close"]
+
+
+@register("atr_ratio_14_100", deps=["atr_14", "atr_100"])
+def _atr_ratio(ctx):
+    return ctx["atr_14"] / (ctx["atr_100"] + 1e-12)
+
+
+@register("range_atr_14", window=14, deps=["HL_range", "TR"])
+def _range_atr(ctx):
+    return ctx["HL_range"] / (ctx.mean("TR", 14) + 1e-12)
+
+
+for _n in (20, 60, 240):
+    @register(f"range_pos_{_n}", window=_n)
+    def _range_pos(ctx, n=_n):
+        hi, lo = ctx.rolling("High", n, "max"), ctx.rolling("Low", n, "min")
+        return (ctx["Close"] - lo) / (hi - lo + 1e-12)
+
+
+# ─────────────────────────────
+# Feature: volume
+# ─────────────────────────────
+for _n in (20, 60, 240):
+    @register(f"volume_ratio_{_n}", window=_n)
+    def _volume_ratio(ctx, n=_n):
+        return ctx["Volume"] / (ctx.mean("Volume", n) + 1e-9)
+
+
+# ─────────────────────────────
+# Feature: calendario e sessioni
+# ─────────────────────────────
+def _minute_of_day(ctx):
+    return ctx.derive("minute_of_day", lambda: (ctx.times // 60_000_000_000) % 1440)
+
+
+def _day_of_week(ctx):                     # 0 = lunedì (1970-01-01 era giovedì)
+    return ctx.derive("day_of_week", lambda: (ctx.times // 86_400_000_000_000 + 3) % 7)
+
+
+@register("hour_sin", scale=False)
+def _hour_sin(ctx):
+    return np.sin(2 * np.pi * _minute_of_day(ctx) / 1440)
+
+
+@register("hour_cos", scale=False)
+def _hour_cos(ctx):
+    return np.cos(2 * np.pi * _minute_of_day(ctx) / 1440)
+
+
+@register("dow_sin", scale=False)
+def _dow_sin(ctx):
+    return np.sin(2 * np.pi * _day_of_week(ctx) / 7)
+
+
+@register("dow_cos", scale=False)
+def _dow_cos(ctx):
+    return np.cos(2 * np.pi * _day_of_week(ctx) / 7)
+
+
+SESSIONS = {"asia": (0, 7), "london": (7, 16), "ny": (12, 21), "overlap": (12, 16)}
+
+for _s, (_h0, _h1) in SESSIONS.items():
+    @register(f"sess_{_s}", scale=False)
+    def _session(ctx, h0=_h0, h1=_h1):
+        m = _minute_of_day(ctx)
+        return ((m >= h0 * 60) & (m < h1 * 60)).astype(np.float64)
+
+
+# ─────────────────────────────
+# Calcolo
+# ─────────────────────────────
+def compute(cols: dict, times, names=DEFAULT) -> dict:
+    """Feature non normalizzate da colonne OHLCV allineate + timestamp."""
+    ctx = Context(cols, times)
+    return {n: ctx[n] for n in names}
+
+
+def compute_frame(df: pd.DataFrame, names=DEFAULT, dtype=None) -> pd.DataFrame:
+    """Feature di `df` (OHLCV); con `dtype` ogni colonna esce già convertita."""
+    cols = compute({c: df[c].to_numpy() for c in INPUTS}, df.index.asi8, names)
+    if dtype is not None:
+        cols = {n: v.astype(dtype, copy=False) for n, v in cols.items()}
+    return pd.DataFrame(cols, index=df.index)
+
+
+def rolling_mean(x: np.ndarray, w: int) -> np.ndarray:
+    """Media mobile semplice (stessa implementazione di ma_diff_*)."""
+    return Context({"x": x}, np.zeros(len(x))).mean("x", w)
+
+
+# ─────────────────────────────
+# Spec versionato
+# ─────────────────────────────
+def spec_hash(spec: dict) -> str:
+    """Hash di ciò che determina l'output (non di data, sorgente o stato online)."""
+    key = {k: spec[k] for k in ("version", "inputs", "features", "lookback")}
+    key["norm"] = {k: v for k, v in spec["norm"].items() if k != "state"}
+    if "dtype" in spec:                    # assente negli spec float64 precedenti
+        key["dtype"] = spec["dtype"]
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def build_spec(names, norm: dict, source=None, dtype=None, symbol: str = None) -> dict:
+    """norm = Normalizer.to_dict() (config + eventuale stato di fine storia).
+
+    `symbol`: simbolo su cui è stato fittato lo stato (expanding/rolling
+    valgono solo per lui, vedi deploy/streaming.py).
+    """
+    spec = dict(version=SPEC_VERSION, inputs=INPUTS, features=list(names),
+                lookback=lookback(names), norm=norm)
+    if dtype is not None and np.dtype(dtype) != np.float64:
+        spec["dtype"] = np.dtype(dtype).name
+    spec["hash"] = spec_hash(spec)
+    spec["created"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    if source is not None:
+        spec["source"] = str(source)
+    if symbol is not None:
+        spec["symbol"] = symbol
+    return spec
+
+
+def save_spec(spec: dict, path: Path = SPEC_PATH):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(spec, f, indent=2)
+    os.replace(tmp, path)
+
+
+def load_spec(path: Path = SPEC_PATH) -> dict:
+    with open(path) as f:
+        spec = json.load(f)
+    if spec.get("version") != SPEC_VERSION:
+        raise ValueError(f"Spec {path}: versione {spec.get('version')} non supportata")
+    if spec.get("hash") != spec_hash(spec):
+        raise ValueError(f"Spec {path}: hash non coerente (file modificato a mano?)")
+    unknown = [f for f in spec["features"] if f not in REGISTRY]
+    if unknown:
+        raise ValueError(f"Spec {path}: feature non registrate {unknown}")
+    return spec
@@ -8,73 +8,101 @@ Conserva solo:
 Output: parquet filtrato + statistiche in console.
 """
 
-import argparse, logging, sys
+import argparse, sys
 from pathlib import Path
 import pandas as pd
 import numpy as np
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/ nel path
+from etl import store
+from etl.features import rolling_mean
+from utils.logger import setup_logging
+from utils.profiling import profiled, lap
+
 # ─────────────────────────────
 # Logging
 # ─────────────────────────────
-LOG_DIR = Path("logs"); LOG_DIR.mkdir(exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_DIR / "filter_trend.log"),
-        logging.StreamHandler(sys.stdout)
-    ],
-)
-L = logging.getLogger("filter_trend")
+L = setup_logging("filter_trend")
 
 # ─────────────────────────────
 # CLI
 # ─────────────────────────────
-p = argparse.ArgumentParser(description="Trend filter via Moving Average")
-p.add_argument("--input",  default="data/processed/EURUSD_M1_labeled.parquet")
-p.add_argument("--output", default="data/processed/EURUSD_M1_filtered.parquet")
-p.add_argument("--ma", type=int, default=50, help="MA window length (bars)")
-args = p.parse_args()
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Trend filter via Moving Average")
+    p.add_argument("--input",  default="data/processed/EURUSD_M1_labeled.parquet")
+    p.add_argument("--output", default="data/processed/EURUSD_M1_filtered.parquet")
+    p.add_argument("--ma", type=int, default=50, help="MA window length (bars)")
+    p.add_argument("--symbol", default="EURUSD", help="Simbolo (stato incrementale)")
+    p.add_argument("--incremental", action="store_true",
+                   help="Solo barre nuove (+ overlap di ma-1 barre per la MA) e append")
+    p.add_argument("--state", default=str(store.STATE_PATH), help="File stato incrementale")
+    return p.parse_args(argv)
 
-SRC = Path(args.input)
-if not SRC.exists():
-    L.error(f"Parquet etichettato non trovato: {SRC}")
-    sys.exit(1)
 
-# ─────────────────────────────
-# Carica e calcola MA
-# ─────────────────────────────
-df = pd.read_parquet(SRC)
-L.info(f"Rows loaded (labeled): {len(df):,}")
+@profiled("filter")
+def main(args):
+    SRC = Path(args.input)
+    if not SRC.exists():
+        L.error(f"Parquet etichettato non trovato: {SRC}")
+        sys.exit(1)
 
-ma_len = args.ma
-df["MA"] = df["Close"].rolling(window=ma_len).mean()
-df.dropna(inplace=True)
+    # ─────────────────────────────
+    # Carica e calcola MA
+    # ─────────────────────────────
+    ma_len = args.ma
+    after = None
+    if args.incremental:
+        after = store.get_stage(args.symbol, "filter", args.state)["last"]
+        L.info(f"Modalità incrementale: ultima barra processata {after}")
 
-# Trend flags
-df["Trend_Long"]  = df["Close"] > df["MA"]
-df["Trend_Short"] = df["Close"] < df["MA"]
+    # overlap: le ma-1 barre già viste servono solo a calcolare la MA
+    df = store.read_after(SRC, after=after, lookback=ma_len - 1, symbol=args.symbol)
+    L.info(f"Rows loaded (labeled): {len(df):,}")
+    if len(df) == 0 or (after is not None and df.index[-1] <= after):
+        L.info("Nessuna nuova barra → niente da fare")
+        return
+    last_in = df.index[-1]
+    lap("load", rows=len(df))
 
-# Filtra: label 1 con Trend_Long, label 0 con Trend_Short
-pre_rows = len(df)
-df = df[(df["Trend_Long"] & (df["Label"] == 1)) |
-        (df["Trend_Short"] & (df["Label"] == 0))]
-L.info(f"Rows after trend filter: {len(df):,} (da {pre_rows:,})")
+    df["MA"] = rolling_mean(df["Close"].to_numpy(), ma_len)   # stessa MA di ma_diff_*
+    df.dropna(inplace=True)
+    if after is not None:
+        df = df[df.index > after]
 
-# ─────────────────────────────
-# Statistiche
-# ─────────────────────────────
-pos_pct = 100 * df["Label"].mean()
-df["date"] = df.index.date
-daily_counts = df.groupby("date").size()
-L.info(f"Positivi dopo filtro: {pos_pct:.2f}%")
-L.info(f"Trade/giorno — mean: {daily_counts.mean():.2f}, "
-       f"median: {daily_counts.median():.2f}, max: {daily_counts.max()}")
+    # Trend flags
+    df["Trend_Long"]  = df["Close"] > df["MA"]
+    df["Trend_Short"] = df["Close"] < df["MA"]
 
-# ─────────────────────────────
-# Salva parquet filtrato
-# ─────────────────────────────
-OUT = Path(args.output)
-OUT.parent.mkdir(parents=True, exist_ok=True)
-df.drop(columns=["MA","Trend_Long","Trend_Short","date"]).to_parquet(OUT)
-L.info(f"✅ Parquet filtrato salvato: {OUT}")
\ No newline at end of file
+    # Filtra: label 1 con Trend_Long, label 0 con Trend_Short
+    pre_rows = len(df)
+    df = df[(df["Trend_Long"] & (df["Label"] == 1)) |
+            (df["Trend_Short"] & (df["Label"] == 0))]
+    L.info(f"Rows after trend filter: {len(df):,} (da {pre_rows:,})")
+    lap("compute", rows=pre_rows)
+
+    # ─────────────────────────────
+    # Statistiche
+    # ─────────────────────────────
+    pos_pct = 100 * df["Label"].mean()
+    df["date"] = df.index.date
+    daily_counts = df.groupby("date").size()
+    L.info(f"Positivi dopo filtro: {pos_pct:.2f}%")
+    L.info(f"Trade/giorno — mean: {daily_counts.mean():.2f}, "
+           f"median: {daily_counts.median():.2f}, max: {daily_counts.max()}")
+
+    # ─────────────────────────────
+    # Salva parquet filtrato
+    # ─────────────────────────────
+    OUT = Path(args.output)
+    out = df.drop(columns=["MA","Trend_Long","Trend_Short","date"])
+    if args.incremental:
+        store.append(out, OUT, args.symbol)
+    else:
+        store.write(out, OUT, args.symbol)
+    store.set_stage(args.symbol, "filter", last_in, args.state, ma=ma_len)
+    lap("write", rows=len(out))
+    L.info(f"✅ Parquet filtrato salvato: {OUT}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
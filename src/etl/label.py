@@ -1,95 +1,119 @@
 #!/usr/bin/env python3
 """
 Crea la colonna Label (1 = TP prima di SL, 0 = SL prima di TP).
-Output: parquet con colonna 'Label'.
+Output: parquet con colonna 'Label' (int8).
+Validazione vettoriale su tutte le righe (barre, indice, dominio label)
+→ logs/quality/label_<S>.json; Pandera completo solo con --deep-validate.
 """
 
-import argparse, logging, sys
+import argparse, sys
 from pathlib import Path
 import pandas as pd
 import numpy as np
-import pandera as pa
-from pandera import Column, DataFrameSchema, Check
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/ nel path
+from etl.labeling import triple_barrier
+from etl import store
+from etl import validate as V
+from utils.logger import setup_logging
+from utils.profiling import profiled, lap
 
 # ─────────────────────────────
 # 1️⃣  Logging
 # ─────────────────────────────
-LOG_DIR = Path("logs"); LOG_DIR.mkdir(exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_DIR / "label.log"),
-        logging.StreamHandler(sys.stdout)
-    ],
-)
-L = logging.getLogger("label")
+L = setup_logging("label")
 
 # ─────────────────────────────
 # 2️⃣  Parametri CLI
 # ─────────────────────────────
-p = argparse.ArgumentParser(description="Label TP/SL")
-p.add_argument("--input",  default="data/processed/EURUSD_M1_clean.parquet")
-p.add_argument("--output", default="data/processed/EURUSD_M1_labeled.parquet")
-p.add_argument("--tp", type=float, default=0.001,  help="TP pct (+)")
-p.add_argument("--sl", type=float, default=0.001,  help="SL pct (-)")
-p.add_argument("--horizon", type=int, default=20,  help="Barre future da osservare")
-args = p.parse_args()
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Label TP/SL")
+    p.add_argument("--input",  default="data/processed/EURUSD_M1_clean.parquet")
+    p.add_argument("--output", default="data/processed/EURUSD_M1_labeled.parquet")
+    p.add_argument("--tp", type=float, default=0.001,  help="TP pct (+)")
+    p.add_argument("--sl", type=float, default=0.001,  help="SL pct (-)")
+    p.add_argument("--horizon", type=int, default=20,  help="Barre future da osservare")
+    p.add_argument("--symbol", default="EURUSD", help="Simbolo (stato incrementale)")
+    p.add_argument("--incremental", action="store_true",
+                   help="Etichetta solo le barre dopo l'ultimo run e fa append")
+    p.add_argument("--state", default=str(store.STATE_PATH), help="File stato incrementale")
+    p.add_argument("--deep-validate", action="store_true",
+                   help="Anche schema Pandera completo (lento)")
+    p.add_argument("--quality-report", default=None,
+                   help="Report JSON di validazione (default logs/quality/label_<symbol>.json)")
+    return p.parse_args(argv)
 
-# ─────────────────────────────
-# 3️⃣  Carica dati
-# ─────────────────────────────
-SRC = Path(args.input)
-if not SRC.exists():
-    L.error(f"Clean parquet non trovato: {SRC}")
-    sys.exit(1)
-df = pd.read_parquet(SRC)
-L.info(f"Rows loaded: {len(df):,}")
 
-# ─────────────────────────────
-# 4️⃣  Calcolo label
-# ─────────────────────────────
-tp_pct, sl_pct, H = args.tp, args.sl, args.horizon
-highs, lows, closes = df["High"].to_numpy(), df["Low"].to_numpy(), df["Close"].to_numpy()
+@profiled("label")
+def main(args):
+    # ─────────────────────────────
+    # 3️⃣  Carica dati
+    # ─────────────────────────────
+    SRC = Path(args.input)
+    if not SRC.exists():
+        L.error(f"Clean parquet non trovato: {SRC}")
+        sys.exit(1)
+    params = dict(tp=args.tp, sl=args.sl, horizon=args.horizon)
+    after = None
+    if args.incremental:
+        st = store.get_stage(args.symbol, "label", args.state)
+        after = st["last"]
+        if after is not None and any(st.get(k) != v for k, v in params.items()):
+            L.error(f"Parametri diversi dal run precedente ({st}) → rilancia senza --incremental")
+            sys.exit(1)
+        L.info(f"Modalità incrementale: ultima barra etichettata {after}")
 
-def label_row(i: int) -> int:
-    tp_level = closes[i] * (1 + tp_pct)
-    sl_level = closes[i] * (1 - sl_pct)
-    for h, l in zip(highs[i+1:i+1+H], lows[i+1:i+1+H]):
-        if h >= tp_level:
-            return 1
-        if l <= sl_level:
-            return 0
-    return 0  # fallback: nessuno colpito → SL
+    # la prima barra da etichettare è quella dopo `after`: il suo futuro (H barre)
+    # è già nel clean parquet, niente overlap all'indietro
+    df = store.read_after(SRC, after=after, symbol=args.symbol)
+    L.info(f"Rows loaded: {len(df):,}")
+    lap("load", rows=len(df))
 
-L.info(f"Start labeling... Horizon: {H}, TP: {tp_pct}, SL: {sl_pct}")
+    # ─────────────────────────────
+    # 4️⃣  Calcolo label
+    # ─────────────────────────────
+    tp_pct, sl_pct, H = args.tp, args.sl, args.horizon
+    # prezzi float32 su disco, livelli TP/SL in float64 (stessa aritmetica di label_row)
+    highs, lows, closes = (df[c].to_numpy(np.float64) for c in ("High", "Low", "Close"))
 
-labels = [label_row(i) for i in range(len(df) - H)] + [None] * H
-df["Label"] = labels
+    L.info(f"Start labeling... Horizon: {H}, TP: {tp_pct}, SL: {sl_pct}")
 
-L.info(f"Done labeling. Dropping last {H} rows (tail horizon)...")
-df.dropna(inplace=True)
-df["Label"] = df["Label"].astype(int)
-L.info(f"Rows after dropping tail: {len(df):,}")
+    hits = triple_barrier(highs, lows, closes, tp_pct, sl_pct, H)
 
-# ─────────────────────────────
-# 5️⃣  Validazione schema Pandera
-# ─────────────────────────────
-schema = DataFrameSchema({
-    "Label": Column(int, Check(lambda s: s.isin([0, 1])))
-})
-try:
-    schema.validate(df[["Label"]].sample(min(len(df), 500)))
-    pct_pos = 100 * df["Label"].mean()
-    L.info(f"Schema ✅ OK – Positives: {pct_pos:.2f}%")
-except pa.errors.SchemaError as e:
-    L.error(f"Schema validation failed:\n{e}")
-    sys.exit(1)
+    L.info(f"Done labeling. Dropping last {H} rows (tail horizon)...")
+    df = df.iloc[:len(hits.label)].copy()
+    df["Label"]       = hits.label.astype(store.LABEL_DTYPE)
+    df["Hit_offset"]  = hits.offset    # barre fino al primo tocco (0 = nessuno)
+    df["Hit_barrier"] = hits.barrier   # +1 TP, -1 SL, 0 nessuno
+    df.dropna(inplace=True)
+    L.info(f"Rows after dropping tail: {len(df):,}")
+    lap("compute", rows=len(highs))
+    if len(df) == 0:
+        L.info("Nessuna nuova barra con orizzonte completo → niente da fare")
+        return
 
-# ─────────────────────────────
-# 6️⃣  Salva parquet
-# ─────────────────────────────
-OUT = Path(args.output)
-OUT.parent.mkdir(parents=True, exist_ok=True)
-df.to_parquet(OUT)
-L.info(f"✅ Label parquet salvato: {OUT}")
\ No newline at end of file
+    # ─────────────────────────────
+    # 5️⃣  Validazione (tutte le righe)
+    # ─────────────────────────────
+    rep = V.validate(df, V.Report("label", args.symbol), bars=True, label=True,
+                     dtypes={"Label": store.LABEL_DTYPE}, deep=args.deep_validate)
+    if not V.finish(rep, L, args.quality_report):
+        sys.exit(1)
+    L.info(f"Positives: {100 * rep.stats['positives']:.2f}%")
+    lap("validate", rows=len(df))
+
+    # ─────────────────────────────
+    # 6️⃣  Salva parquet
+    # ─────────────────────────────
+    OUT = Path(args.output)
+    if args.incremental:
+        store.append(df, OUT, args.symbol)
+    else:
+        store.write(df, OUT, args.symbol)
+    store.set_stage(args.symbol, "label", df.index[-1], args.state, **params)
+    lap("write", rows=len(df))
+    L.info(f"✅ Label parquet salvato: {OUT}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
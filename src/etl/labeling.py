@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Motore di labeling triple-barrier vettorizzato (TP / SL / orizzonte H).
+
+Sostituisce il loop Python `label_row(i)` con un calcolo NumPy a blocchi:
+si avanza di un offset h = 1..H alla volta e si confrontano in un colpo solo
+tutte le barre ancora "aperte" con High/Low della barra i+h.
+Le barre risolte escono dal set attivo, quindi il costo reale è
+proporzionale alla somma dei tempi di primo tocco, non a N·H.
+
+Semantica identica a `label_row`:
+  • a parità di barra si controlla prima il TP (High >= TP) poi lo SL
+  • nessuna barriera colpita entro H → label 0 (fallback SL)
+  • le ultime H barre non hanno futuro completo → escluse dal risultato
+"""
+
+from typing import NamedTuple
+import numpy as np
+
+BARRIER_NONE, BARRIER_TP, BARRIER_SL = 0, 1, -1
+
+# Sotto questa quota di barre ancora aperte si passa da maschere su slice
+# contigue a indici compressi (gather solo sulle barre attive).
+DENSE_FRACTION = 0.25
+
+
+class BarrierHits(NamedTuple):
+    label:   np.ndarray  # int64: 1 = TP prima di SL, 0 altrimenti
+    offset:  np.ndarray  # int32: barre dalla entry al primo tocco (0 = nessuno)
+    barrier: np.ndarray  # int8 : BARRIER_TP / BARRIER_SL / BARRIER_NONE
+
+
+def triple_barrier(highs: np.ndarray, lows: np.ndarray, closes: np.ndarray,
+                   tp_pct: float, sl_pct: float, horizon: int) -> BarrierHits:
+    """Label TP/SL per le prime len(closes) - horizon barre."""
+    highs, lows, closes = np.asarray(highs), np.asarray(lows), np.asarray(closes)
+    n = max(len(closes) - horizon, 0)
+
+    offset  = np.zeros(n, dtype=np.int32)
+    barrier = np.zeros(n, dtype=np.int8)
+
+    # stessi livelli (stessa aritmetica float) di label_row
+    tp_level = closes[:n] * (1 + tp_pct)
+    sl_level = closes[:n] * (1 - sl_pct)
+
+    open_ = np.ones(n, dtype=bool)   # fase densa: maschera sulle barre aperte
+    active = None                    # fase sparsa: indici delle barre aperte
+
+    for h in range(1, horizon + 1):
+        if active is None:
+            tp_hit = open_ & (highs[h:h + n] >= tp_level)
+            sl_hit = open_ & ~tp_hit & (lows[h:h + n] <= sl_level)
+            offset[tp_hit | sl_hit] = h
+            barrier[tp_hit] = BARRIER_TP
+            barrier[sl_hit] = BARRIER_SL
+            open_ &= ~(tp_hit | sl_hit)
+            still_open = np.count_nonzero(open_)
+            if still_open == 0:
+                break
+            if still_open < DENSE_FRACTION * n:
+                active = np.flatnonzero(open_)
+        else:
+            tp_hit = highs[active + h] >= tp_level[active]
+            sl_hit = ~tp_hit & (lows[active + h] <= sl_level[active])
+            hit = tp_hit | sl_hit
+            offset[active[hit]] = h
+            barrier[active[tp_hit]] = BARRIER_TP
+            barrier[active[sl_hit]] = BARRIER_SL
+            active = active[~hit]
+            if active.size == 0:
+                break
+
+    label = (barrier == BARRIER_TP).astype(np.int64)
+    return BarrierHits(label, offset, barrier)
+
+
+# ─────────────────────────────
+# Sweep parametri: una passata per orizzonte
+# ─────────────────────────────
+# Elementi (righe × H) per blocco di finestre: limita la RAM del sweep.
+SWEEP_BLOCK_ELEMS = 4_000_000
+
+
+def _first_reach(path: np.ndarray, level: np.ndarray) -> np.ndarray:
+    """Primo indice j con path[b, j] >= level[k, b] (H se mai raggiunto).
+
+    `path` ha righe non decrescenti (running max), quindi basta una ricerca
+    binaria vettorizzata: log2(H) gather invece di H confronti per soglia.
+    """
+    B, H = path.shape
+    flat = path.reshape(-1)
+    base = np.arange(0, B * H, H, dtype=np.int64)
+    lo = np.zeros(level.shape, dtype=np.int64)
+    hi = np.full(level.shape, H, dtype=np.int64)
+    for _ in range(int(H).bit_length()):
+        mid = (lo + hi) >> 1
+        below = (mid < H) & (flat.take(base + np.minimum(mid, H - 1)) < level)
+        np.copyto(lo, mid + 1, where=below)
+        np.copyto(hi, mid, where=~below)
+    return lo
+
+
+def sweep_positive_counts(highs: np.ndarray, lows: np.ndarray, closes: np.ndarray,
+                          tp_list, sl_list, horizon: int,
+                          groups: np.ndarray = None, n_groups: int = 1,
+                          block_elems: int = SWEEP_BLOCK_ELEMS):
+    """Conta i positivi per ogni combinazione (tp, sl) con un solo orizzonte.
+
+    Per ogni blocco di barre si calcola una volta sola il percorso futuro
+    running-max(High) / running-min(Low) su H barre; il primo tocco di ogni
+    soglia TP/SL si ricava da quel percorso, e ogni combo (tp, sl) costa
+    solo un confronto fra i due tempi di primo tocco.
+    Risultato identico a `triple_barrier` combo per combo.
+
+    Ritorna (positives[K_tp, K_sl, G], rows[G]); `groups` (int, lunghezza
+    len(closes)) permette il breakdown, es. per giorno.
+    """
+    highs, lows, closes = np.asarray(highs), np.asarray(lows), np.asarray(closes)
+    tp_arr = np.asarray(tp_list, dtype=float)
+    sl_arr = np.asarray(sl_list, dtype=float)
+    n = max(len(closes) - horizon, 0)
+
+    positives = np.zeros((len(tp_arr), len(sl_arr), n_groups), dtype=np.int64)
+    rows = np.zeros(n_groups, dtype=np.int64)
+    if groups is None:
+        groups = np.zeros(len(closes), dtype=np.int64)
+    if n == 0 or horizon == 0:   # nessun futuro → tutte fallback 0
+        rows += np.bincount(groups[:n], minlength=n_groups)
+        return positives, rows
+
+    # finestra futura della barra i = barre i+1 .. i+H (view, nessuna copia)
+    win_hi = np.lib.stride_tricks.sliding_window_view(highs[1:], horizon)
+    win_lo = np.lib.stride_tricks.sliding_window_view(lows[1:], horizon)
+    block = max(1, block_elems // horizon)
+
+    for a in range(0, n, block):
+        b = min(a + block, n)
+        run_max = np.maximum.accumulate(win_hi[a:b], axis=1)
+        run_min = -np.minimum.accumulate(win_lo[a:b], axis=1)  # non decrescente
+        c = closes[a:b]
+        # stessi livelli di label_row; Low <= sl  ⇔  -Low >= -sl
+        first_tp = _first_reach(run_max, c[None, :] * (1 + tp_arr[:, None]))
+        first_sl = _first_reach(run_min, -(c[None, :] * (1 - sl_arr[:, None])))
+
+        g = groups[a:b]
+        rows += np.bincount(g, minlength=n_groups)
+        for k in range(len(tp_arr)):
+            tp_ok = first_tp[k] < horizon
+            for j in range(len(sl_arr)):
+                lab = tp_ok & (first_tp[k] <= first_sl[j])
+                positives[k, j] += np.bincount(g[lab], minlength=n_groups)
+    return positives, rows
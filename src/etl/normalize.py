@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Normalizzazione z-score senza leakage, identica offline e online.
+
+Modi:
+  • global    → mean/std fittati solo sul blocco di fit (train), poi fissi
+  • expanding → mean/std su tutte le barre fino a t inclusa
+  • rolling   → mean/std sulle ultime `window` barre fino a t inclusa
+
+expanding/rolling girano in una passata O(N): somme cumulative di x-c e
+(x-c)² (c = media del blocco di fit, riduce la cancellazione numerica),
+poi somme di finestra come differenza di due cumulative. np.add.accumulate
+è sequenziale: ripartendo dall'ultima cumulativa salvata, elaborare i dati
+in un blocco solo, a pezzi o una barra alla volta (gateway) produce gli
+stessi bit. Lo stato (n, coda delle cumulative) è serializzabile nello spec.
+Le colonne in `raw` (flag, sin/cos) passano invariate.
+"""
+
+import numpy as np
+
+MODES = ("global", "expanding", "rolling")
+
+
+class Normalizer:
+    def __init__(self, features, mode: str = "global", window: int = 1440,
+                 min_periods: int = 100, raw=()):
+        if mode not in MODES:
+            raise ValueError(f"Modo normalizzazione sconosciuto: {mode} (attesi {MODES})")
+        self.features, self.mode = list(features), mode
+        self.raw = [f for f in self.features if f in set(raw)]
+        self.keep_raw = np.isin(self.features, self.raw)
+        self.window, self.min_periods = int(window), int(min_periods)
+        self.shift = self.mean = self.std = None
+        self.n, self.cs, self.cq = 0, None, None      # barre viste + coda cumulative
+
+    # ─────────────────────────────
+    # Fit / transform
+    # ─────────────────────────────
+    def fit(self, X: np.ndarray) -> "Normalizer":
+        """Fit sul blocco di train: mean/std (global) o costante di shift."""
+        X = np.asarray(X, dtype=np.float64)
+        self.shift = np.nanmean(X, axis=0)
+        if self.mode == "global":
+            std = np.nanstd(X, axis=0, ddof=1)
+            self.mean, self.std = self.shift, np.where(std > 0, std, 1.0)   # costante: x = media → 0
+        return self
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        """Z-score delle righe di X (in ordine) e avanzamento dello stato.
+
+        Le righe prima di min_periods (expanding) o di una finestra piena
+        (rolling) escono a NaN.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if self.mode == "global":
+            return np.where(self.keep_raw, X, (X - self.mean) / self.std)
+
+        k = len(self.features)
+        if self.cs is None:
+            self.cs, self.cq = np.zeros((1, k)), np.zeros((1, k))
+        D = X - self.shift
+        cs = np.add.accumulate(np.vstack([self.cs[-1:], D]), axis=0)[1:]
+        cq = np.add.accumulate(np.vstack([self.cq[-1:], D * D]), axis=0)[1:]
+        j = self.n + 1 + np.arange(len(X))            # barre viste dopo ciascuna riga
+
+        if self.mode == "expanding":
+            S, Q, cnt, minp = cs, cq, j, self.min_periods
+        else:
+            W = self.window
+            base = self.n - (len(self.cs) - 1)        # indice della prima cumulativa in coda
+            lo = np.maximum(j - W, 0) - base
+            S = cs - np.vstack([self.cs, cs])[lo]
+            Q = cq - np.vstack([self.cq, cq])[lo]
+            cnt, minp = np.minimum(j, W), W
+
+        cnt = cnt[:, None].astype(np.float64)
+        m = S / cnt
+        with np.errstate(invalid="ignore", divide="ignore"):
+            var = (Q - S * m) / (cnt - 1)
+            Z = (D - m) / np.sqrt(var)
+        Z[(var <= 0) & ~self.keep_raw] = 0.0          # finestra costante: x = media
+        Z[:, self.keep_raw] = X[:, self.keep_raw]
+        Z[cnt[:, 0] < max(minp, 2)] = np.nan
+
+        keep = 1 if self.mode == "expanding" else self.window + 1
+        self.cs = np.vstack([self.cs, cs])[-keep:]
+        self.cq = np.vstack([self.cq, cq])[-keep:]
+        self.n += len(X)
+        return Z
+
+    # ─────────────────────────────
+    # Serializzazione (spec JSON)
+    # ─────────────────────────────
+    def config(self) -> dict:
+        """Parametri che definiscono l'output (entrano nell'hash dello spec)."""
+        cfg = dict(mode=self.mode, shift=dict(zip(self.features, self.shift.tolist())))
+        if self.raw:
+            cfg["raw"] = self.raw
+        if self.mode == "global":
+            cfg["stats"] = {c: [float(m), float(s)]
+                            for c, m, s in zip(self.features, self.mean, self.std)}
+        elif self.mode == "rolling":
+            cfg["window"] = self.window
+        else:
+            cfg["min_periods"] = self.min_periods
+        return cfg
+
+    def to_dict(self) -> dict:
+        d = self.config()
+        if self.mode != "global" and self.cs is not None:
+            d["state"] = dict(n=self.n, cs=self.cs.tolist(), cq=self.cq.tolist())
+        return d
+
+    @classmethod
+    def from_dict(cls, features, d: dict) -> "Normalizer":
+        norm = cls(features, d["mode"], d.get("window", 1440), d.get("min_periods", 100),
+                   d.get("raw", ()))
+        norm.shift = np.array([d["shift"][c] for c in norm.features])
+        if norm.mode == "global":
+            norm.mean = np.array([d["stats"][c][0] for c in norm.features])
+            norm.std  = np.array([d["stats"][c][1] for c in norm.features])
+        elif "state" in d:
+            st = d["state"]
+            norm.n, norm.cs, norm.cq = int(st["n"]), np.array(st["cs"]), np.array(st["cq"])
+        return norm
@@ -3,52 +3,88 @@
 Divide il parquet delle feature in tre blocchi temporali:
 70 % train • 15 % valid • 15 % test.
 Salva in data/splits/.
+
+I confini si calcolano leggendo solo la colonna time; ogni blocco viene poi
+materializzato con un filtro per intervallo di tempo (pushdown), senza
+caricare in RAM l'intero feature store.
 """
 
-import argparse, logging, os, sys
+import argparse, os, sys
 from pathlib import Path
 import pandas as pd
 from datetime import datetime
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/ nel path
+from etl import store
+from utils.logger import setup_logging
+from utils.profiling import profiled, lap
+
 # ────────────────────────────────
 # Logging
 # ────────────────────────────────
-LOG_DIR = Path("logs"); LOG_DIR.mkdir(exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_DIR / "split.log"),
-        logging.StreamHandler(sys.stdout)
-    ],
-)
-L = logging.getLogger("split")
+L = setup_logging("split")
 
 # ────────────────────────────────
 # CLI
 # ────────────────────────────────
-p = argparse.ArgumentParser(description="Temporal train/valid/test split")
-p.add_argument("--input",  default="data/feature_store/EURUSD_M1_features.parquet")
-p.add_argument("--outdir", default="data/splits")
-p.add_argument("--train",  type=float, default=0.70, help="Quota train")
-p.add_argument("--valid",  type=float, default=0.15, help="Quota valid")
-args = p.parse_args()
-
-IN  = Path(args.input)
-OUT = Path(args.outdir)
-
-if not IN.exists():
-    L.error(f"Feature parquet non trovato: {IN}")
-    sys.exit(1)
-
-df = pd.read_parquet(IN).sort_index()
-n  = len(df)
-a  = int(n * args.train)
-b  = int(n * (args.train + args.valid))
-L.info(f"Rows total: {n:,}  → train:{a:,}  valid:{b-a:,}  test:{n-b:,}")
-
-OUT.mkdir(parents=True, exist_ok=True)
-df.iloc[:a].to_parquet(OUT/"train.parquet")
-df.iloc[a:b].to_parquet(OUT/"valid.parquet")
-df.iloc[b:].to_parquet(OUT/"test.parquet")
-L.info(f"✅ Split salvati in {OUT.resolve()}")
\ No newline at end of file
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Temporal train/valid/test split")
+    p.add_argument("--input",  default="data/feature_store/EURUSD_M1_features.parquet")
+    p.add_argument("--outdir", default="data/splits")
+    p.add_argument("--train",  type=float, default=0.70, help="Quota train")
+    p.add_argument("--valid",  type=float, default=0.15, help="Quota valid")
+    p.add_argument("--train-end", default=None, help="Data fine train (esclusa), alternativa a --train")
+    p.add_argument("--valid-end", default=None, help="Data fine valid (esclusa), alternativa a --valid")
+    p.add_argument("--symbol", default="EURUSD", help="Simbolo (stato incrementale)")
+    p.add_argument("--incremental", action="store_true",
+                   help="Le barre nuove vanno in coda a test.parquet (confini train/valid fissi)")
+    p.add_argument("--state", default=str(store.STATE_PATH), help="File stato incrementale")
+    return p.parse_args(argv)
+
+
+@profiled("split")
+def main(args):
+    IN  = Path(args.input)
+    OUT = Path(args.outdir)
+
+    if not IN.exists():
+        L.error(f"Feature parquet non trovato: {IN}")
+        sys.exit(1)
+
+    if args.incremental:
+        after = store.get_stage(args.symbol, "split", args.state)["last"]
+        L.info(f"Modalità incrementale: ultima barra splittata {after}")
+        if after is not None:
+            new = store.read_after(IN, after=after, symbol=args.symbol)
+            if len(new):
+                store.append(new, OUT/"test.parquet")
+                store.set_stage(args.symbol, "split", new.index[-1], args.state)
+            lap("append_test", rows=len(new))
+            L.info(f"✅ Nuove righe in test: {len(new):,}")
+            return
+
+    times = store.read_index(IN, args.symbol)
+    n  = len(times)
+    a  = times.searchsorted(pd.Timestamp(args.train_end)) if args.train_end else int(n * args.train)
+    b  = (times.searchsorted(pd.Timestamp(args.valid_end)) if args.valid_end
+          else int(n * (args.train + args.valid)))
+    b  = max(a, b)
+    L.info(f"Rows total: {n:,}  → train:{a:,}  valid:{b-a:,}  test:{n-b:,}")
+    lap("index", rows=n)
+
+    OUT.mkdir(parents=True, exist_ok=True)
+    for name, lo, hi in (("train", 0, a), ("valid", a, b), ("test", b, n)):
+        if lo < hi:
+            part = store.read(IN, symbol=args.symbol, start=times[lo],
+                              end=times[hi] if hi < n else None)
+        else:
+            part = store.read(IN, symbol=args.symbol, start=times[-1]).iloc[:0]
+        store.write(part, OUT/f"{name}.parquet")
+        L.info(f"{name}: {times[lo] if lo < n else '-'} → {len(part):,} righe")
+        lap(name, rows=len(part))
+    store.set_stage(args.symbol, "split", times[-1], args.state)
+    L.info(f"✅ Split salvati in {OUT.resolve()}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
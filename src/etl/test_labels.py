@@ -2,38 +2,80 @@
 """
 Testa diverse configurazioni TP/SL e Horizon.
 Stampa % positivi per ogni combinazione.
+
+Sweep in una passata per orizzonte (vedi labeling.sweep_positive_counts):
+il percorso futuro max/min viene calcolato una volta sola e riusato da
+tutte le combinazioni (tp, sl); gli orizzonti girano in parallelo su un
+process pool. Output: tabella tidy (opzionale breakdown per giorno).
 """
 
+import argparse, sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 import pandas as pd
 import numpy as np
-from pathlib import Path
 
-# Parametri
-INPUT = "data/processed/EURUSD_M1_clean.parquet"
-tp_list = [0.001, 0.002, 0.003]  # TP: 0.1%, 0.2%, 0.3%
-sl_list = [0.001, 0.002]         # SL: 0.1%, 0.2%
-horizon_list = [20, 50]          # Barre future
-
-# Carica dati
-df = pd.read_parquet(INPUT)
-highs, lows, closes = df["High"].to_numpy(), df["Low"].to_numpy(), df["Close"].to_numpy()
-
-def label_row(i, tp_pct, sl_pct, H):
-    tp_level = closes[i] * (1 + tp_pct)
-    sl_level = closes[i] * (1 - sl_pct)
-    for h, l in zip(highs[i+1:i+1+H], lows[i+1:i+1+H]):
-        if h >= tp_level:
-            return 1
-        if l <= sl_level:
-            return 0
-    return 0
-
-print("🔎 Start TP/SL test...\n")
-
-# Loop su combinazioni
-for tp in tp_list:
-    for sl in sl_list:
-        for H in horizon_list:
-            labels = [label_row(i, tp, sl, H) for i in range(len(df) - H)]
-            pct_pos = 100 * np.mean(labels)
-            print(f"TP: {tp:.3f} | SL: {sl:.3f} | Horizon: {H:3d} → Positivi: {pct_pos:.2f}%")
\ No newline at end of file
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/ nel path
+from etl.labeling import sweep_positive_counts
+
+
+def sweep_horizon(path: str, tp_list, sl_list, H: int, by_day: bool) -> pd.DataFrame:
+    """Tutte le combo (tp, sl) per un singolo orizzonte H (gira in un worker)."""
+    df = pd.read_parquet(path, columns=["High", "Low", "Close"])
+    highs, lows, closes = df["High"].to_numpy(), df["Low"].to_numpy(), df["Close"].to_numpy()
+
+    if by_day:
+        groups, days = pd.factorize(df.index.normalize())
+    else:
+        groups, days = None, [None]
+    positives, rows = sweep_positive_counts(highs, lows, closes, tp_list, sl_list, H,
+                                            groups=groups, n_groups=len(days))
+
+    k, j, d = np.indices(positives.shape).reshape(3, -1)
+    out = pd.DataFrame(dict(tp=np.asarray(tp_list)[k], sl=np.asarray(sl_list)[j],
+                            horizon=H, rows=rows[d], positives=positives.ravel()))
+    if by_day:
+        out["date"] = days.date[d]
+    return out[out["rows"] > 0]
+
+
+def main(args):
+    print("🔎 Start TP/SL test...\n")
+
+    workers = min(args.workers, len(args.horizon))
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        futs = [ex.submit(sweep_horizon, args.input, args.tp, args.sl, H, args.by_day)
+                for H in args.horizon]
+        res = pd.concat([f.result() for f in futs], ignore_index=True)
+
+    res["pos_pct"] = 100 * res["positives"] / res["rows"]
+
+    summary = (res.groupby(["tp", "sl", "horizon"], as_index=False)[["rows", "positives"]].sum()
+                  .sort_values(["tp", "sl", "horizon"]))
+    for r in summary.itertuples():
+        print(f"TP: {r.tp:.3f} | SL: {r.sl:.3f} | Horizon: {r.horizon:3d} "
+              f"→ Positivi: {100 * r.positives / r.rows:.2f}%")
+
+    if args.output:
+        out = Path(args.output)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        if out.suffix == ".csv":
+            res.to_csv(out, index=False)
+        else:
+            res.to_parquet(out, index=False)
+        print(f"\n✅ Tabella sweep salvata: {out}")
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Sweep TP/SL/Horizon → % positivi")
+    p.add_argument("--input", default="data/processed/EURUSD_M1_clean.parquet")
+    p.add_argument("--tp", type=float, nargs="+", default=[0.001, 0.002, 0.003],
+                   help="TP pct (lista)")
+    p.add_argument("--sl", type=float, nargs="+", default=[0.001, 0.002],
+                   help="SL pct (lista)")
+    p.add_argument("--horizon", type=int, nargs="+", default=[20, 50],
+                   help="Barre future (lista)")
+    p.add_argument("--by-day", action="store_true", help="Breakdown per giorno")
+    p.add_argument("--workers", type=int, default=4, help="Processi (uno per orizzonte)")
+    p.add_argument("--output", default=None, help="Tabella tidy (.parquet o .csv)")
+    main(p.parse_args())
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Validazione vettoriale di tutte le righe (niente sample, niente lambda).
+
+Ogni controllo è un'operazione NumPy per colonna, in una sola passata:
+  • bars     → NaN/inf e prezzi <= 0 su OHLC, High >= max(Open, Close),
+               Low <= min(Open, Close), High >= Low, Volume >= 0
+  • index    → DatetimeIndex strettamente crescente (fuori ordine,
+               duplicati), gap fra barre: conteggio, gap massimo e
+               warning oltre max_gap (default 4 giorni: i weekend passano);
+               check_order/check_gaps separati per chi valida l'input
+               grezzo prima di ordinarlo (clean)
+  • label    → dominio {0, 1}
+  • features → valori finiti (NaN / inf), conteggio per colonna
+  • dtype    → dtype attesi delle colonne
+
+Il Report raccoglie errori (bloccanti), warning e statistiche, con i primi
+timestamp in errore; si può accumulare su più chunk (clean --chunksize)
+e viene salvato come JSON compatto (logs/quality/<stage>_<simbolo>.json).
+
+Modalità deep (--deep-validate degli stage): in più lo schema Pandera
+completo su tutte le righe; pandera viene importato solo in quel caso.
+"""
+
+import json, time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+PRICES   = ["Open", "High", "Low", "Close"]
+LABELS   = (0, 1)
+MAX_GAP  = pd.Timedelta("4D")
+EXAMPLES = 5                      # timestamp di esempio per controllo
+REPORT_DIR = Path("logs/quality")
+
+
+class Report:
+    """Esito della validazione di uno stage: errori, warning, statistiche."""
+
+    def __init__(self, stage: str, symbol: str = None):
+        self.stage, self.symbol = stage, symbol
+        self.rows, self.secs = 0, 0.0
+        self.errors, self.warnings, self.stats = {}, {}, {}
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def flag(self, name: str, mask: np.ndarray, times, level: str = "error", **extra) -> int:
+        """Registra le righe con mask True (conteggio + primi timestamp)."""
+        n = int(np.count_nonzero(mask))
+        if n == 0:
+            return 0
+        bucket = self.errors if level == "error" else self.warnings
+        first = [str(t) for t in times[np.flatnonzero(mask)[:EXAMPLES]]]
+        item = bucket.setdefault(name, dict(count=0, first=[]))
+        item["count"] += n
+        item["first"] = (item["first"] + first)[:EXAMPLES]
+        for k, v in extra.items():
+            if isinstance(v, dict):
+                acc = item.setdefault(k, {})
+                for c, m in v.items():
+                    acc[c] = acc.get(c, 0) + m
+            else:
+                item[k] = v
+        return n
+
+    def merge(self, other: "Report") -> "Report":
+        """Accumula in questo report un report parziale dello stesso stage."""
+        self.rows += other.rows
+        self.secs += other.secs
+        for mine, theirs in ((self.errors, other.errors), (self.warnings, other.warnings)):
+            for name, item in theirs.items():
+                acc = mine.setdefault(name, dict(count=0, first=[]))
+                acc["count"] += item["count"]
+                acc["first"] = (acc["first"] + item["first"])[:EXAMPLES]
+                for k, v in item.items():
+                    if k in ("count", "first"):
+                        continue
+                    if isinstance(v, dict):
+                        sub = acc.setdefault(k, {})
+                        for c, m in v.items():
+                            sub[c] = sub.get(c, 0) + m
+                    else:
+                        acc[k] = v
+        s, o = self.stats, other.stats
+        for k, v in o.items():
+            if k == "gaps":
+                s[k] = s.get(k, 0) + v
+            elif k == "max_gap":
+                if pd.Timedelta(v) > pd.Timedelta(s.get(k, "0s")):
+                    s[k], s["max_gap_at"] = v, o.get("max_gap_at")
+            elif k == "first":
+                s.setdefault(k, v)
+            elif k != "max_gap_at":
+                s[k] = v
+        return self
+
+    def to_dict(self) -> dict:
+        return dict(stage=self.stage, symbol=self.symbol, rows=self.rows,
+                    secs=round(self.secs, 4), ok=self.ok, errors=self.errors,
+                    warnings=self.warnings, stats=self.stats)
+
+
+# ────────────────────────────────
+# 1️⃣  Controlli vettoriali
+# ────────────────────────────────
+def check_dtypes(df: pd.DataFrame, expected: dict, rep: Report):
+    """Colonne mancanti o con dtype diverso: errore su tutte le righe."""
+    every = np.ones(len(df), dtype=bool)
+    for col, dt in expected.items():
+        if col not in df.columns:
+            rep.flag(f"missing:{col}", every, df.index)
+        elif df[col].dtype != np.dtype(dt):
+            rep.flag(f"dtype:{col}", every, df.index,
+                     expected=np.dtype(dt).name, got=str(df[col].dtype))
+
+
+def check_bars(df: pd.DataFrame, rep: Report):
+    t = df.index
+    o, h, l, c = (df[x].to_numpy() for x in PRICES)
+    bad = ~(np.isfinite(o) & np.isfinite(h) & np.isfinite(l) & np.isfinite(c))
+    rep.flag("ohlc_not_finite", bad, t)
+    rep.flag("ohlc_not_positive", ~bad & (np.minimum(np.minimum(o, h), np.minimum(l, c)) <= 0), t)
+    rep.flag("high_below_low", h < l, t)
+    rep.flag("high_below_open_close", h < np.maximum(o, c), t)
+    rep.flag("low_above_open_close", l > np.minimum(o, c), t)
+    if "Volume" in df.columns:
+        rep.flag("volume_negative", df["Volume"].to_numpy() < 0, t)
+
+
+def _steps(index: pd.DatetimeIndex, prev=None):
+    """Differenze fra timestamp consecutivi (ns) e timestamp a cui si riferiscono."""
+    t = index.asi8
+    if prev is not None:
+        return np.diff(t, prepend=pd.Timestamp(prev).value), index
+    return np.diff(t), index[1:]
+
+
+def check_index(index: pd.Index, rep: Report, prev=None, max_gap=MAX_GAP):
+    """Ordine, duplicati e gap; `prev` = ultimo timestamp del chunk precedente."""
+    if not isinstance(index, pd.DatetimeIndex):
+        rep.errors["index_not_datetime"] = dict(count=len(index), first=[], got=type(index).__name__)
+        return
+    if len(index) == 0:
+        return
+    check_order(index, rep, prev)
+    check_gaps(index, rep, prev, max_gap)
+
+
+def check_order(index: pd.DatetimeIndex, rep: Report, prev=None, level: str = "error"):
+    """Timestamp fuori ordine o duplicati. level="warning" per l'input grezzo
+    di uno stage che poi ordina e deduplica (clean): si contano, non bloccano."""
+    if len(index) == 0:
+        return
+    d, at = _steps(index, prev)
+    dup = d == 0
+    back = d < 0
+    if back.any():                  # non ordinato: anche i duplicati non adiacenti
+        dup |= index.duplicated()[len(index) - len(d):]
+        back &= ~dup
+    rep.flag("index_out_of_order", back, at, level=level)
+    rep.flag("index_duplicated", dup, at, level=level)
+
+
+def check_gaps(index: pd.DatetimeIndex, rep: Report, prev=None, max_gap=MAX_GAP):
+    """Statistiche dei gap (indice già ordinato) + primo/ultimo timestamp."""
+    if len(index) == 0:
+        return
+    d, at = _steps(index, prev)
+    pos = d[d > 0]
+    if len(pos):
+        step = int(np.median(pos))                 # barra tipica (1min per M1)
+        gaps = d > step
+        s = rep.stats
+        s["bar"] = str(pd.Timedelta(step))
+        s["gaps"] = s.get("gaps", 0) + int(np.count_nonzero(gaps))
+        big = int(d.max())
+        if big > pd.Timedelta(s.get("max_gap", "0s")).value:
+            s["max_gap"] = str(pd.Timedelta(big))
+            s["max_gap_at"] = str(at[int(d.argmax())])
+        rep.flag("gap_over_max", d > pd.Timedelta(max_gap).value, at, level="warning",
+                 max_gap=str(pd.Timedelta(max_gap)))
+    s = rep.stats
+    s.setdefault("first", str(index[0]))
+    s["last"] = str(index[-1])
+
+
+def check_label(labels: pd.Series, rep: Report, values=LABELS):
+    v = labels.to_numpy()
+    rep.flag("label_domain", ~np.isin(v, values), labels.index, values=list(values))
+    if len(v):
+        rep.stats["positives"] = round(float(np.mean(v == values[-1])), 4)
+
+
+def check_features(df: pd.DataFrame, features: list, rep: Report):
+    bad = np.zeros(len(df), dtype=bool)
+    per_col = {}
+    for c in features:
+        m = ~np.isfinite(df[c].to_numpy())
+        n = int(np.count_nonzero(m))
+        if n:
+            per_col[c] = n
+            bad |= m
+    rep.flag("features_not_finite", bad, df.index, columns=per_col)
+
+
+# ────────────────────────────────
+# 2️⃣  Entry point per gli stage
+# ────────────────────────────────
+def validate(df: pd.DataFrame, rep: Report, *, bars=False, label=False, features=(),
+             dtypes=None, prev=None, deep=False) -> Report:
+    """Esegue i controlli richiesti su tutte le righe di `df` e accumula in `rep`."""
+    t0 = time.perf_counter()
+    rep.rows += len(df)
+    if dtypes:
+        check_dtypes(df, dtypes, rep)
+    check_index(df.index, rep, prev)
+    if bars:
+        check_bars(df, rep)
+    if label:
+        check_label(df["Label"], rep)
+    if len(features):
+        check_features(df, list(features), rep)
+    if deep:
+        deep_validate(df, rep, bars=bars, label=label, features=features, dtypes=dtypes)
+    rep.secs += time.perf_counter() - t0
+    return rep
+
+
+def deep_validate(df: pd.DataFrame, rep: Report, *, bars=False, label=False,
+                  features=(), dtypes=None):
+    """Schema Pandera completo (lento): tipi + check per colonna su tutte le righe."""
+    import pandera as pa
+    from pandera import Column, DataFrameSchema, Check
+
+    dtypes = dtypes or {}
+    cols = {}
+    if bars:
+        cols.update({c: Column(dtypes.get(c), Check(lambda s: s.notna())) for c in PRICES})
+        if "Volume" in df.columns:
+            cols["Volume"] = Column(dtypes.get("Volume"), Check.ge(0), nullable=True)
+    if label:
+        cols["Label"] = Column(dtypes.get("Label"), Check.isin(list(LABELS)))
+    cols.update({c: Column(dtypes.get(c), Check(lambda s: s.notna())) for c in features})
+    try:
+        DataFrameSchema(cols).validate(df, lazy=True)
+    except pa.errors.SchemaErrors as e:
+        fc = e.failure_cases
+        rep.errors["pandera"] = dict(count=len(fc), first=[
+            f"{r.column}: {r.check} ({r.failure_case})" for r in fc.head(EXAMPLES).itertuples()])
+
+
+def report_path(stage: str, symbol: str = None) -> Path:
+    return REPORT_DIR / (f"{stage}_{symbol}.json" if symbol else f"{stage}.json")
+
+
+def finish(rep: Report, logger, path=None) -> bool:
+    """Logga il riepilogo e salva il report JSON; ritorna rep.ok."""
+    path = Path(path) if path else report_path(rep.stage, rep.symbol)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(rep.to_dict(), f, indent=2)
+    for name, w in rep.warnings.items():
+        logger.warning(f"Validazione: {name} × {w['count']:,} (es. {w['first'][:2]})")
+    if not rep.ok:
+        for name, e in rep.errors.items():
+            info = {k: v for k, v in e.items() if k not in ("count", "first")}
+            logger.error(f"Validazione: {name} × {e['count']:,} (es. {e['first'][:3]})"
+                         + (f" {info}" if info else ""))
+        logger.error(f"⚠️  Validazione {rep.stage} fallita su {rep.rows:,} righe → {path}")
+        return False
+    rate = rep.rows / max(rep.secs, 1e-9)
+    logger.info(f"Validazione {rep.rows:,} righe ✅ OK in {rep.secs * 1000:.0f} ms "
+                f"({rate:,.0f} righe/s, gap {rep.stats.get('gaps', 0):,}) → {path}")
+    return True
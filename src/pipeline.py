@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Orchestratore multi-simbolo: clean → label → features → split → train →
+onnx per ogni simbolo, su un pool di processi; filter (trend MA) è un ramo
+laterale di label: nessuno stage legge il suo output, quindi non entra
+nelle chiavi di cache a valle e se fallisce la catena prosegue.
+
+  • ogni stage è importato una volta per worker e chiamato come funzione
+    (parse_args(argv) + main(args)): niente 7 × N avvii di python che
+    re-importano pandas/lightgbm
+  • un simbolo = una catena sequenziale; i simboli girano in parallelo
+    (--workers), i thread LightGBM vengono divisi fra i worker
+  • cache: chiave = sha256(stage + argv + sorgenti dello stage + contenuto
+    degli input). Se la chiave coincide con quella dell'ultimo run riuscito
+    e gli output esistono, lo stage viene saltato. Gli hash dei file sono
+    memorizzati per (size, mtime) → un run tutto in cache non rilegge i dati
+  • stato incrementale e cache separati per simbolo (data/state/<S>_*.json):
+    i worker non scrivono mai lo stesso file
+  • a fine run: tabella tempo / picco RSS per stage e logs/pipeline_summary.json;
+    i sotto-step degli stage finiscono in logs/metrics.jsonl con lo stesso
+    RUN_ID (utils/profiling.py compare per confrontare due run)
+  • --mmap-cache DIR: gli stage leggono i parquet da una cache Arrow IPC
+    memory-mapped (pagine condivise fra stage e worker, niente decodifica)
+
+Uso:
+  python src/pipeline.py --symbols EURUSD GBPUSD USDJPY --workers 3
+  python src/pipeline.py --symbols EURUSD --stages label features --force
+  python src/pipeline.py --symbols EURUSD --extra "label=--tp 0.002 --sl 0.002"
+"""
+
+import argparse, glob, hashlib, importlib, json, os, shlex, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent
+sys.path.insert(0, str(SRC))  # src/ nel path
+from utils.logger import setup_logging
+from utils.profiling import reset_peak_rss, peak_rss_mb, run_id
+
+L = setup_logging("pipeline")
+
+STAGES = ("clean", "label", "filter", "features", "split", "train", "onnx")
+# stage → stage da cui legge (DAG): uno stage salta solo se il suo upstream fallisce
+UPSTREAM = {"clean": None, "label": "clean", "filter": "label", "features": "label",
+            "split": "features", "train": "split", "onnx": "train"}
+SUMMARY_PATH = Path("logs/pipeline_summary.json")
+
+
+# ────────────────────────────────
+# 1️⃣  DAG: modulo, sorgenti, input/output per simbolo
+# ────────────────────────────────
+def paths(symbol: str, args) -> dict:
+    data, models = Path(args.data_dir), Path(args.models_dir)
+    if args.source == "ticks":
+        raw = str(Path(args.raw_dir) / "ticks" / symbol / "*.csv")
+    else:
+        raw = str(Path(args.raw_dir) / f"{symbol}_M1.csv")
+    return dict(
+        raw=raw,
+        clean=data / "processed" / f"{symbol}_M1_clean.parquet",
+        labeled=data / "processed" / f"{symbol}_M1_labeled.parquet",
+        filtered=data / "processed" / f"{symbol}_M1_filtered.parquet",
+        features=data / "feature_store" / f"{symbol}_M1_features.parquet",
+        spec=data / "feature_store" / f"{symbol}_feature_spec.json",
+        splits=data / "splits" / symbol,
+        model=models / symbol / "checkpoints" / "lgbm_model.pkl",
+        onnx=models / symbol / "onnx" / "lgbm_model.onnx",
+        state=data / "state" / f"{symbol}_state.json",
+        cache=data / "state" / "cache" / f"{symbol}.json",
+    )
+
+
+def stage_plan(stage: str, symbol: str, P: dict, args):
+    """(modulo, argv, input, output, sorgenti) di uno stage per un simbolo."""
+    inc = ["--incremental"] if args.incremental else []
+    common = ["--symbol", symbol, "--state", str(P["state"])] + inc
+    store_src = ["etl/store.py", "utils/logger.py"]
+    if stage == "clean":
+        if args.source == "ticks":
+            argv = ["--input", P["raw"], "--output", str(P["clean"]),
+                    "--symbol", symbol, "--state", str(P["state"])]
+            return ("etl.aggregate_ticks", argv, sorted(glob.glob(P["raw"])), [P["clean"]],
+                    ["etl/aggregate_ticks.py"] + store_src)
+        argv = ["--input", P["raw"], "--output", str(P["clean"])] + common
+        return ("etl.clean", argv, [P["raw"]], [P["clean"]],
+                ["etl/clean.py", "etl/validate.py"] + store_src)
+    if stage == "label":
+        argv = ["--input", str(P["clean"]), "--output", str(P["labeled"])] + common
+        return ("etl.label", argv, [P["clean"]], [P["labeled"]],
+                ["etl/label.py", "etl/labeling.py", "etl/validate.py"] + store_src)
+    if stage == "filter":
+        argv = ["--input", str(P["labeled"]), "--output", str(P["filtered"])] + common
+        return ("etl.filter_trend", argv, [P["labeled"]], [P["filtered"]],
+                ["etl/filter_trend.py", "etl/features.py"] + store_src)
+    if stage == "features":
+        argv = ["--input", str(P["labeled"]), "--output", str(P["features"]),
+                "--spec", str(P["spec"])] + common
+        return ("etl.feature_engineering", argv, [P["labeled"]], [P["features"], P["spec"]],
+                ["etl/feature_engineering.py", "etl/features.py", "etl/normalize.py",
+                 "etl/validate.py"] + store_src)
+    if stage == "split":
+        argv = ["--input", str(P["features"]), "--outdir", str(P["splits"])] + common
+        return ("etl.split", argv, [P["features"]], [P["splits"]], ["etl/split.py"] + store_src)
+    if stage == "train":
+        argv = ["--splits", str(P["splits"]), "--out", str(P["model"]),
+                "--spec", str(P["spec"]), "--threads", str(args.threads),
+                "--symbol", symbol, "--state", str(P["state"])]
+        return ("train.train_lgbm", argv, [P["splits"], P["spec"]], [P["model"]],
+                ["train/train_lgbm.py", "etl/features.py", "utils/logger.py"])
+    if stage == "onnx":
+        argv = ["--model", str(P["model"]), "--output", str(P["onnx"])]
+        spec = P["model"].parent / "feature_spec.json"
+        return ("train.convert_to_onnx", argv, [P["model"], spec], [P["onnx"]],
+                ["train/convert_to_onnx.py", "etl/features.py", "utils/logger.py"])
+    raise ValueError(f"Stage sconosciuto: {stage}")
+
+
+# ────────────────────────────────
+# 2️⃣  Hash contenuti + cache
+# ────────────────────────────────
+def file_hash(path: Path, memo: dict) -> str:
+    """sha256 del file, ricalcolato solo se size/mtime sono cambiati."""
+    st = path.stat()
+    key = str(path.resolve())
+    hit = memo.get(key)
+    if hit and hit[0] == st.st_size and hit[1] == st.st_mtime_ns:
+        return hit[2]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    memo[key] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+    return memo[key][2]
+
+
+def content_hash(path: Path, memo: dict) -> str:
+    """Hash di un file o di una directory (dataset hive, splits) file per file."""
+    path = Path(path)
+    if not path.exists():
+        return "missing"
+    if path.is_file():
+        return file_hash(path, memo)
+    h = hashlib.sha256()
+    for f in sorted(p for p in path.rglob("*") if p.is_file()):
+        h.update(str(f.relative_to(path)).encode())
+        h.update(file_hash(f, memo).encode())
+    return h.hexdigest()
+
+
+def stage_key(stage: str, argv: list, inputs: list, sources: list, memo: dict) -> str:
+    h = hashlib.sha256(json.dumps([stage, argv]).encode())
+    for s in sources:
+        h.update(file_hash(SRC / s, memo).encode())
+    for p in inputs:
+        h.update(content_hash(p, memo).encode())
+    return h.hexdigest()
+
+
+def load_cache(path: Path) -> dict:
+    if path.exists():
+        with open(path) as f:
+            return json.load(f)
+    return {"stages": {}, "files": {}}
+
+
+def save_cache(cache: dict, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(cache, f, indent=1)
+    os.replace(tmp, path)
+
+
+# ────────────────────────────────
+# 3️⃣  Catena di un simbolo (gira in un worker)
+# ────────────────────────────────
+def run_symbol(symbol: str, args) -> list:
+    P = paths(symbol, args)
+    for k in ("clean", "labeled", "features", "state"):
+        Path(P[k]).parent.mkdir(parents=True, exist_ok=True)
+    cache = load_cache(P["cache"])
+    memo = cache["files"]
+    results, failed = [], set()
+
+    for stage in STAGES:
+        if stage not in args.stages:
+            continue
+        row = dict(symbol=symbol, stage=stage, status="", secs=0.0, rss_mb=None)
+        results.append(row)
+        if UPSTREAM[stage] in failed:
+            row["status"] = "skipped"
+            failed.add(stage)
+            continue
+        module, argv, inputs, outputs, sources = stage_plan(stage, symbol, P, args)
+        argv = argv + shlex.split(args.extra.get(stage, ""))
+        if not inputs or any(not Path(p).exists() for p in inputs):
+            L.error(f"[{symbol}] {stage}: input mancanti {[str(p) for p in inputs]}")
+            row["status"] = "failed"
+            failed.add(stage)
+            continue
+
+        key = stage_key(stage, argv, inputs, sources, memo)
+        if (not args.force and cache["stages"].get(stage) == key
+                and all(Path(p).exists() for p in outputs)):
+            row["status"] = "cached"
+            L.info(f"[{symbol}] {stage}: in cache")
+            continue
+
+        L.info(f"[{symbol}] {stage}: {module} {' '.join(argv)}")
+        exact = reset_peak_rss()
+        t0 = time.perf_counter()
+        try:
+            mod = importlib.import_module(module)
+            mod.main(mod.parse_args(argv))
+            row["status"] = "ok"
+        except SystemExit as e:
+            row["status"] = "ok" if e.code in (None, 0) else "failed"
+        except Exception as e:
+            L.exception(f"[{symbol}] {stage}: {e}")
+            row["status"] = "failed"
+        row["secs"] = time.perf_counter() - t0
+        row["rss_mb"] = peak_rss_mb()
+        row["rss_exact"] = exact
+
+        if row["status"] == "ok":
+            cache["stages"][stage] = key
+        else:
+            cache["stages"].pop(stage, None)
+            failed.add(stage)
+        save_cache(cache, P["cache"])
+    return results
+
+
+# ────────────────────────────────
+# 4️⃣  Main
+# ────────────────────────────────
+def parse_extra(items) -> dict:
+    extra = {}
+    for item in items or ():
+        stage, _, argv = item.partition("=")
+        if stage not in STAGES:
+            raise SystemExit(f"--extra: stage sconosciuto {stage!r} (attesi {STAGES})")
+        extra[stage] = (extra.get(stage, "") + " " + argv).strip()
+    return extra
+
+
+def print_summary(rows: list, wall: float):
+    L.info(f"{'symbol':<10}{'stage':<10}{'status':<9}{'secs':>9}{'peak RSS MB':>13}")
+    for r in rows:
+        rss = f"{r['rss_mb']:,.0f}" if r["rss_mb"] is not None else "-"
+        L.info(f"{r['symbol']:<10}{r['stage']:<10}{r['status']:<9}{r['secs']:>9.2f}{rss:>13}")
+    for stage in STAGES:
+        done = [r for r in rows if r["stage"] == stage and r["status"] == "ok"]
+        if done:
+            L.info(f"  {stage:<9} eseguiti {len(done)}  tempo tot {sum(r['secs'] for r in done):.1f}s  "
+                   f"picco RSS {max(r['rss_mb'] for r in done):,.0f} MB")
+    L.info(f"Wall time totale: {wall:.1f}s")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Pipeline multi-simbolo con cache degli stage")
+    p.add_argument("--symbols", nargs="+", default=["EURUSD"])
+    p.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES),
+                   help="Stage da eseguire (default: tutti)")
+    p.add_argument("--source", choices=("csv", "ticks"), default="csv",
+                   help="csv: <raw-dir>/<S>_M1.csv (clean.py) • "
+                        "ticks: <raw-dir>/ticks/<S>/*.csv (aggregate_ticks.py)")
+    p.add_argument("--raw-dir", default="data/raw")
+    p.add_argument("--data-dir", default="data")
+    p.add_argument("--models-dir", default="models")
+    p.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                   help="Simboli in parallelo")
+    p.add_argument("--threads", type=int, default=0,
+                   help="Thread LightGBM per simbolo (0 = cpu / workers)")
+    p.add_argument("--incremental", action="store_true",
+                   help="Passa --incremental agli stage ETL")
+    p.add_argument("--force", action="store_true", help="Ignora la cache")
+    p.add_argument("--extra", action="append", metavar="STAGE=ARGS",
+                   help='Argomenti extra per uno stage, es. "label=--tp 0.002 --sl 0.002"')
+    p.add_argument("--mmap-cache", default=None, metavar="DIR",
+                   help="Cache Arrow IPC memory-mapped per le letture degli stage (etl/store.py)")
+    return p.parse_args(argv)
+
+
+def main(args):
+    args.extra = parse_extra(args.extra)
+    run = run_id()                     # in env: condiviso da stage e worker
+    if args.mmap_cache:
+        os.environ["ETL_MMAP_CACHE"] = args.mmap_cache   # store.CACHE_ENV, ereditata dai worker
+    workers = max(1, min(args.workers, len(args.symbols)))
+    if not args.threads:
+        args.threads = max(1, (os.cpu_count() or 1) // workers)
+    L.info(f"Simboli: {len(args.symbols)}  stage: {' → '.join(args.stages)}  "
+           f"worker: {workers}  thread LightGBM: {args.threads}")
+
+    t0 = time.perf_counter()
+    rows = []
+    if workers == 1:
+        for s in args.symbols:
+            rows += run_symbol(s, args)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            for res in ex.map(run_symbol, args.symbols, [args] * len(args.symbols)):
+                rows += res
+    wall = time.perf_counter() - t0
+
+    print_summary(rows, wall)
+    SUMMARY_PATH.parent.mkdir(exist_ok=True)
+    with open(SUMMARY_PATH, "w") as f:
+        json.dump(dict(run=run, wall_secs=wall, workers=workers, stages=rows), f, indent=2)
+    failed = sorted({r["symbol"] for r in rows if r["status"] == "failed"})
+    if failed:
+        L.error(f"⚠️  Simboli con errori: {failed}")
+        sys.exit(1)
+    L.info(f"✅ Pipeline completata → {SUMMARY_PATH}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -1,18 +1,71 @@
 #!/usr/bin/env python3
-import joblib, onnxmltools, os, pathlib, logging, sys
-from onnxmltools.convert.common.data_types import FloatTensorType
-logging.basicConfig(level=logging.INFO, format="%(message)s")
-
-MODEL = "models/checkpoints/lgbm_model.pkl"
-ONNX  = "models/onnx/lgbm_model.onnx"
-
-if not os.path.exists(MODEL):
-    logging.error("⚠️  .pkl non trovato, run train_lgbm.py prima.")
-    sys.exit(1)
-
-model = joblib.load(MODEL)
-initial = [("float_input", FloatTensorType([None,4]))]
-onnx = onnxmltools.convert_lightgbm(model, initial_types=initial)
-pathlib.Path("models/onnx").mkdir(parents=True, exist_ok=True)
-onnxmltools.utils.save_model(onnx, ONNX)
-logging.info(f"✅ ONNX salvato: {ONNX}")
\ No newline at end of file
+import argparse, os, pathlib, shutil, sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))  # src/ nel path
+from etl.features import load_spec
+from utils.logger import setup_logging
+from utils.profiling import profiled, lap
+
+L = setup_logging("convert")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="LightGBM .pkl → ONNX (+ spec feature)")
+    p.add_argument("--model",  default="models/checkpoints/lgbm_model.pkl")
+    p.add_argument("--output", default="models/onnx/lgbm_model.onnx")
+    p.add_argument("--spec",   default=None,
+                   help="Spec feature (default: feature_spec.json accanto al .pkl, "
+                        "copiato da train_lgbm.py)")
+    p.add_argument("--registry", default=None,
+                   help="Registry modelli (deploy/registry.py): pubblica onnx + spec + pkl + metriche")
+    p.add_argument("--pointer", choices=("none", "candidate", "production"), default="candidate",
+                   help="Puntatore da spostare sulla versione pubblicata (--registry)")
+    return p.parse_args(argv)
+
+
+@profiled("onnx")
+def main(args):
+    if not os.path.exists(args.model):
+        L.error("⚠️  .pkl non trovato, run train_lgbm.py prima.")
+        sys.exit(1)
+    spec_in = args.spec or str(pathlib.Path(args.model).parent / "feature_spec.json")
+    out_dir = pathlib.Path(args.output).parent
+    spec_out = out_dir / "feature_spec.json"          # letto dal gateway
+
+    import joblib, onnxmltools                       # import pesanti solo qui
+    from onnxmltools.convert.common.data_types import FloatTensorType
+    model = joblib.load(args.model)
+    n_feat = model.num_feature()
+    spec = load_spec(spec_in) if os.path.exists(spec_in) else None
+    if spec is None:
+        L.warning(f"⚠️  Spec feature non trovato ({spec_in}): /predict_bars non disponibile")
+    elif len(spec["features"]) != n_feat:
+        L.error(f"⚠️  Spec con {len(spec['features'])} feature, modello con {n_feat}")
+        sys.exit(1)
+    initial = [("float_input", FloatTensorType([None, n_feat]))]
+    # zipmap=False → "probabilities" è un tensore [N,2], niente lista di dict da
+    # convertire in Python a ogni richiesta del gateway
+    lap("load")
+    onnx = onnxmltools.convert_lightgbm(model, initial_types=initial, zipmap=False)
+    lap("convert")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tmp = pathlib.Path(args.output).with_suffix(".onnx.tmp")
+    onnxmltools.utils.save_model(onnx, str(tmp))
+    os.replace(tmp, args.output)                      # mai un .onnx scritto a metà
+    L.info(f"✅ ONNX salvato: {args.output}")
+    if spec is not None:
+        shutil.copyfile(spec_in, spec_out)
+        L.info(f"✅ Spec feature copiato: {spec_out} (hash {spec['hash']})")
+    if args.registry:
+        from deploy import registry
+        v = registry.publish(args.output, spec_out if spec is not None else None,
+                             args.registry, pkl=args.model)
+        L.info(f"✅ Registry {args.registry}: versione {v}")
+        if args.pointer != "none":
+            registry.set_pointer(args.registry, args.pointer, v, reason="convert_to_onnx")
+            L.info(f"→ {args.pointer} = {v}")
+        lap("publish")
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -1,63 +1,251 @@
 #!/usr/bin/env python3
 """
 Train LightGBM binario con monitor AUC e early stopping. Salva .pkl.
+Le colonne di input arrivano dallo spec feature (feature_engineering.py),
+copiato accanto al modello per convert_to_onnx.py.
+
+--cv walk-forward | purged: stima dell'AUC su più fold di train+valid
+(il test resta fuori), con purge/embargo di H barre attorno al blocco di
+validazione (le label guardano H barre avanti → righe adiacenti si
+sovrappongono). Il Dataset binnato è costruito una volta sola, i fold ne
+usano dei subset; i fold girano in parallelo su thread (LightGBM rilascia
+il GIL) con num_threads diviso fra i job. L'early stopping di ogni fold
+usa la coda del suo train (--cv-stop, staccata di `embargo` righe), il
+blocco di validazione viene solo misurato all'iterazione scelta lì: la
+stima non è ottimizzata sul blocco che la misura. Il modello salvato resta
+quello del split train/valid fisso.
+
+lightgbm e joblib sono importati solo quando servono: --help e il worker
+(src/worker.py) non pagano il loro import (~1s con sklearn/scipy).
 """
 
-import argparse, logging, os, sys
+import argparse, os, shutil, sys, time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import pandas as pd, lightgbm as lgb, joblib, json
+import numpy as np
+import pandas as pd, json
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/ nel path
+from etl import store
+from etl.features import load_spec, SPEC_PATH
+from utils.logger import setup_logging
+from utils.profiling import profiled, lap
 
 # Logging
-LOG_DIR = Path("logs"); LOG_DIR.mkdir(exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_DIR / "train.log"),
-        logging.StreamHandler(sys.stdout)
-    ],
-)
-L = logging.getLogger("train")
+L = setup_logging("train")
+
+# parametri di binning: vanno al Dataset, non a lgb.train
+DATASET_PARAMS = ("max_bin", "max_bin_by_feature", "min_data_in_bin", "feature_pre_filter",
+                  "bin_construct_sample_cnt")
 
 # CLI
-p = argparse.ArgumentParser(description="Train LightGBM")
-p.add_argument("--splits", default="data/splits")
-p.add_argument("--out",    default="models/checkpoints/lgbm_model.pkl")
-p.add_argument("--metric", default="auc")
-args = p.parse_args()
-
-# Percorsi
-SPL  = Path(args.splits)
-TRAIN = SPL/"train.parquet"; VALID = SPL/"valid.parquet"
-if not TRAIN.exists() or not VALID.exists():
-    L.error("⚠️  train/valid parquet mancano, run split.py prima.")
-    sys.exit(1)
-
-# Carica
-FEAT = ["HL_range","OC_change","Body_pct","Volume_log"]
-train = pd.read_parquet(TRAIN)
-valid = pd.read_parquet(VALID)
-dtrain = lgb.Dataset(train[FEAT], label=train["Label"])
-dvalid = lgb.Dataset(valid[FEAT], label=valid["Label"])
-
-params = dict(objective="binary", metric=args.metric,
-              learning_rate=0.02, num_leaves=31, verbose=-1)
-
-model = lgb.train(params, dtrain,
-                  num_boost_round=1000,
-                  valid_sets=[dtrain, dvalid],
-                  valid_names=["train","valid"],
-                  early_stopping_rounds=50,
-                  callbacks=[lgb.log_evaluation(period=50)])
-
-Path(args.out).parent.mkdir(parents=True, exist_ok=True)
-joblib.dump(model, args.out)
-L.info(f"✅ Modello salvato: {args.out}")
-
-# Salva metriche JSON
-metrics = dict(best_iter=model.best_iteration,
-               best_score=model.best_score["valid"][args.metric])
-Path("models/checkpoints").mkdir(parents=True, exist_ok=True)
-with open("models/checkpoints/metrics.json","w") as f:
-    json.dump(metrics,f,indent=2)
-L.info(f"AUC valido: {metrics['best_score']:.4f}")
\ No newline at end of file
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Train LightGBM")
+    p.add_argument("--splits", default="data/splits")
+    p.add_argument("--out",    default="models/checkpoints/lgbm_model.pkl")
+    p.add_argument("--metric", default="auc")
+    p.add_argument("--spec",   default=str(SPEC_PATH), help="Spec feature (feature_engineering.py)")
+    p.add_argument("--threads", type=int, default=0, help="Thread LightGBM (0 = default)")
+    p.add_argument("--params", default=None,
+                   help="JSON con iperparametri (es. best_params.json di tune_lgbm.py)")
+    p.add_argument("--cv", choices=("none", "walk-forward", "purged"), default="none",
+                   help="Validazione a fold su train+valid")
+    p.add_argument("--folds", type=int, default=5, help="Numero di fold (--cv)")
+    p.add_argument("--embargo", type=int, default=None,
+                   help="Barre di purge/embargo (default: horizon di label.py dallo stato, o 20)")
+    p.add_argument("--cv-stop", type=float, default=0.2,
+                   help="Quota finale del train di ogni fold per l'early stopping (--cv)")
+    p.add_argument("--jobs", type=int, default=0,
+                   help="Fold in parallelo (0 = min(fold, core))")
+    p.add_argument("--symbol", default="EURUSD", help="Simbolo (horizon dallo stato)")
+    p.add_argument("--state", default=str(store.STATE_PATH), help="File stato pipeline")
+    return p.parse_args(argv)
+
+
+# ────────────────────────────────
+# Fold purged / walk-forward
+# ────────────────────────────────
+def cv_folds(n: int, k: int, scheme: str, embargo: int):
+    """Indici (train, valid) per fold, righe in ordine temporale.
+
+    walk-forward: k+1 blocchi, il fold i allena sui blocchi 0..i e valida
+      sul blocco i+1; le ultime `embargo` righe di train vengono scartate.
+    purged: k blocchi, il fold i valida sul blocco i e allena sugli altri,
+      tolte le `embargo` righe prima (label che finiscono nel valid) e dopo
+      (embargo) il blocco di validazione.
+    """
+    if scheme == "walk-forward":
+        edges = np.linspace(0, n, k + 2).astype(int)
+        for i in range(k):
+            lo, hi = edges[i + 1], edges[i + 2]
+            yield np.arange(0, max(lo - embargo, 0)), np.arange(lo, hi)
+    else:
+        edges = np.linspace(0, n, k + 1).astype(int)
+        idx = np.arange(n)
+        for i in range(k):
+            lo, hi = edges[i], edges[i + 1]
+            keep = (idx < lo - embargo) | (idx >= hi + embargo)
+            yield idx[keep], np.arange(lo, hi)
+
+
+def split_stop(tr: np.ndarray, frac: float, embargo: int):
+    """(fit, early stopping): l'ultima quota `frac` del train del fold, con
+    `embargo` righe scartate fra le due parti (label sovrapposte)."""
+    n_stop = int(len(tr) * frac)
+    return tr[:max(len(tr) - n_stop - embargo, 0)], tr[len(tr) - n_stop:]
+
+
+def stop_on(name: str, rounds: int):
+    """Early stopping guardando solo il valid set `name`; gli altri valid set
+    vengono riportati all'iterazione migliore di quello."""
+    import lightgbm as lgb
+    best = dict(iter=-1, score=None, results=None)
+
+    def _cb(env):
+        for data, _, value, higher in env.evaluation_result_list:
+            if data != name:
+                continue
+            if best["score"] is None or (value > best["score"] if higher else value < best["score"]):
+                best.update(iter=env.iteration, score=value, results=env.evaluation_result_list)
+            break
+        if env.iteration - best["iter"] >= rounds or env.iteration == env.end_iteration - 1:
+            raise lgb.callback.EarlyStopException(best["iter"], best["results"])
+    _cb.order = 30
+    return _cb
+
+
+def load_params(path: str) -> tuple:
+    """(parametri di training, parametri del Dataset) da un best_params.json.
+
+    Il binning con cui tune_lgbm.py ha scelto i parametri ("dataset", o
+    max_bin per i file più vecchi) deve essere lo stesso del training.
+    """
+    with open(path) as f:
+        best = json.load(f)
+    params = dict(best["params"])
+    ds = dict(best.get("dataset") or ({"max_bin": best["max_bin"]} if "max_bin" in best else {}))
+    for k in DATASET_PARAMS:
+        if k in params:
+            ds[k] = params.pop(k)
+    return params, ds
+
+
+def run_cv(args, params: dict, train: pd.DataFrame, valid: pd.DataFrame, FEAT: list,
+           ds_params: dict = None) -> dict:
+    import lightgbm as lgb
+    data = pd.concat([train, valid])
+    n = len(data)
+    embargo = args.embargo
+    if embargo is None:
+        embargo = store.get_stage(args.symbol, "label", args.state).get("horizon", 20)
+    jobs = args.jobs or min(args.folds, os.cpu_count() or 1)
+    threads = max(1, (args.threads or os.cpu_count() or 1) // jobs)
+    L.info(f"CV {args.cv}: {args.folds} fold su {n:,} righe, embargo {embargo} barre, "
+           f"{jobs} job × {threads} thread")
+
+    # binning una volta sola, i fold sono subset del Dataset costruito
+    t0 = time.perf_counter()
+    full = lgb.Dataset(data[FEAT], label=data["Label"], free_raw_data=False,
+                       params=dict(ds_params or {}, verbose=-1)).construct()
+    folds = []
+    for tr, va in cv_folds(n, args.folds, args.cv, embargo):
+        fit_idx, stop_idx = split_stop(tr, args.cv_stop, embargo)
+        if len(fit_idx) == 0 or len(stop_idx) == 0 or len(va) == 0:
+            continue
+        folds.append((fit_idx, va, full.subset(fit_idx).construct(),
+                      full.subset(stop_idx).construct(), full.subset(va).construct()))
+    L.info(f"Dataset binnato + {len(folds)} subset in {time.perf_counter() - t0:.1f}s")
+
+    fold_params = dict(params, num_threads=threads)
+    times = data.index
+
+    def fit(i):
+        tr, va, dtr, dstop, dva = folds[i]
+        t = time.perf_counter()
+        # il valid viene solo registrato: l'iterazione la sceglie il set di stop
+        m = lgb.train(fold_params, dtr, num_boost_round=1000, valid_sets=[dstop, dva],
+                      valid_names=["stop", "valid"], callbacks=[stop_on("stop", 50)])
+        return dict(fold=i, n_train=len(tr), n_stop=dstop.num_data(), n_valid=len(va),
+                    valid_start=str(times[va[0]]), valid_end=str(times[va[-1]]),
+                    best_iter=m.best_iteration,
+                    score=m.best_score["valid"][args.metric],
+                    secs=round(time.perf_counter() - t, 2))
+
+    with ThreadPoolExecutor(max_workers=jobs) as ex:
+        res = list(ex.map(fit, range(len(folds))))
+    for r in res:
+        L.info(f"  fold {r['fold']}: train {r['n_train']:,}  stop {r['n_stop']:,}  valid {r['n_valid']:,} "
+               f"({r['valid_start']} → {r['valid_end']})  {args.metric} {r['score']:.4f}  "
+               f"iter {r['best_iter']}  {r['secs']}s")
+    scores = np.array([r["score"] for r in res])
+    L.info(f"CV {args.metric}: {scores.mean():.4f} ± {scores.std(ddof=1) if len(scores) > 1 else 0:.4f}")
+    return dict(scheme=args.cv, folds=res, embargo=int(embargo), stop_frac=args.cv_stop,
+                mean=float(scores.mean()),
+                std=float(scores.std(ddof=1)) if len(scores) > 1 else 0.0,
+                best_iter_mean=float(np.mean([r["best_iter"] for r in res])),
+                secs=round(time.perf_counter() - t0, 2))
+
+
+@profiled("train")
+def main(args):
+    # Percorsi
+    SPL  = Path(args.splits)
+    TRAIN = SPL/"train.parquet"; VALID = SPL/"valid.parquet"
+    if not TRAIN.exists() or not VALID.exists():
+        L.error("⚠️  train/valid parquet mancano, run split.py prima.")
+        sys.exit(1)
+
+    # Carica
+    if not Path(args.spec).exists():
+        L.error(f"⚠️  Spec feature non trovato: {args.spec} (run feature_engineering.py)")
+        sys.exit(1)
+    spec = load_spec(args.spec)
+    FEAT = spec["features"]
+    L.info(f"Feature: {len(FEAT)} (spec {spec['hash']})")
+    train = pd.read_parquet(TRAIN, columns=FEAT + ["Label"])   # solo colonne usate
+    valid = pd.read_parquet(VALID, columns=FEAT + ["Label"])
+    lap("load", rows=len(train) + len(valid))
+
+    params = dict(objective="binary", metric=args.metric,
+                  learning_rate=0.02, num_leaves=31, verbose=-1)
+    ds_params = {}
+    if args.params:
+        tuned, ds_params = load_params(args.params)
+        params.update(tuned)
+        L.info(f"Iperparametri da {args.params}: {params}  Dataset: {ds_params}")
+    cv = run_cv(args, params, train, valid, FEAT, ds_params) if args.cv != "none" else None
+    if cv is not None:
+        lap("cv", rows=len(train) + len(valid))
+    if args.threads:
+        params["num_threads"] = args.threads
+
+    import joblib, lightgbm as lgb
+    dtrain = lgb.Dataset(train[FEAT], label=train["Label"], params=ds_params)
+    dvalid = lgb.Dataset(valid[FEAT], label=valid["Label"], reference=dtrain, params=ds_params)
+
+    model = lgb.train(params, dtrain,
+                      num_boost_round=1000,
+                      valid_sets=[dtrain, dvalid],
+                      valid_names=["train","valid"],
+                      callbacks=[lgb.early_stopping(50, verbose=False),
+                                 lgb.log_evaluation(period=50)])
+    lap("fit", rows=len(train))
+
+    Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump(model, args.out)
+    shutil.copyfile(args.spec, Path(args.out).parent / "feature_spec.json")
+    L.info(f"✅ Modello salvato: {args.out}")
+
+    # Salva metriche JSON (accanto al modello)
+    metrics = dict(best_iter=model.best_iteration,
+                   best_score=model.best_score["valid"][args.metric])
+    if cv is not None:
+        metrics["cv"] = cv
+    with open(Path(args.out).parent / "metrics.json","w") as f:
+        json.dump(metrics,f,indent=2)
+    L.info(f"AUC valido: {metrics['best_score']:.4f}")
+    lap("write")
+
+
+if __name__ == "__main__":
+    main(parse_args())
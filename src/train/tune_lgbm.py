@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Ricerca iperparametri LightGBM con Optuna.
+
+  • train/valid vengono letti e binnati una volta sola e salvati come
+    dataset binario LightGBM (save_binary) in una cache indicizzata da
+    hash di parquet + spec + max_bin: i trial caricano il .bin, niente
+    parquet né re-binning a ogni trial (né al resume)
+  • i trial girano in --workers processi, ognuno con --threads thread
+    LightGBM (default cpu / workers) → nessun oversubscription
+  • pruning: l'AUC `valid` intermedio viene riportato a Optuna ogni
+    --report-every iterazioni, i trial sotto la mediana vengono fermati
+  • studio su SQLite (--storage): rilanciando con lo stesso --study si
+    riprende la ricerca; i migliori parametri finiscono in --best-out,
+    da passare a train_lgbm.py --params
+
+I parametri di binning (max_bin) non si ottimizzano: sono fissati nel .bin.
+"""
+
+import argparse, hashlib, json, math, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+import pandas as pd, lightgbm as lgb
+import optuna
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/ nel path
+from etl.features import load_spec, SPEC_PATH
+from utils.logger import setup_logging
+from utils.profiling import profiled, lap
+
+L = setup_logging("tune")
+
+HIGHER_BETTER = ("auc", "average_precision", "map", "ndcg")
+
+
+# ────────────────────────────────
+# CLI
+# ────────────────────────────────
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Tuning LightGBM (Optuna + pruning)")
+    p.add_argument("--splits", default="data/splits")
+    p.add_argument("--spec",   default=str(SPEC_PATH), help="Spec feature (feature_engineering.py)")
+    p.add_argument("--metric", default="auc")
+    p.add_argument("--study",  default="lgbm", help="Nome dello studio (resume se esiste)")
+    p.add_argument("--storage", default="sqlite:///models/tuning/optuna.db")
+    p.add_argument("--cache-dir", default="models/tuning/cache", help="Dataset binari LightGBM")
+    p.add_argument("--best-out", default="models/tuning/best_params.json")
+    p.add_argument("--trials",  type=int, default=50, help="Trial da eseguire in questo run")
+    p.add_argument("--timeout", type=float, default=None, help="Secondi massimi per worker")
+    p.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                   help="Processi in parallelo")
+    p.add_argument("--threads", type=int, default=0, help="Thread LightGBM per trial (0 = cpu / workers)")
+    p.add_argument("--max-bin", type=int, default=255)
+    p.add_argument("--rounds",  type=int, default=2000, help="Iterazioni massime per trial")
+    p.add_argument("--report-every", type=int, default=10, help="Passo dei report per il pruning")
+    p.add_argument("--seed", type=int, default=42)
+    return p.parse_args(argv)
+
+
+# ────────────────────────────────
+# Dataset binnato in cache
+# ────────────────────────────────
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def build_cache(args, spec: dict) -> Path:
+    """Binna train/valid una volta e li salva come .bin; ritorna la directory."""
+    SPL = Path(args.splits)
+    TRAIN, VALID = SPL / "train.parquet", SPL / "valid.parquet"
+    key = hashlib.sha256(json.dumps([_file_digest(TRAIN), _file_digest(VALID),
+                                     spec["hash"], args.max_bin]).encode()).hexdigest()[:16]
+    out = Path(args.cache_dir) / key
+    if (out / "train.bin").exists() and (out / "valid.bin").exists():
+        L.info(f"Dataset binario in cache: {out}")
+        return out
+
+    t0 = time.perf_counter()
+    FEAT = spec["features"]
+    train = pd.read_parquet(TRAIN, columns=FEAT + ["Label"])
+    valid = pd.read_parquet(VALID, columns=FEAT + ["Label"])
+    # feature_pre_filter=False: min_data_in_leaf resta ottimizzabile sul .bin
+    ds_params = dict(max_bin=args.max_bin, feature_pre_filter=False, verbose=-1)
+    dtrain = lgb.Dataset(train[FEAT], label=train["Label"], params=ds_params)
+    dvalid = lgb.Dataset(valid[FEAT], label=valid["Label"], reference=dtrain, params=ds_params)
+    out.mkdir(parents=True, exist_ok=True)
+    dtrain.save_binary(str(out / "train.bin"))
+    dvalid.save_binary(str(out / "valid.bin"))
+    L.info(f"Dataset binnato ({len(train):,} + {len(valid):,} righe) → {out} "
+           f"in {time.perf_counter() - t0:.1f}s")
+    return out
+
+
+# ────────────────────────────────
+# Trial
+# ────────────────────────────────
+def suggest(trial: optuna.Trial) -> dict:
+    return dict(
+        learning_rate=trial.suggest_float("learning_rate", 0.005, 0.2, log=True),
+        num_leaves=trial.suggest_int("num_leaves", 8, 256, log=True),
+        min_data_in_leaf=trial.suggest_int("min_data_in_leaf", 20, 2000, log=True),
+        feature_fraction=trial.suggest_float("feature_fraction", 0.4, 1.0),
+        bagging_fraction=trial.suggest_float("bagging_fraction", 0.4, 1.0),
+        bagging_freq=1,
+        lambda_l1=trial.suggest_float("lambda_l1", 1e-8, 10.0, log=True),
+        lambda_l2=trial.suggest_float("lambda_l2", 1e-8, 10.0, log=True),
+    )
+
+
+def make_pruner() -> optuna.pruners.BasePruner:
+    # il pruner non è salvato nello storage: ogni processo lo ricrea uguale
+    return optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=50)
+
+
+def pruning_callback(trial: optuna.Trial, metric: str, every: int):
+    """Riporta la metrica `valid` a Optuna e interrompe i trial poco promettenti."""
+    def _cb(env):
+        if (env.iteration + 1) % every:
+            return
+        for name, m, value, _ in env.evaluation_result_list:
+            if name == "valid" and m == metric:
+                trial.report(value, step=env.iteration + 1)
+                if trial.should_prune():
+                    raise optuna.TrialPruned(f"iter {env.iteration + 1}: {metric} {value:.4f}")
+    _cb.order = 30
+    return _cb
+
+
+def worker(args, cache: str, n_trials: int, seed: int) -> int:
+    """Un processo: carica i .bin una volta, poi esegue trial sullo studio condiviso."""
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    ds_params = dict(feature_pre_filter=False, verbose=-1)
+    dtrain = lgb.Dataset(str(Path(cache) / "train.bin"), params=ds_params).construct()
+    dvalid = lgb.Dataset(str(Path(cache) / "valid.bin"), reference=dtrain,
+                         params=ds_params).construct()
+    study = optuna.load_study(study_name=args.study, storage=args.storage,
+                              sampler=optuna.samplers.TPESampler(seed=seed),
+                              pruner=make_pruner())
+
+    def objective(trial):
+        params = dict(objective="binary", metric=args.metric, verbose=-1,
+                      num_threads=args.threads, seed=args.seed, **suggest(trial))
+        t0 = time.perf_counter()
+        model = lgb.train(params, dtrain, num_boost_round=args.rounds,
+                          valid_sets=[dvalid], valid_names=["valid"],
+                          callbacks=[lgb.early_stopping(50, verbose=False),
+                                     pruning_callback(trial, args.metric, args.report_every)])
+        score = model.best_score["valid"][args.metric]
+        trial.set_user_attr("best_iter", model.best_iteration)
+        L.info(f"trial {trial.number}: {args.metric} {score:.4f}  iter {model.best_iteration}  "
+               f"{time.perf_counter() - t0:.1f}s")
+        return score
+
+    study.optimize(objective, n_trials=n_trials, timeout=args.timeout, catch=())
+    return n_trials
+
+
+# ────────────────────────────────
+# Main
+# ────────────────────────────────
+@profiled("tune")
+def main(args):
+    SPL = Path(args.splits)
+    if not (SPL / "train.parquet").exists() or not (SPL / "valid.parquet").exists():
+        L.error("⚠️  train/valid parquet mancano, run split.py prima.")
+        sys.exit(1)
+    if not Path(args.spec).exists():
+        L.error(f"⚠️  Spec feature non trovato: {args.spec} (run feature_engineering.py)")
+        sys.exit(1)
+    spec = load_spec(args.spec)
+    workers = max(1, min(args.workers, args.trials))
+    if not args.threads:
+        args.threads = max(1, (os.cpu_count() or 1) // workers)
+
+    cache = build_cache(args, spec)
+    lap("cache")
+    if args.storage.startswith("sqlite:///"):
+        Path(args.storage[len("sqlite:///"):]).parent.mkdir(parents=True, exist_ok=True)
+    direction = "maximize" if args.metric in HIGHER_BETTER else "minimize"
+    study = optuna.create_study(
+        study_name=args.study, storage=args.storage, direction=direction,
+        load_if_exists=True, pruner=make_pruner())
+    done = len(study.trials)
+    L.info(f"Studio '{args.study}' ({args.storage}): {done} trial esistenti, "
+           f"+{args.trials} con {workers} worker × {args.threads} thread")
+
+    per_worker = math.ceil(args.trials / workers)
+    t0 = time.perf_counter()
+    if workers == 1:
+        worker(args, str(cache), args.trials, args.seed)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as ex:
+            futs = [ex.submit(worker, args, str(cache),
+                              min(per_worker, args.trials - i * per_worker), args.seed + i)
+                    for i in range(workers) if args.trials - i * per_worker > 0]
+            for f in futs:
+                f.result()
+
+    lap("trials", rows=args.trials)               # righe = trial
+    study = optuna.load_study(study_name=args.study, storage=args.storage)
+    states = pd.Series([t.state.name for t in study.trials]).value_counts().to_dict()
+    best = study.best_trial
+    L.info(f"Trial totali: {len(study.trials)} {states} in {time.perf_counter() - t0:.1f}s")
+    L.info(f"Migliore: trial {best.number}  {args.metric} {best.value:.4f}  {best.params}")
+
+    Path(args.best_out).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.best_out, "w") as f:
+        json.dump(dict(study=args.study, metric=args.metric, value=best.value,
+                       trial=best.number, best_iter=best.user_attrs.get("best_iter"),
+                       spec=spec["hash"], max_bin=args.max_bin,
+                       dataset=dict(max_bin=args.max_bin, feature_pre_filter=False),
+                       params=dict(best.params, bagging_freq=1)), f, indent=2)
+    L.info(f"✅ Parametri salvati: {args.best_out} (→ train_lgbm.py --params)")
+
+
+if __name__ == "__main__":
+    main(parse_args())
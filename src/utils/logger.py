@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Logging condiviso degli stage: logs/<file>.log + stdout, stesso formato
+di sempre. Un logger per stage (niente basicConfig globale), così più
+stage importati nello stesso processo (pipeline.py) scrivono ognuno
+nel proprio file.
+"""
+
+import logging, sys
+from pathlib import Path
+
+LOG_DIR = Path("logs")
+FORMAT  = "%(asctime)s [%(levelname)s] %(message)s"
+
+
+def setup_logging(name: str, filename: str = None, level=logging.INFO) -> logging.Logger:
+    """Logger `name` → LOG_DIR/<filename or name>.log + stdout (idempotente)."""
+    log = logging.getLogger(name)
+    if not log.handlers:
+        LOG_DIR.mkdir(exist_ok=True)
+        fmt = logging.Formatter(FORMAT)
+        for h in (logging.FileHandler(LOG_DIR / f"{filename or name}.log"),
+                  logging.StreamHandler(sys.stdout)):
+            h.setFormatter(fmt)
+            log.addHandler(h)
+        log.setLevel(level)
+        log.propagate = False
+    return log
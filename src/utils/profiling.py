@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Strumentazione condivisa di stage ETL, training e gateway.
+
+  • span temporizzati per sotto-step (load, compute, validate, write...):
+    wall, CPU, righe e righe/s, RSS corrente e picco RSS dello span
+    (VmHWM azzerato all'inizio di ogni span, Linux)
+  • un record JSON per span (+ "total" per lo stage) in append su
+    logs/metrics.jsonl (env METRICS_PATH); i record di un run condividono
+    `run` (env RUN_ID, impostato da pipeline.py per tutti gli stage)
+  • PROFILE_DIR=<dir>: cProfile dell'intero main → <dir>/<stage>_<S>_<run>.prof
+    (formato pstats: python -m pstats, snakeviz); per py-spy i record
+    riportano il pid
+  • confronto fra run per trovare regressioni:
+      python src/utils/profiling.py compare            # ultimi due run
+      python src/utils/profiling.py compare --base <run> --new <run> --threshold 0.2
+
+Uso negli script: main decorato con @profiled("label"), poi lap("load",
+rows=n) chiude il sotto-step iniziato al lap precedente; span("nome") come
+context manager per blocchi annidati. Senza profiler attivo sono no-op.
+"""
+
+import argparse, cProfile, functools, json, os, platform, resource, sys, time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+METRICS_PATH = Path(os.environ.get("METRICS_PATH", "logs/metrics.jsonl"))
+
+
+# ────────────────────────────────
+# 1️⃣  Memoria
+# ────────────────────────────────
+def _clear_refs() -> bool:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _status_mb(key: str):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(key):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+_carry = 0.0      # picco già visto prima dell'ultimo azzeramento interno
+
+
+def reset_peak_rss() -> bool:
+    """Azzera VmHWM del processo (Linux ≥ 4.0); False se non supportato."""
+    global _carry
+    _carry = 0.0
+    return _clear_refs()
+
+
+def peak_rss_mb() -> float:
+    """Picco RSS dall'ultimo reset_peak_rss(), anche se gli span hanno azzerato VmHWM."""
+    hwm = _status_mb("VmHWM:")
+    if hwm is None:   # fallback: picco dall'avvio del processo (non azzerabile)
+        hwm = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return max(_carry, hwm)
+
+
+def rss_mb():
+    mb = _status_mb("VmRSS:")
+    return round(mb, 1) if mb is not None else None
+
+
+def _span_reset():
+    global _carry
+    _carry = peak_rss_mb()
+    _clear_refs()
+
+
+# ────────────────────────────────
+# 2️⃣  Profiler
+# ────────────────────────────────
+def run_id() -> str:
+    rid = os.environ.get("RUN_ID")
+    if not rid:
+        rid = os.environ["RUN_ID"] = datetime.now().strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}"
+    return rid
+
+
+class Span:
+    def __init__(self, name: str, rows=None):
+        self.name, self.rows = name, rows
+        self.t0, self.c0 = time.perf_counter(), time.process_time()
+        self.peak = 0.0
+
+    def record(self) -> dict:
+        secs = time.perf_counter() - self.t0
+        self.peak = max(self.peak, _status_mb("VmHWM:") or peak_rss_mb())
+        rec = dict(span=self.name, secs=round(secs, 6),
+                   cpu_secs=round(time.process_time() - self.c0, 6),
+                   peak_rss_mb=round(self.peak, 1), rss_mb=rss_mb())
+        if self.rows is not None:
+            rec.update(rows=int(self.rows), rows_per_s=round(self.rows / max(secs, 1e-9), 1))
+        return rec
+
+
+class Profiler:
+    """Span di uno stage → record JSON lines in `path`."""
+
+    def __init__(self, stage: str, symbol: str = None, path=None):
+        self.stage, self.symbol = stage, symbol
+        self.path = Path(path or METRICS_PATH)
+        self.run = run_id()
+        self.stack, self.records = [], []
+        self.lap_span = None
+        self.total = Span("total")
+
+    def _base(self) -> dict:
+        return dict(ts=datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+                    run=self.run, stage=self.stage, symbol=self.symbol,
+                    host=platform.node(), pid=os.getpid())
+
+    def _open(self, name: str, rows=None) -> Span:
+        if self.stack:                             # il padre tiene il picco visto finora
+            self.stack[-1].peak = max(self.stack[-1].peak, _status_mb("VmHWM:") or 0.0)
+        _span_reset()
+        s = Span(name, rows)
+        self.stack.append(s)
+        return s
+
+    def _close(self, s: Span):
+        self.stack.remove(s)
+        rec = s.record()
+        if self.stack:
+            self.stack[-1].peak = max(self.stack[-1].peak, s.peak)
+        self.emit(**rec)
+
+    @contextmanager
+    def span(self, name: str, rows=None):
+        s = self._open(name, rows)
+        try:
+            yield s
+        finally:
+            self._close(s)
+
+    def start(self):
+        self.lap_span = self._open("")
+
+    def lap(self, name: str, rows=None):
+        """Chiude il sotto-step iniziato al lap precedente (o a start()) come `name`."""
+        s = self.lap_span
+        if s is not None and s in self.stack:
+            s.name, s.rows = name, rows
+            self._close(s)
+        self.lap_span = self._open("")
+
+    def emit(self, **fields):
+        """Scrive un record (span o metrica libera, es. latenze del gateway)."""
+        rec = {**self._base(), **fields}
+        self.records.append(rec)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:          # una write per riga: append atomico
+            f.write(json.dumps(rec) + "\n")
+
+    def close(self, status: str = "ok", rows=None):
+        if self.lap_span in self.stack:
+            self.stack.remove(self.lap_span)       # tempo dopo l'ultimo lap: solo nel total
+        self.total.rows = rows
+        self.total.peak = max(self.total.peak, peak_rss_mb())
+        self.emit(**self.total.record(), status=status)
+
+
+_CURRENT: list = []
+
+
+def current():
+    return _CURRENT[-1] if _CURRENT else None
+
+
+def lap(name: str, rows=None):
+    if _CURRENT:
+        _CURRENT[-1].lap(name, rows)
+
+
+@contextmanager
+def span(name: str, rows=None):
+    P = current()
+    if P is None:
+        yield None
+        return
+    with P.span(name, rows) as s:
+        yield s
+
+
+def profiled(stage: str):
+    """Decoratore per main(args): profiler attivo + record "total" (+ cProfile)."""
+    def deco(main):
+        @functools.wraps(main)
+        def wrapper(args, *a, **kw):
+            symbol = getattr(args, "symbol", None)
+            P = Profiler(stage, symbol)
+            _CURRENT.append(P)
+            reset_peak_rss()
+            P.start()
+            prof_dir = os.environ.get("PROFILE_DIR")
+            prof = cProfile.Profile() if prof_dir else None
+            status = "failed"
+            try:
+                if prof:
+                    prof.enable()
+                out = main(args, *a, **kw)
+                status = "ok"
+                return out
+            except SystemExit as e:
+                status = "ok" if e.code in (None, 0) else "failed"
+                raise
+            finally:
+                if prof:
+                    prof.disable()
+                    Path(prof_dir).mkdir(parents=True, exist_ok=True)
+                    name = "_".join(x for x in (stage, symbol, P.run) if x)
+                    prof.dump_stats(str(Path(prof_dir) / f"{name}.prof"))
+                P.close(status)
+                _CURRENT.remove(P)
+        return wrapper
+    return deco
+
+
+# ────────────────────────────────
+# 3️⃣  Confronto fra run
+# ────────────────────────────────
+def load_records(path=METRICS_PATH) -> list:
+    if not Path(path).exists():
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def runs(records: list) -> list:
+    """Run in ordine di prima apparizione."""
+    return list(dict.fromkeys(r["run"] for r in records if "secs" in r))
+
+
+def summarize_run(records: list, run: str) -> dict:
+    """(stage, symbol, span) → secs / peak RSS / rows/s (somme se lo span si ripete)."""
+    out = {}
+    for r in records:
+        if r["run"] != run or "secs" not in r:
+            continue
+        k = (r["stage"], r.get("symbol"), r["span"])
+        acc = out.setdefault(k, dict(secs=0.0, peak_rss_mb=0.0, rows=0))
+        acc["secs"] += r["secs"]
+        acc["peak_rss_mb"] = max(acc["peak_rss_mb"], r.get("peak_rss_mb") or 0.0)
+        acc["rows"] += r.get("rows") or 0
+    return out
+
+
+def compare(records: list, base: str, new: str, threshold: float = 0.2,
+            min_secs: float = 0.05) -> list:
+    """Righe di confronto; regression=True se il tempo cresce oltre `threshold`."""
+    a, b = summarize_run(records, base), summarize_run(records, new)
+    rows = []
+    for k in (k for k in a if k in b):           # ordine di esecuzione del run base
+        x, y = a[k], b[k]
+        ratio = y["secs"] / x["secs"] if x["secs"] > 0 else float("inf")
+        rows.append(dict(stage=k[0], symbol=k[1], span=k[2], base_secs=x["secs"],
+                         new_secs=y["secs"], ratio=ratio,
+                         base_rss=x["peak_rss_mb"], new_rss=y["peak_rss_mb"],
+                         regression=(ratio > 1 + threshold
+                                     and max(x["secs"], y["secs"]) >= min_secs)))
+    return rows
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Metriche per stage: confronto fra run")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    ls = sub.add_parser("runs", help="Elenca i run registrati")
+    ls.add_argument("--metrics", default=str(METRICS_PATH))
+    c = sub.add_parser("compare", help="Confronta due run (default: ultimi due)")
+    c.add_argument("--metrics", default=str(METRICS_PATH))
+    c.add_argument("--base", default=None)
+    c.add_argument("--new", default=None)
+    c.add_argument("--threshold", type=float, default=0.2, help="Rallentamento tollerato (0.2 = +20%%)")
+    c.add_argument("--min-secs", type=float, default=0.05, help="Ignora span più brevi")
+    return p.parse_args(argv)
+
+
+def main(args):
+    records = load_records(args.metrics)
+    ids = runs(records)
+    if args.cmd == "runs":
+        for rid in ids:
+            tot = [r for r in records if r["run"] == rid and r["span"] == "total"]
+            stages = sorted({r["stage"] for r in tot})
+            print(f"{rid}  {len(tot)} stage  {sum(r['secs'] for r in tot):8.2f}s  {' '.join(stages)}")
+        return
+    if len(ids) < 2 and not (args.base and args.new):
+        print(f"Servono almeno due run in {args.metrics} (trovati {len(ids)})")
+        sys.exit(1)
+    base, new = args.base or ids[-2], args.new or ids[-1]
+    rows = compare(records, base, new, args.threshold, args.min_secs)
+    print(f"base {base}  →  new {new}")
+    print(f"{'stage':<10}{'symbol':<9}{'span':<14}{'base s':>9}{'new s':>9}{'Δ%':>8}"
+          f"{'RSS base':>10}{'RSS new':>9}")
+    for r in rows:
+        mark = "  ⚠️ " if r["regression"] else ""
+        print(f"{r['stage']:<10}{str(r['symbol'] or '-'):<9}{r['span']:<14}"
+              f"{r['base_secs']:9.3f}{r['new_secs']:9.3f}{100 * (r['ratio'] - 1):+8.1f}"
+              f"{r['base_rss']:10.0f}{r['new_rss']:9.0f}{mark}")
+    bad = [r for r in rows if r["regression"]]
+    if bad:
+        print(f"Regressioni oltre +{100 * args.threshold:.0f}%: {len(bad)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(parse_args())
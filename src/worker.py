@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Worker residente: librerie e modello ONNX restano caricati fra un job e
+l'altro, i job arrivano su un socket locale.
+
+Per un refresh incrementale da cron l'avvio dell'interprete e l'import di
+pandas / pyarrow / lightgbm costano più del lavoro vero; col worker il
+client importa solo la stdlib e il job parte subito.
+
+  • serve: importa gli stage una volta (--preload), opzionale sessione
+    ONNX già pronta (--model), poi ascolta su un socket Unix
+    (data/state/worker.sock) o TCP locale (--address 127.0.0.1:8790)
+  • protocollo: una riga JSON per richiesta e una per risposta
+      {"op": "run", "stage": "label", "argv": [...], "cwd": ..., "env": {...}}
+      {"op": "predict", "model": "...onnx", "features": [[...], ...]}
+      {"op": "ping"} | {"op": "stop"}
+  • i job "run" girano uno alla volta (parse_args(argv) + main(args) come
+    pipeline.py) nella cwd del client, con RUN_ID proprio; i log degli
+    stage vanno in <cwd del client>/logs per la durata del job e dell'env
+    del client passano solo le variabili di JOB_ENV (os.environ non viene
+    mai svuotato: "predict" gira su altri thread); "predict" non aspetta i
+    job (sessione onnxruntime condivisa, ricaricata se il file cambia)
+  • il client esce con l'exit code del job; --fallback esegue il job nel
+    processo corrente se il worker non risponde
+
+Uso:
+  python src/worker.py serve --model models/onnx/lgbm_model.onnx &
+  python src/worker.py run label -- --incremental
+  python src/worker.py run pipeline -- --symbols EURUSD --incremental
+  python src/worker.py stop
+"""
+
+import argparse, importlib, json, logging, os, socket, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))  # src/ nel path
+
+ADDRESS = os.environ.get("WORKER_ADDRESS", "data/state/worker.sock")
+
+# job → modulo con parse_args(argv) + main(args)
+MODULES = {
+    "clean":    "etl.clean",
+    "ticks":    "etl.aggregate_ticks",
+    "label":    "etl.label",
+    "filter":   "etl.filter_trend",
+    "features": "etl.feature_engineering",
+    "split":    "etl.split",
+    "train":    "train.train_lgbm",
+    "tune":     "train.tune_lgbm",
+    "onnx":     "train.convert_to_onnx",
+    "score":    "deploy.batch_score",
+    "backtest": "backtest.run_backtest",
+    "pipeline": "pipeline",
+}
+PRELOAD = ("clean", "label", "filter", "features", "split", "train", "onnx", "pipeline")
+# variabili d'ambiente che valgono per un job (le altre restano quelle del worker)
+JOB_ENV = ("RUN_ID", "METRICS_PATH", "PROFILE_DIR", "ETL_MMAP_CACHE")
+
+
+def parse_address(address: str):
+    """"host:port" → TCP, altrimenti path del socket Unix."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, str(Path(address).resolve())
+
+
+# ────────────────────────────────
+# 1️⃣  Client (solo stdlib)
+# ────────────────────────────────
+def request(msg: dict, address: str = ADDRESS, timeout: float = None) -> dict:
+    family, addr = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(addr)
+        with s.makefile("rwb") as f:
+            f.write(json.dumps(msg).encode() + b"\n")
+            f.flush()
+            line = f.readline()
+    if not line:
+        raise ConnectionError(f"Worker {address}: connessione chiusa senza risposta")
+    return json.loads(line)
+
+
+def predict(X, model: str, address: str = ADDRESS) -> list:
+    """Predizioni dal modello tenuto caldo dal worker (lista di P(Label = 1))."""
+    r = request(dict(op="predict", model=str(Path(model).resolve()),
+                     features=[list(map(float, row)) for row in X]), address)
+    if r["status"] != "ok":
+        raise RuntimeError(r.get("error"))
+    return r["predictions"]
+
+
+# ────────────────────────────────
+# 2️⃣  Esecuzione dei job
+# ────────────────────────────────
+def _redirect_logs(log_dir: Path) -> list:
+    """FileHandler dei logger degli stage → log_dir; ritorna gli scambi da annullare.
+
+    setup_logging apre logs/<stage>.log all'import, cioè nella cwd del
+    worker al preload: senza scambio i log dei job finirebbero lì.
+    """
+    swaps = []
+    for log in list(logging.Logger.manager.loggerDict.values()):
+        if not isinstance(log, logging.Logger) or log.name == "worker":
+            continue
+        for h in [h for h in log.handlers if isinstance(h, logging.FileHandler)]:
+            log_dir.mkdir(parents=True, exist_ok=True)
+            new = logging.FileHandler(log_dir / Path(h.baseFilename).name)
+            new.setFormatter(h.formatter)
+            new.setLevel(h.level)
+            log.removeHandler(h)
+            log.addHandler(new)
+            swaps.append((log, h, new))
+    return swaps
+
+
+def _restore_logs(swaps: list):
+    for log, old, new in swaps:
+        log.removeHandler(new)
+        new.close()
+        log.addHandler(old)
+
+
+def run_job(job: dict) -> dict:
+    """Un job "run" nel processo corrente: cwd, log e JOB_ENV del client, RUN_ID nuovo.
+
+    Non è rientrante (cwd e variabili sono del processo): il server lo
+    chiama sotto job_lock.
+    """
+    from utils import profiling
+    from utils.logger import LOG_DIR
+    stage = job.get("stage")
+    if stage not in MODULES:
+        return dict(status="failed", exit=2, error=f"Job sconosciuto: {stage!r} (attesi {sorted(MODULES)})")
+    old_cwd, old_metrics = os.getcwd(), profiling.METRICS_PATH
+    old_env = {k: os.environ.get(k) for k in JOB_ENV}
+    env = job.get("env") or {}
+    swaps = []
+    t0 = time.perf_counter()
+    res = dict(stage=stage)
+    try:
+        os.chdir(job.get("cwd") or old_cwd)
+        swaps = _redirect_logs(LOG_DIR.resolve())
+        for k in JOB_ENV:                      # solo chiavi del job, mai clear()
+            if k in env:
+                os.environ[k] = str(env[k])
+            else:
+                os.environ.pop(k, None)
+        run = os.environ["RUN_ID"] = job.get("run") or f"{stage}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        res["run"] = run
+        profiling.METRICS_PATH = Path(os.environ.get("METRICS_PATH", "logs/metrics.jsonl"))
+        mod = importlib.import_module(MODULES[stage])
+        try:
+            mod.main(mod.parse_args(job.get("argv") or []))
+            res["exit"] = 0
+        except SystemExit as e:
+            res["exit"] = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception as e:
+        res.update(exit=1, error=f"{type(e).__name__}: {e}")
+    finally:
+        _restore_logs(swaps)
+        os.chdir(old_cwd)
+        for k, v in old_env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        profiling.METRICS_PATH = old_metrics
+    res.update(status="ok" if res["exit"] == 0 else "failed", secs=round(time.perf_counter() - t0, 4), rss_mb=profiling.rss_mb())
+    return res
+
+
+class Models:
+    """Sessioni ONNX per path, ricaricate se il file cambia (mtime/size)."""
+
+    def __init__(self, threads: int = 1):
+        self.threads, self.cache = threads, {}
+
+    def get(self, path: str):
+        from deploy.onnx_model import OnnxModel
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        hit = self.cache.get(path)
+        if hit is None or hit[0] != key:
+            hit = self.cache[path] = (key, OnnxModel(path, intra_threads=self.threads))
+        return hit[1]
+
+
+# ────────────────────────────────
+# 3️⃣  Server
+# ────────────────────────────────
+def serve(args):
+    import gc, signal, socketserver, threading
+    import numpy as np
+    from utils.logger import setup_logging
+    L = setup_logging("worker")
+
+    t0 = time.perf_counter()
+    for name in args.preload:
+        importlib.import_module(MODULES[name])
+    models = Models(args.threads)
+    if args.model:
+        m = models.get(str(Path(args.model).resolve()))
+        m.predict_proba(np.zeros((1, m.n_features), dtype=np.float32))    # warmup
+    L.info(f"Worker pronto in {time.perf_counter() - t0:.2f}s: {len(args.preload)} moduli"
+           + (f", modello {args.model}" if args.model else ""))
+
+    job_lock = threading.Lock()
+    stats = dict(jobs=0, failed=0, predict=0, started=time.time())
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                msg = {}
+                try:
+                    msg = json.loads(line)
+                    res = dispatch(msg)
+                except Exception as e:
+                    res = dict(status="failed", error=f"{type(e).__name__}: {e}")
+                self.wfile.write(json.dumps(res).encode() + b"\n")
+                self.wfile.flush()
+                if msg.get("op") == "stop":          # dopo la risposta al client
+                    threading.Thread(target=server.shutdown, daemon=True).start()
+
+    def dispatch(msg: dict) -> dict:
+        op = msg.get("op")
+        if op == "ping":
+            return dict(status="ok", pid=os.getpid(), busy=job_lock.locked(),
+                        uptime_s=round(time.time() - stats["started"], 1), **{
+                            k: v for k, v in stats.items() if k != "started"})
+        if op == "stop":
+            return dict(status="ok", jobs=stats["jobs"])
+        if op == "predict":
+            m = models.get(msg["model"])
+            X = np.asarray(msg["features"], dtype=np.float32).reshape(-1, m.n_features)
+            stats["predict"] += len(X)
+            return dict(status="ok", predictions=m.predict_proba(X).tolist())
+        if op == "run":
+            with job_lock:
+                L.info(f"Job {msg.get('stage')}: {' '.join(msg.get('argv') or [])}")
+                res = run_job(msg)
+                gc.collect()
+            stats["jobs"] += 1
+            stats["failed"] += res["status"] != "ok"
+            L.info(f"Job {res['stage']} → {res['status']} in {res['secs']:.2f}s"
+                   + (f" ({res['error']})" if res.get("error") else ""))
+            return res
+        return dict(status="failed", error=f"op sconosciuta: {op!r}")
+
+    family, addr = parse_address(args.address)
+    if family == socket.AF_UNIX:
+        if Path(addr).exists():
+            try:
+                request(dict(op="ping"), args.address, timeout=2)
+                L.error(f"⚠️  Worker già attivo su {addr}")
+                sys.exit(1)
+            except OSError:
+                Path(addr).unlink()          # socket rimasto da un worker terminato
+        Path(addr).parent.mkdir(parents=True, exist_ok=True)
+        base = socketserver.ThreadingUnixStreamServer
+    else:
+        base = socketserver.ThreadingTCPServer
+
+    class Server(base):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    server = Server(addr, Handler)
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    L.info(f"In ascolto su {addr} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if family == socket.AF_UNIX and Path(addr).exists():
+            Path(addr).unlink()
+        L.info(f"Worker fermato: {stats['jobs']} job ({stats['failed']} falliti), "
+               f"{stats['predict']:,} predizioni")
+
+
+# ────────────────────────────────
+# 4️⃣  CLI
+# ────────────────────────────────
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Worker residente per stage e predizioni")
+    p.add_argument("--address", default=ADDRESS,
+                   help="Socket Unix (path) o host:port TCP locale (env WORKER_ADDRESS)")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("serve", help="Avvia il worker")
+    s.add_argument("--preload", nargs="*", choices=sorted(MODULES), default=list(PRELOAD),
+                   help="Moduli importati all'avvio")
+    s.add_argument("--model", default=None, help="Modello ONNX da tenere caldo")
+    s.add_argument("--threads", type=int, default=1, help="Thread intra-op onnxruntime")
+    r = sub.add_parser("run", help="Esegue un job sul worker")
+    r.add_argument("stage", choices=sorted(MODULES))
+    r.add_argument("argv", nargs=argparse.REMAINDER, help="Argomenti dello stage (dopo --)")
+    r.add_argument("--fallback", action="store_true",
+                   help="Se il worker non risponde, esegue il job in questo processo")
+    r.add_argument("--timeout", type=float, default=None, help="Secondi massimi di attesa")
+    sub.add_parser("ping", help="Stato del worker")
+    sub.add_parser("stop", help="Ferma il worker")
+    return p.parse_args(argv)
+
+
+def main(args):
+    if args.cmd == "serve":
+        return serve(args)
+    try:
+        if args.cmd == "run":
+            argv = args.argv[1:] if args.argv[:1] == ["--"] else args.argv
+            job = dict(op="run", stage=args.stage, argv=argv, cwd=os.getcwd(),
+                       run=os.environ.get("RUN_ID"),
+                       env={k: v for k, v in os.environ.items() if k in JOB_ENV and k != "RUN_ID"})
+            try:
+                res = request(job, args.address, args.timeout)
+            except OSError as e:
+                if not args.fallback:
+                    raise
+                print(f"Worker non raggiungibile ({e}) → job eseguito in locale")
+                res = run_job(job)
+            mark = "✅" if res["status"] == "ok" else "❌"
+            print(f"{mark} {res['stage']} {res['status']} in {res['secs']:.2f}s (exit {res['exit']})"
+                  + (f": {res['error']}" if res.get("error") else ""))
+            sys.exit(res["exit"])
+        res = request(dict(op=args.cmd), args.address, timeout=5)
+        print(json.dumps(res))
+    except OSError as e:
+        print(f"⚠️  Worker non raggiungibile su {args.address}: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(parse_args())